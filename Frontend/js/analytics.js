@@ -0,0 +1,216 @@
+/**
+ * Analytics overlays module
+ * Draws the live histogram, clipping figures and focus peaking pushed by the server
+ *
+ * The server analyses the small lores stream (app/analytics.py) and sends
+ * compact results on the analytics.exposure event topic, so nothing here
+ * reads pixels from the preview. On by default; ?histogram=0 in the page URL
+ * turns it off (remembered in localStorage, ?histogram=1 turns it back on).
+ */
+
+const CHANNELS = [
+    ['y', 'rgba(255, 255, 255, 0.85)'],
+    ['r', 'rgba(255, 80, 80, 0.55)'],
+    ['g', 'rgba(80, 220, 80, 0.55)'],
+    ['b', 'rgba(90, 140, 255, 0.55)']
+];
+const WIDTH = 192;
+const HEIGHT = 72;
+
+export class ExposureAssist {
+    constructor() {
+        this.source = null;
+        this.element = null;
+        this.canvas = null;
+        this.context = null;
+        this.label = null;
+    }
+
+    /**
+     * Whether the histogram is wanted (default on)
+     */
+    static requested() {
+        const flag = new URLSearchParams(window.location.search).get('histogram');
+        if (flag !== null) localStorage.setItem('lancamHistogram', flag);
+        return localStorage.getItem('lancamHistogram') !== '0';
+    }
+
+    start() {
+        const preview = document.getElementById('cameraPreview');
+        if (!preview) return;
+        this.createElement(preview);
+        this.source = new EventSource('/api/events?topics=analytics.exposure');
+        this.source.addEventListener('analytics.exposure', (event) => {
+            this.draw(JSON.parse(event.data));
+        });
+        this.source.onerror = () => {
+            this.label.textContent = 'Histogram: reconnecting';
+        };
+    }
+
+    stop() {
+        if (this.source) this.source.close();
+        this.source = null;
+        if (this.element) this.element.remove();
+    }
+
+    createElement(preview) {
+        this.element = document.createElement('div');
+        this.element.className = 'exposure-assist';
+        this.element.style.cssText = `
+            position: absolute;
+            top: 12px;
+            right: 12px;
+            background: rgba(0, 0, 0, 0.6);
+            color: white;
+            padding: 6px;
+            border-radius: 8px;
+            font: 12px monospace;
+            z-index: 1000;
+            pointer-events: none;
+        `;
+        this.canvas = document.createElement('canvas');
+        this.canvas.width = WIDTH;
+        this.canvas.height = HEIGHT;
+        this.canvas.style.display = 'block';
+        this.context = this.canvas.getContext('2d');
+        this.label = document.createElement('div');
+        this.label.style.whiteSpace = 'pre';
+        this.label.textContent = 'Histogram: waiting for frames';
+        this.element.append(this.canvas, this.label);
+
+        const cameraArea = document.getElementById('cameraArea') || preview.parentElement;
+        cameraArea.style.position = 'relative';
+        cameraArea.appendChild(this.element);
+    }
+
+    /**
+     * Draw one analytics.exposure result
+     * @param {Object} result - histogram (0..255 per bin), clipping fractions, mean luma
+     */
+    draw(result) {
+        const ctx = this.context;
+        ctx.clearRect(0, 0, WIDTH, HEIGHT);
+        ctx.globalCompositeOperation = 'lighter';
+        for (const [name, colour] of CHANNELS) {
+            const bins = result.histogram[name];
+            if (!bins) continue;
+            const step = WIDTH / bins.length;
+            ctx.fillStyle = colour;
+            bins.forEach((value, i) => {
+                const h = value / 255 * HEIGHT;
+                ctx.fillRect(i * step, HEIGHT - h, step, h);
+            });
+        }
+        ctx.globalCompositeOperation = 'source-over';
+
+        // Red edge markers when either end clips
+        ctx.fillStyle = 'rgb(255, 40, 40)';
+        if (result.clipped_low > 0.01) ctx.fillRect(0, 0, 3, HEIGHT);
+        if (result.clipped_high > 0.01) ctx.fillRect(WIDTH - 3, 0, 3, HEIGHT);
+
+        const percent = (fraction) => (fraction * 100).toFixed(1);
+        const ev = result.ev_to_target;
+        this.label.textContent =
+            `Y ${result.mean_luma.toFixed(0)}  ${ev >= 0 ? '+' : ''}${ev.toFixed(1)} EV\n` +
+            `clip ${percent(result.clipped_low)}% / ${percent(result.clipped_high)}%`;
+    }
+}
+
+/**
+ * Focus peaking while the focus slider is in use
+ *
+ * Subscribes to analytics.peaking when the slider moves and drops the
+ * subscription a few seconds after the last move, so the server only
+ * computes edges while someone is focusing. The mask arrives run-length
+ * encoded for the lores frame and is painted onto a canvas over the preview.
+ */
+const PEAKING_HOLD_MS = 4000;
+const PEAKING_COLOUR = [255, 40, 200, 255];
+
+export class FocusPeaking {
+    constructor() {
+        this.preview = null;
+        this.canvas = null;
+        this.context = null;
+        this.image = null;
+        this.source = null;
+        this.timer = null;
+        this.onInput = () => this.activate();
+    }
+
+    start() {
+        this.preview = document.getElementById('cameraPreview');
+        const slider = document.getElementById('focusSlider');
+        if (!this.preview || !slider) return;
+        slider.addEventListener('input', this.onInput);
+        this.canvas = document.createElement('canvas');
+        this.canvas.className = 'focus-peaking';
+        this.canvas.style.cssText = `
+            position: absolute;
+            z-index: 999;
+            pointer-events: none;
+            image-rendering: pixelated;
+        `;
+        const cameraArea = document.getElementById('cameraArea') || this.preview.parentElement;
+        cameraArea.style.position = 'relative';
+        cameraArea.appendChild(this.canvas);
+        this.context = this.canvas.getContext('2d');
+    }
+
+    stop() {
+        const slider = document.getElementById('focusSlider');
+        if (slider) slider.removeEventListener('input', this.onInput);
+        this.deactivate();
+        if (this.canvas) this.canvas.remove();
+    }
+
+    activate() {
+        clearTimeout(this.timer);
+        this.timer = setTimeout(() => this.deactivate(), PEAKING_HOLD_MS);
+        if (this.source) return;
+        this.source = new EventSource('/api/events?topics=analytics.peaking');
+        this.source.addEventListener('analytics.peaking', (event) => {
+            this.draw(JSON.parse(event.data));
+        });
+    }
+
+    deactivate() {
+        clearTimeout(this.timer);
+        if (this.source) this.source.close();
+        this.source = null;
+        if (this.context) this.context.clearRect(0, 0, this.canvas.width, this.canvas.height);
+    }
+
+    /**
+     * Paint one mask: alternating off/on runs, one byte each, row-major
+     * @param {Object} result - width, height and base64 runs (app/analytics.py encode_runs)
+     */
+    draw(result) {
+        if (!this.source) return;   // arrived after the hold ran out
+        const { width, height } = result;
+        if (this.canvas.width !== width || this.canvas.height !== height || !this.image) {
+            this.canvas.width = width;
+            this.canvas.height = height;
+            this.image = this.context.createImageData(width, height);
+        }
+        // Cover the preview as displayed
+        this.canvas.style.left = `${this.preview.offsetLeft}px`;
+        this.canvas.style.top = `${this.preview.offsetTop}px`;
+        this.canvas.style.width = `${this.preview.clientWidth}px`;
+        this.canvas.style.height = `${this.preview.clientHeight}px`;
+
+        const pixels = this.image.data;
+        pixels.fill(0);
+        const runs = atob(result.runs);
+        let position = 0;
+        for (let i = 0; i < runs.length; i++) {
+            const run = runs.charCodeAt(i);
+            if (i % 2 === 1) {
+                for (let p = position; p < position + run; p++) pixels.set(PEAKING_COLOUR, p * 4);
+            }
+            position += run;
+        }
+        this.context.putImageData(this.image, 0, 0);
+    }
+}
@@ -9,6 +9,8 @@ import { DateTimeManager } from './datetime.js';
 import { PowerManager } from './power.js';
 import { CameraManager } from './camera.js';
 import { UIControls } from './ui-controls.js';
+import { LatencyOverlay } from './latency.js';
+import { ExposureAssist, FocusPeaking } from './analytics.js';
 
 class LancamApp {
     constructor() {
@@ -16,6 +18,9 @@ class LancamApp {
         this.dateTimeManager = new DateTimeManager();
         this.powerManager = new PowerManager();
         this.cameraManager = new CameraManager();
+        this.latencyOverlay = null;
+        this.exposureAssist = null;
+        this.focusPeaking = new FocusPeaking();
         
         // Make theme manager globally available
         window.themeManager = this.themeManager;
@@ -47,6 +52,21 @@ class LancamApp {
             
             // Start date/time updates
             this.dateTimeManager.start();
+
+            // Optional glass-to-glass latency overlay (?latency=1)
+            if (LatencyOverlay.requested()) {
+                this.latencyOverlay = new LatencyOverlay();
+                await this.latencyOverlay.start();
+            }
+
+            // Live histogram and clipping from the lores analytics (?histogram=0 hides it)
+            if (ExposureAssist.requested()) {
+                this.exposureAssist = new ExposureAssist();
+                this.exposureAssist.start();
+            }
+
+            // Focus peaking overlay while the focus slider moves
+            this.focusPeaking.start();
             
             // Make managers globally available
             window.themeManager = this.themeManager;
@@ -65,6 +85,9 @@ class LancamApp {
      */
     cleanup() {
         this.dateTimeManager.stop();
+        if (this.latencyOverlay) this.latencyOverlay.stop();
+        if (this.exposureAssist) this.exposureAssist.stop();
+        this.focusPeaking.stop();
     }
 }
 
@@ -0,0 +1,40 @@
+/**
+ * Background job module
+ * Follows progress of server-side jobs (certificate batches, exports) over SSE
+ */
+
+export class JobWatcher {
+    /**
+     * Watch a job until it finishes
+     * @param {number} jobId - Job id returned by the API
+     * @param {function} onProgress - Called with the job state on every update
+     * @returns {Promise<object>} Final job state
+     */
+    static watch(jobId, onProgress = () => {}) {
+        return new Promise((resolve) => {
+            const source = new EventSource(`/api/jobs/${jobId}/events`);
+
+            source.addEventListener(`job:${jobId}`, (event) => {
+                const job = JSON.parse(event.data);
+                onProgress(job);
+                if (job.state !== 'running') {
+                    source.close();
+                    resolve(job);
+                }
+            });
+
+            source.onerror = () => {
+                console.warn(`Lost progress stream for job ${jobId}`);
+            };
+        });
+    }
+
+    /**
+     * Format progress for display, e.g. "120/300 (40%)"
+     */
+    static describe(job) {
+        if (!job.total) return job.state;
+        const percent = Math.floor((job.done / job.total) * 100);
+        return `${job.done}/${job.total} (${percent}%)`;
+    }
+}
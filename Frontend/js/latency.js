@@ -0,0 +1,174 @@
+/**
+ * Latency overlay module
+ * Measures glass-to-glass latency of the live preview and reports it to the server
+ *
+ * Enabled with ?latency=1 in the page URL (remembered in localStorage;
+ * ?latency=0 turns it off). It needs frames stamped with the test pattern
+ * (synthetic camera with LANCAM_TEST_PATTERN=1): a stripe of blocks along
+ * the top edge holding the frame counter and the capture time, laid out as
+ * in app/camera.py (stamp_pattern).
+ */
+
+const PATTERN_BLOCKS = 2 + 16 + 32;
+const SAMPLE_MS = 250;         // how often the displayed frame is read back
+const REPORT_MS = 10000;       // how often samples are sent to the server
+const TWO_32 = 2 ** 32;
+
+export class LatencyOverlay {
+    constructor() {
+        this.preview = null;
+        this.canvas = document.createElement('canvas');
+        this.context = this.canvas.getContext('2d', { willReadFrequently: true });
+        this.offset = 0;           // server clock minus browser clock, ms
+        this.samples = [];         // recent latencies, ms
+        this.pending = [];         // seconds, not yet reported
+        this.lastCounter = null;
+        this.element = null;
+        this.timers = [];
+    }
+
+    /**
+     * Whether the overlay was asked for in the URL or earlier
+     */
+    static requested() {
+        const flag = new URLSearchParams(window.location.search).get('latency');
+        if (flag !== null) localStorage.setItem('lancamLatency', flag);
+        return localStorage.getItem('lancamLatency') === '1';
+    }
+
+    async start() {
+        this.preview = document.getElementById('cameraPreview');
+        if (!this.preview) return;
+        this.createElement();
+        await this.syncClock();
+        this.timers.push(setInterval(() => this.sample(), SAMPLE_MS));
+        this.timers.push(setInterval(() => this.report(), REPORT_MS));
+        this.timers.push(setInterval(() => this.syncClock(), 60000));
+    }
+
+    stop() {
+        this.timers.forEach(clearInterval);
+        this.timers = [];
+        if (this.element) this.element.remove();
+    }
+
+    createElement() {
+        this.element = document.createElement('div');
+        this.element.className = 'latency-overlay';
+        this.element.style.cssText = `
+            position: absolute;
+            bottom: 12px;
+            right: 12px;
+            background: rgba(0, 0, 0, 0.7);
+            color: white;
+            padding: 6px 12px;
+            border-radius: 8px;
+            font: 13px monospace;
+            z-index: 1000;
+            pointer-events: none;
+            white-space: pre;
+        `;
+        this.element.textContent = 'Latency: waiting for frames';
+        const cameraArea = document.getElementById('cameraArea') || this.preview.parentElement;
+        cameraArea.style.position = 'relative';
+        cameraArea.appendChild(this.element);
+    }
+
+    /**
+     * Estimate the server clock offset from the round trip with the lowest delay
+     */
+    async syncClock() {
+        let best = null;
+        for (let i = 0; i < 5; i++) {
+            try {
+                const sent = Date.now();
+                const res = await fetch('/api/debug/clock', { cache: 'no-store' });
+                const data = await res.json();
+                const received = Date.now();
+                const rtt = received - sent;
+                if (best === null || rtt < best.rtt) {
+                    best = { rtt, offset: data.time * 1000 - (sent + received) / 2 };
+                }
+            } catch (err) {
+                console.warn('Clock sync failed:', err);
+            }
+        }
+        if (best !== null) this.offset = best.offset;
+    }
+
+    /**
+     * Decode the pattern of the frame currently on screen
+     * @returns {{counter: number, captureMs: number} | null}
+     */
+    decode() {
+        const width = this.preview.naturalWidth;
+        const height = this.preview.naturalHeight;
+        if (!width || !height) return null;
+        const blockWidth = Math.floor(width / PATTERN_BLOCKS);
+        const stripeHeight = Math.max(8, Math.floor(height / 40));
+        const row = Math.floor(stripeHeight / 2);
+
+        this.canvas.width = width;
+        this.canvas.height = stripeHeight;
+        this.context.drawImage(this.preview, 0, 0);
+        const pixels = this.context.getImageData(0, row, width, 1).data;
+        const level = (i) => {
+            const x = (i * blockWidth + Math.floor(blockWidth / 2)) * 4;
+            return (pixels[x] + pixels[x + 1] + pixels[x + 2]) / 3;
+        };
+
+        const white = level(0);
+        const black = level(1);
+        if (white - black < 96) return null;
+        const threshold = (white + black) / 2;
+        // 48 bits exceed 32-bit bitwise operations, so build the numbers arithmetically
+        let counter = 0;
+        let captureMs = 0;
+        for (let i = 0; i < 16; i++) counter = counter * 2 + (level(2 + i) > threshold ? 1 : 0);
+        for (let i = 0; i < 32; i++) captureMs = captureMs * 2 + (level(18 + i) > threshold ? 1 : 0);
+        return { counter, captureMs };
+    }
+
+    sample() {
+        let decoded;
+        try {
+            decoded = this.decode();
+        } catch (err) {
+            return;   // stream not loaded yet
+        }
+        if (!decoded) {
+            this.element.textContent = 'Latency: no test pattern\n(LANCAM_TEST_PATTERN=1)';
+            return;
+        }
+        if (decoded.counter === this.lastCounter) return;   // same frame as last time
+        this.lastCounter = decoded.counter;
+
+        const nowMs = (Date.now() + this.offset) % TWO_32;
+        const latency = (((nowMs - decoded.captureMs) % TWO_32) + TWO_32) % TWO_32;
+        if (latency > 60000) return;   // clock not synced yet
+        this.samples.push(latency);
+        if (this.samples.length > 120) this.samples.shift();
+        this.pending.push(latency / 1000);
+
+        const sorted = [...this.samples].sort((a, b) => a - b);
+        const p50 = sorted[Math.floor(sorted.length * 0.5)];
+        const p90 = sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * 0.9))];
+        this.element.textContent =
+            `Latency ${latency.toFixed(0)} ms\np50 ${p50.toFixed(0)}  p90 ${p90.toFixed(0)} ms`;
+    }
+
+    async report() {
+        if (!this.pending.length) return;
+        const samples = this.pending;
+        this.pending = [];
+        try {
+            await fetch('/api/debug/latency', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ samples })
+            });
+        } catch (err) {
+            console.warn('Failed to report latency:', err);
+        }
+    }
+}
@@ -1,29 +1,78 @@
 """
 Flask application factory and configuration
 """
+import os
 import threading
 from flask import Flask
-from picamera2 import Picamera2
+from .config import CONFIG
 
 
 # Global variables for camera and thread lock
 picam2 = None
 lock = threading.Lock()
+inference_service = None
+result_cache = None
+history_store = None
+retention_worker = None
+derivative_store = None
+certificate_service = None
+upload_queue = None
+mail_worker = None
+frame_hub = None
+media_service = None
+preroll = None
+recording_catalog = None
+analytics = None
+calibration_store = None
 
 
 def create_app():
     """Create and configure the Flask application"""
     app = Flask(__name__, static_folder="../Frontend", static_url_path="")
+    app.config["USE_X_SENDFILE"] = CONFIG['downloads']['x_sendfile']
     
+    # Worker processes are forked first, so no camera or worker threads exist yet
+    init_inference()
+    init_history()
+    init_certificates()
+
     # Initialize camera
     init_camera()
+    init_media()
+    init_result_cache()
+    init_calibration()
+    init_uploads()
+    init_mailer()
+    start_background_workers()
     
     # Register blueprints
     from .camera_routes import camera_bp
     from .control_routes import control_bp
+    from .inference_routes import inference_bp
+    from .history_routes import history_bp
+    from .event_routes import events_bp
+    from .certificate_routes import certificate_bp
+    from .export_routes import export_bp
+    from .upload_routes import upload_bp
+    from .mail_routes import mail_bp
+    from .media_routes import media_bp
+    from .debug_routes import debug_bp
+    from .analytics_routes import analytics_bp
+    from .calibration_routes import calibration_bp
     
     app.register_blueprint(camera_bp)
     app.register_blueprint(control_bp)
+    app.register_blueprint(inference_bp)
+    app.register_blueprint(history_bp)
+    app.register_blueprint(events_bp)
+    app.register_blueprint(certificate_bp)
+    app.register_blueprint(export_bp)
+    app.register_blueprint(upload_bp)
+    app.register_blueprint(mail_bp)
+    app.register_blueprint(media_bp)
+    app.register_blueprint(debug_bp)
+    app.register_blueprint(analytics_bp)
+    app.register_blueprint(calibration_bp)
     
     return app
 
@@ -34,10 +83,14 @@ def init_camera():
         return  # Already initialized
     
     try:
-        picam2 = Picamera2()
+        from .analytics import lores_stream
+        from .camera import open_camera
+        picam2 = open_camera()
         sensorSize = picam2.sensor_resolution
+        main_size = (sensorSize[0] // 3, sensorSize[1] // 3)
         preview_config = picam2.create_preview_configuration(
-            main={"size": (sensorSize[0] // 3, sensorSize[1] // 3)},
+            main={"size": main_size},
+            lores=lores_stream(main_size),
             controls={
                 "AfMode": 2,
             }
@@ -51,6 +104,141 @@ def init_camera():
 
 
 
+def init_media():
+    global frame_hub, media_service, preroll, recording_catalog, analytics
+    if frame_hub is not None:
+        return
+
+    from .analytics import ExposureAnalyzer, FocusPeakingAnalyzer, LoresAnalytics
+    from .auto_exposure import AutoExposure
+    from .clips import PreRollBuffer
+    from .frame_hub import FrameHub
+    from .media import MediaService
+    from .recordings import RecordingCatalog
+    frame_hub = FrameHub(get_camera, lock)
+    try:
+        recording_catalog = RecordingCatalog()
+        media_service = MediaService(get_camera, lock)
+    except (OSError, RuntimeError) as e:
+        print(f"Recording and restreaming disabled: {e}")
+    preroll = PreRollBuffer(frame_hub, recording_catalog)
+    analytics = LoresAnalytics(frame_hub)
+    analytics.register(ExposureAnalyzer())
+    analytics.register(FocusPeakingAnalyzer())
+    analytics.register(AutoExposure(get_camera, frame_hub))
+
+
+def init_inference():
+    global inference_service
+    if inference_service is not None:
+        return  # Already initialized
+
+    from .inference import InferenceService
+    service = InferenceService()
+    if not os.path.exists(service.model_path):
+        print(f"Inference disabled: model not found at {service.model_path}")
+        return
+
+    try:
+        if service.start():
+            inference_service = service
+            print(f"Inference worker ready ({service.warmup_ms:.0f} ms warm-up)")
+        else:
+            print(f"Failed to start inference worker: {service.error}")
+    except Exception as e:
+        print(f"Failed to start inference worker: {e}")
+
+
+def init_result_cache():
+    global result_cache
+    if result_cache is not None:
+        return
+
+    from .result_cache import ResultCache
+    try:
+        result_cache = ResultCache()
+    except OSError as e:
+        print(f"Result cache disabled: {e}")
+
+
+def init_calibration():
+    global calibration_store
+    if calibration_store is not None:
+        return
+
+    from .calibration import CalibrationStore
+    try:
+        calibration_store = CalibrationStore()
+    except OSError as e:
+        print(f"Calibration disabled: {e}")
+
+
+def init_history():
+    global history_store
+    if history_store is not None:
+        return
+
+    from .history import HistoryStore
+    from .retention import RetentionWorker
+    try:
+        history_store = HistoryStore()
+    except Exception as e:
+        print(f"Failed to open scan history: {e}")
+        return
+
+    global retention_worker, derivative_store
+    from .derivatives import DerivativeStore
+    derivative_store = DerivativeStore(history_store)
+    retention_worker = RetentionWorker(history_store, derivative_store)
+
+
+def init_certificates():
+    global certificate_service
+    if certificate_service is not None:
+        return
+
+    from .certificates import CertificateService
+    try:
+        certificate_service = CertificateService(history_store)
+    except Exception as e:
+        print(f"Certificate rendering disabled: {e}")
+
+
+def init_uploads():
+    global upload_queue
+    if upload_queue is not None:
+        return
+
+    from .upload_queue import UploadQueue
+    try:
+        upload_queue = UploadQueue()
+    except Exception as e:
+        print(f"Cloud upload queue disabled: {e}")
+
+
+def init_mailer():
+    global mail_worker
+    if mail_worker is not None:
+        return
+
+    from .mailer import MailWorker
+    mail_worker = MailWorker(derivative_store)
+
+
+def start_background_workers():
+    """Start worker threads once every worker process has been forked"""
+    if retention_worker is not None:
+        retention_worker.start()
+    if upload_queue is not None:
+        upload_queue.start()
+    if mail_worker is not None:
+        mail_worker.start()
+    if preroll is not None and CONFIG['clips']['auto_arm']:
+        preroll.arm()
+    if analytics is not None:
+        analytics.start()
+
+
 def get_camera():
     """Get the camera instance"""
     return picam2
@@ -59,3 +247,73 @@ def get_camera():
 def get_lock():
     """Get the thread lock"""
     return lock
+
+
+def get_frame_hub():
+    """Get the shared preview frame source"""
+    return frame_hub
+
+
+def get_analytics():
+    """Get the lores stream analyzers"""
+    return analytics
+
+
+def get_calibration():
+    """Get the flat-field/dark-frame calibration store"""
+    return calibration_store
+
+
+def get_media():
+    """Get the shared H.264 encoder and its recording/streaming sinks"""
+    return media_service
+
+
+def get_recordings():
+    """Get the in-memory recordings catalog"""
+    return recording_catalog
+
+
+def get_preroll():
+    """Get the pre-event clip buffer"""
+    return preroll
+
+
+def get_inference():
+    """Get the inference service (None when no model is installed)"""
+    return inference_service
+
+
+def get_result_cache():
+    """Get the analysis result cache"""
+    return result_cache
+
+
+def get_history():
+    """Get the scan history store"""
+    return history_store
+
+
+def get_retention():
+    """Get the retention purge worker"""
+    return retention_worker
+
+
+def get_derivatives():
+    """Get the thumbnail/preview derivative store"""
+    return derivative_store
+
+
+def get_certificates():
+    """Get the certificate rendering service"""
+    return certificate_service
+
+
+def get_uploads():
+    """Get the cloud upload queue"""
+    return upload_queue
+
+
+def get_mailer():
+    """Get the mail delivery worker"""
+    return mail_worker
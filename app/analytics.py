@@ -0,0 +1,308 @@
+"""
+Live analysis of the lores stream
+
+The camera runs a small YUV420 "lores" stream next to the preview. The frame
+hub copies a lores frame only when an analyzer is due (every Nth frame, and
+only while someone listens), and hands it to a worker thread that keeps only
+the latest frame, so analysis never delays the preview. Results are pushed
+over the events channel as compact arrays, not images.
+
+Frames only flow while the hub has a subscriber, so the worker holds a hub
+subscription of its own whenever an analyzer is wanted; analysis does not
+depend on someone watching /stream.
+"""
+import threading
+import time
+
+from .config import CONFIG
+from .events import event_bus
+from .metrics import Histogram
+
+
+ANALYSIS_SECONDS = Histogram("lancam_analysis_seconds", "Lores analysis time per frame", labels=("analyzer",))
+
+
+def lores_stream(main_size):
+    """Lores stream configuration for a main stream size, or None if main is no bigger
+
+    Keeps the main aspect ratio with even dimensions, as YUV420 needs.
+    """
+    width = CONFIG['analytics']['lores_width']
+    if main_size[0] <= width:
+        return None
+    height = round(width * main_size[1] / main_size[0] / 2) * 2
+    return {"size": (width, max(height, 2)), "format": "YUV420"}
+
+
+def split_yuv420(yuv, size):
+    """Y (h x w) and U, V (h/2 x w/2) planes of a YUV420 array as make_array("lores") returns it"""
+    w, h = size
+    stride = yuv.shape[1]
+    y = yuv[:h, :w]
+    chroma = yuv[h:h + h // 2].reshape(-1)
+    # Each chroma row is half a stride long, packed two to an array row
+    u = chroma[:(h // 2) * (stride // 2)].reshape(h // 2, stride // 2)[:, :w // 2]
+    v = chroma[(h // 2) * (stride // 2):(h // 2) * stride].reshape(h // 2, stride // 2)[:, :w // 2]
+    return y, u, v
+
+
+class Analyzer:
+    """One analysis of lores frames, published on topic every `every` frames
+
+    listeners are in-process consumers of the results (e.g. a controller);
+    without them an analyzer only runs while an events client listens.
+    """
+
+    name = None
+
+    def __init__(self, every):
+        self.every = max(1, int(every))
+        self.enabled = True
+        self.listeners = []
+        self.last = None
+        self.runs = 0
+
+    @property
+    def topic(self):
+        return f"analytics.{self.name}"
+
+    def wanted(self):
+        return self.enabled and (bool(self.listeners) or event_bus.has_subscribers(self.topic))
+
+    def analyze(self, y, u, v, metadata):
+        raise NotImplementedError
+
+    def configure(self, data):
+        """Apply settings from a request body; ValueError on bad values"""
+        if "every" in data:
+            every = data["every"]
+            if not isinstance(every, int) or isinstance(every, bool) or not 1 <= every <= 300:
+                raise ValueError("every must be an integer between 1 and 300")
+            self.every = every
+        if "enabled" in data:
+            if not isinstance(data["enabled"], bool):
+                raise ValueError("enabled must be true or false")
+            self.enabled = data["enabled"]
+
+    def status(self):
+        return {"enabled": self.enabled, "every": self.every, "runs": self.runs,
+                "listening": self.wanted()}
+
+
+class ExposureAnalyzer(Analyzer):
+    """Histograms, clipping and mean luminance for exposure assist"""
+
+    name = "exposure"
+
+    def __init__(self):
+        cfg = CONFIG['analytics']
+        super().__init__(cfg['exposure_every'])
+        self.bins = cfg['histogram_bins']
+        self.clip_low = cfg['clip_low']
+        self.clip_high = cfg['clip_high']
+        self.target = cfg['target_luma']
+
+    def analyze(self, y, u, v, metadata):
+        import numpy as np
+
+        # RGB at chroma resolution: one sample per 2x2 block is plenty for histograms
+        y2 = y[::2, ::2][:u.shape[0], :u.shape[1]].astype(np.float32)
+        cb = u.astype(np.float32) - 128.0
+        cr = v.astype(np.float32) - 128.0
+        rgb = (y2 + 1.402 * cr, y2 - 0.344 * cb - 0.714 * cr, y2 + 1.772 * cb)
+
+        shift = 8 - (self.bins.bit_length() - 1)   # 256 levels -> bins
+        hist = {"y": np.bincount((y >> shift).ravel(), minlength=self.bins)}
+        clipped = {}
+        for name, channel in zip("rgb", rgb):
+            channel = np.clip(channel, 0, 255).astype(np.uint8)
+            hist[name] = np.bincount((channel >> shift).ravel(), minlength=self.bins)
+            clipped[name] = round(float(np.count_nonzero(channel >= self.clip_high)) / channel.size, 4)
+
+        pixels = y.size
+        mean = float(y.mean())
+        highlights = float(np.count_nonzero(y >= self.clip_high)) / pixels
+        shadows = float(np.count_nonzero(y <= self.clip_low)) / pixels
+        return {
+            # Each histogram scaled to 0..255 of its own peak: small, and enough to draw
+            "histogram": {k: (h * 255 // max(int(h.max()), 1)).tolist() for k, h in hist.items()},
+            "mean_luma": round(mean, 1),
+            "clipped_high": round(highlights, 4),
+            "clipped_low": round(shadows, 4),
+            "clipped": clipped,
+            # Stops to the target mean; > 0 means brighter exposure wanted
+            "ev_to_target": round(float(np.log2(self.target / max(mean, 1.0))), 2),
+            "exposure_time": metadata.get("ExposureTime"),
+            "analogue_gain": metadata.get("AnalogueGain"),
+        }
+
+
+def run_lengths(mask):
+    """Row-major run lengths of a boolean mask, starting with a (possibly empty) off run"""
+    import numpy as np
+    flat = mask.ravel()
+    edges = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], edges, [flat.size]))
+    runs = np.diff(bounds)
+    if flat.size and flat[0]:
+        runs = np.concatenate(([0], runs))
+    return runs
+
+
+def encode_runs(runs):
+    """Run lengths as base64 bytes; runs over 255 become 255, 0, rest so on/off still alternate"""
+    import base64
+    import numpy as np
+    out = []
+    for run in runs.tolist():
+        while run > 255:
+            out += (255, 0)
+            run -= 255
+        out.append(run)
+    return base64.b64encode(np.array(out, dtype=np.uint8).tobytes()).decode()
+
+
+class FocusPeakingAnalyzer(Analyzer):
+    """Edge-strength mask for focus peaking, sent run-length encoded (see encode_runs)
+
+    The browser paints the mask over the preview itself, so the MJPEG stream
+    is neither re-encoded nor any bigger.
+    """
+
+    name = "peaking"
+
+    def __init__(self):
+        cfg = CONFIG['analytics']
+        super().__init__(cfg['peaking_every'])
+        self.threshold = cfg['peaking_threshold']
+        self.max_fraction = cfg['peaking_max_fraction']
+
+    def analyze(self, y, u, v, metadata):
+        import numpy as np
+
+        # Central differences in both directions, |gx| + |gy|, on the Y plane
+        y = y.astype(np.int16)
+        strength = (np.abs(y[1:-1, 2:] - y[1:-1, :-2]) + np.abs(y[2:, 1:-1] - y[:-2, 1:-1]))
+        threshold = self.threshold
+        # A busy or noisy scene would flag most pixels: keep only the strongest edges,
+        # which also bounds the size of the run-length list
+        limit = int(strength.size * self.max_fraction)
+        if np.count_nonzero(strength >= threshold) > limit:
+            threshold = max(threshold, int(np.partition(strength.ravel(), strength.size - limit)[-limit]) + 1)
+
+        mask = np.zeros(y.shape, dtype=bool)
+        mask[1:-1, 1:-1] = strength >= threshold
+        runs = run_lengths(mask)
+        return {
+            "width": int(y.shape[1]),
+            "height": int(y.shape[0]),
+            "runs": encode_runs(runs),
+            "threshold": threshold,
+            "edge_fraction": round(float(np.count_nonzero(mask)) / mask.size, 4),
+            # Mean edge strength; rises as the lens comes into focus
+            "sharpness": round(float(strength.mean()), 2),
+            "lens_position": metadata.get("LensPosition"),
+        }
+
+    def configure(self, data):
+        super().configure(data)
+        if "threshold" in data:
+            threshold = data["threshold"]
+            if not isinstance(threshold, int) or isinstance(threshold, bool) or not 1 <= threshold <= 510:
+                raise ValueError("threshold must be an integer between 1 and 510")
+            self.threshold = threshold
+
+    def status(self):
+        status = super().status()
+        status["threshold"] = self.threshold
+        return status
+
+
+class LoresAnalytics:
+    """Feeds due lores frames from the frame hub to the analyzers on a worker thread"""
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.analyzers = {}
+        self.cond = threading.Condition()
+        self.pending = None        # latest (frame, yuv, size, metadata, analyzers); older ones are dropped
+        self.frames = 0
+        self.dropped = 0
+        self.error = None
+        self.thread = None
+        self.holding = False       # whether we hold a frame hub subscription
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="lores-analytics", daemon=True)
+            self.thread.start()
+            self.hub.lores_sink = self
+
+    def register(self, analyzer):
+        self.analyzers[analyzer.name] = analyzer
+        return analyzer
+
+    def get(self, name):
+        return self.analyzers.get(name)
+
+    def due(self):
+        """Analyzers that want the next frame; called on the capture thread"""
+        self.frames += 1
+        return [a for a in self.analyzers.values() if self.frames % a.every == 0 and a.wanted()]
+
+    def feed(self, yuv, size, metadata, analyzers):
+        with self.cond:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = (self.frames, yuv, size, metadata, analyzers)
+            self.cond.notify()
+
+    def _hold_hub(self):
+        """Keep the frame hub running while any analyzer wants frames"""
+        wanted = any(a.wanted() for a in list(self.analyzers.values()))
+        if wanted and not self.holding:
+            self.hub.subscribe()
+            self.holding = True
+        elif not wanted and self.holding:
+            self.hub.unsubscribe()
+            self.holding = False
+
+    def _run(self):
+        while True:
+            self._hold_hub()
+            with self.cond:
+                # Wake up now and then to notice listeners coming and going
+                if not self.cond.wait_for(lambda: self.pending is not None, timeout=1.0):
+                    continue
+                frame, yuv, size, metadata, analyzers = self.pending
+                self.pending = None
+            y, u, v = split_yuv420(yuv, size)
+            for analyzer in analyzers:
+                t0 = time.perf_counter()
+                try:
+                    result = analyzer.analyze(y, u, v, metadata)
+                except Exception as e:
+                    self.error = f"{analyzer.name}: {e}"
+                    continue
+                if result is None:         # nothing to report for this frame
+                    continue
+                elapsed = time.perf_counter() - t0
+                ANALYSIS_SECONDS.labels(analyzer.name).observe(elapsed)
+                result["frame"] = frame
+                result["analysis_ms"] = round(elapsed * 1000.0, 2)
+                analyzer.last = result
+                analyzer.runs += 1
+                event_bus.publish(analyzer.topic, result)
+                for callback in list(analyzer.listeners):
+                    try:
+                        callback(result, metadata)
+                    except Exception as e:
+                        self.error = f"{analyzer.name} listener: {e}"
+
+    def status(self):
+        return {
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "error": self.error,
+            "analyzers": {name: a.status() for name, a in self.analyzers.items()},
+        }
@@ -0,0 +1,51 @@
+"""
+Lores analytics routes: status, latest results and per-analyzer settings
+
+Results themselves are pushed on /api/events?topics=analytics.<name>.
+"""
+from flask import Blueprint, request, jsonify
+from . import get_analytics
+
+
+analytics_bp = Blueprint("analytics", __name__)
+
+
+def error_response(msg, code=400):
+    return jsonify({"success": False, "message": msg}), code
+
+
+@analytics_bp.route("/api/analytics/status")
+def status():
+    analytics = get_analytics()
+    if analytics is None:
+        return error_response("Analytics not available", 503)
+    return jsonify({"success": True, "data": analytics.status()})
+
+
+@analytics_bp.route("/api/analytics/<name>")
+def latest(name):
+    """Most recent result of one analyzer (null until it has run)"""
+    analytics = get_analytics()
+    if analytics is None:
+        return error_response("Analytics not available", 503)
+    analyzer = analytics.get(name)
+    if analyzer is None:
+        return error_response(f"Unknown analyzer: {name}", 404)
+    return jsonify({"success": True, "data": analyzer.last})
+
+
+@analytics_bp.route("/api/analytics/<name>", methods=["POST"])
+def configure(name):
+    """Change an analyzer's settings: {"every": 3, "enabled": true}, plus its own (e.g. threshold)"""
+    analytics = get_analytics()
+    if analytics is None:
+        return error_response("Analytics not available", 503)
+    analyzer = analytics.get(name)
+    if analyzer is None:
+        return error_response(f"Unknown analyzer: {name}", 404)
+
+    try:
+        analyzer.configure(request.json or {})
+    except ValueError as e:
+        return error_response(str(e))
+    return jsonify({"success": True, "data": analyzer.status()})
@@ -0,0 +1,213 @@
+"""
+Closed-loop software auto-exposure on lores frames
+
+libcamera's AE meters the whole frame, which on a dark UV scene is mostly
+black tray, and set_exposure/set_gain switch it off anyway. This controller
+meters only the stones (lores pixels brighter than the tray inside an
+optional region of interest) and steps ExposureTime x AnalogueGain towards
+a target level. After each step it waits for a frame whose metadata shows
+the new values before metering again, so a step is never judged on a frame
+exposed with the old settings. The settings each illumination mode
+converged to are kept, so the next step in that mode starts from them and
+usually converges on its first frame.
+
+converge() runs on POST /api/camera/auto_exposure. The scan sequence runs in
+the client, so no server-side capture path calls it yet.
+"""
+import math
+import threading
+import time
+from collections import deque
+
+from .analytics import Analyzer
+from .config import CONFIG
+from .metrics import Histogram
+
+
+CONVERGE_SECONDS = Histogram("lancam_ae_converge_seconds", "Time for software AE to converge",
+                             buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0),
+                             labels=("mode", "converged"))
+CONVERGE_FRAMES = Histogram("lancam_ae_converge_frames", "Lores frames used by software AE",
+                            buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32), labels=("mode",))
+
+_busy = threading.Lock()
+
+
+def _applied(actual, wanted, tolerance=0.05):
+    """Whether a metadata value matches the requested one (sensors quantise exposure to lines)"""
+    return actual is not None and abs(actual - wanted) <= tolerance * wanted
+
+
+class AutoExposure(Analyzer):
+    """Meters the stones on lores frames and drives ExposureTime / AnalogueGain"""
+
+    name = "ae"
+
+    def __init__(self, get_camera, hub):
+        cfg = CONFIG['auto_exposure']
+        super().__init__(1)
+        self.get_camera = get_camera
+        self.hub = hub
+        self.cfg = cfg
+        self.state = None          # the convergence in progress, read by the analytics thread
+        self.done = threading.Event()
+        self.finish_lock = threading.Lock()
+        self.presets = {}          # mode -> (exposure us, gain) it last converged to
+        self.results = deque(maxlen=20)
+
+    def wanted(self):
+        # Only while converge() waits; results are published for anyone watching
+        return self.enabled and self.state is not None
+
+    # ----------------------------
+    # Caller side
+    # ----------------------------
+    def converge(self, mode="default", roi=None, target=None, timeout=None):
+        """Step exposure until the stones meter at target; returns a result dict
+
+        roi is (x, y, w, h) as fractions of the frame. Raises RuntimeError if
+        the camera is missing, or while another convergence runs.
+        """
+        camera = self.get_camera()
+        if camera is None:
+            raise RuntimeError("Camera not available")
+        if not _busy.acquire(blocking=False):
+            raise RuntimeError("Auto-exposure is already running")
+        try:
+            state = {
+                "mode": mode,
+                "roi": roi,
+                "target": float(target or self.cfg['target']),
+                "start": time.perf_counter(),
+                "frames": 0,
+                "steps": 0,
+                "pending": None,       # (exposure, gain) requested and not yet seen in metadata
+                "waited": 0,
+                "level": None,
+                "exposure": None,
+                "gain": None,
+            }
+            preset = self.presets.get(mode)
+            if preset is not None:
+                self._apply(camera, state, *preset)
+            self.done.clear()
+            self.state = state
+            self.hub.subscribe()       # keeps frames, and with them lores analysis, flowing
+            try:
+                finished = self.done.wait(timeout or self.cfg['timeout_s'])
+            finally:
+                self.hub.unsubscribe()
+                self.state = None
+            if not finished:
+                self._finish(state, False, "timeout")
+                self.done.wait()       # set by whichever of us finished it
+            return state["result"]
+        finally:
+            _busy.release()
+
+    def _apply(self, camera, state, exposure, gain):
+        camera.set_controls({"AeEnable": False, "ExposureTime": int(exposure), "AnalogueGain": float(gain)})
+        state["pending"] = (int(exposure), float(gain))
+        state["waited"] = 0
+
+    def _finish(self, state, converged, reason):
+        with self.finish_lock:     # the analytics thread and a timing-out caller may race
+            if "result" in state:
+                return
+            state["result"] = None
+        seconds = time.perf_counter() - state["start"]
+        result = {
+            "mode": state["mode"],
+            "converged": converged,
+            "reason": reason,
+            "seconds": round(seconds, 3),
+            "frames": state["frames"],
+            "steps": state["steps"],
+            "level": state["level"],
+            "target": state["target"],
+            "exposure_time": state["exposure"],
+            "analogue_gain": state["gain"],
+        }
+        state["result"] = result
+        if converged:
+            self.presets[state["mode"]] = (state["exposure"], state["gain"])
+        CONVERGE_SECONDS.labels(state["mode"], str(converged).lower()).observe(seconds)
+        CONVERGE_FRAMES.labels(state["mode"]).observe(state["frames"])
+        self.results.append(result)
+        self.done.set()
+
+    # ----------------------------
+    # Analytics thread
+    # ----------------------------
+    def meter(self, y, roi=None):
+        """Mean Y of the stones: pixels above the tray level inside roi
+
+        Falls back to the brightest pixels when too few clear the tray level,
+        e.g. when everything is badly underexposed.
+        """
+        import numpy as np
+        if roi:
+            h, w = y.shape
+            x0, y0 = int(roi[0] * w), int(roi[1] * h)
+            x1, y1 = max(x0 + 1, int((roi[0] + roi[2]) * w)), max(y0 + 1, int((roi[1] + roi[3]) * h))
+            y = y[y0:y1, x0:x1]
+        stones = y[y > self.cfg['tray_level']]
+        if stones.size >= self.cfg['min_stone_fraction'] * y.size:
+            return float(stones.mean())
+        count = max(1, int(y.size * self.cfg['min_stone_fraction']))
+        return float(np.partition(y.ravel(), y.size - count)[-count:].mean())
+
+    def analyze(self, y, u, v, metadata):
+        state = self.state
+        if state is None or "result" in state:
+            return None
+        state["frames"] += 1
+        exposure = metadata.get("ExposureTime")
+        gain = metadata.get("AnalogueGain")
+        if state["pending"] is not None:
+            wanted_exposure, wanted_gain = state["pending"]
+            if not (_applied(exposure, wanted_exposure) and _applied(gain, wanted_gain)):
+                state["waited"] += 1
+                if state["waited"] < self.cfg['settle_frames']:
+                    return None
+                # Not seen after settle_frames: the sensor clamped it; meter what we got
+            state["pending"] = None
+        if not exposure or not gain:
+            self._finish(state, False, "no exposure metadata")
+            return None
+
+        level = self.meter(y, state["roi"])
+        error = math.log2(state["target"] / max(level, 1.0))
+        state.update(level=round(level, 1), exposure=int(exposure), gain=round(float(gain), 3))
+        progress = {"mode": state["mode"], "step": state["steps"], "level": state["level"],
+                    "error_ev": round(error, 2), "exposure_time": state["exposure"],
+                    "analogue_gain": state["gain"]}
+
+        if abs(error) <= self.cfg['tolerance_ev']:
+            self._finish(state, True, "converged")
+        elif state["steps"] >= self.cfg['max_steps']:
+            self._finish(state, False, "max_steps")
+        else:
+            limit = self.cfg['max_step_ev']
+            if level >= 250:
+                error = -limit             # saturated: the mean cannot say how far over it is
+            product = exposure * gain * 2.0 ** max(-limit, min(limit, error))
+            new_exposure = max(self.cfg['min_exposure'], min(self.cfg['max_exposure'], product))
+            new_gain = max(1.0, min(self.cfg['max_gain'], product / new_exposure))
+            if _applied(exposure, new_exposure, 0.01) and _applied(gain, new_gain, 0.01):
+                self._finish(state, False, "limit")
+            else:
+                camera = self.get_camera()
+                if camera is None:
+                    self._finish(state, False, "camera lost")
+                else:
+                    self._apply(camera, state, new_exposure, new_gain)
+                    state["steps"] += 1
+        return progress
+
+    def status(self):
+        status = super().status()
+        status["presets"] = {mode: {"exposure_time": e, "analogue_gain": g}
+                             for mode, (e, g) in self.presets.items()}
+        status["results"] = list(self.results)
+        return status
@@ -0,0 +1,289 @@
+"""
+Flat-field and dark-frame calibration
+
+Per illumination mode and exposure, averaged dark frames (no light) and
+flat fields (an even target under that illumination) are recorded once and
+turned into two float32 maps stored as .npy files:
+
+    gain = mean(flat - dark) / (flat - dark)     per pixel and channel
+    bias = -dark * gain
+
+so correcting a capture is one multiply and one add, in place, with no
+temporaries: corrected = raw * gain + bias. The maps are memory-mapped, so
+loading a calibration costs nothing until pages are touched and the page
+cache shares them between worker processes.
+
+A calibration is flagged stale when it is too old, when the dark frame was
+re-recorded after the flat field, or when the sensor temperature has drifted
+since it was recorded.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+from .config import CONFIG
+from .metrics import lock_holder, timed_lock
+
+
+KINDS = ("dark", "flat")
+CALIBRATION_LOCK = lock_holder("calibration")
+_MODE = re.compile(r"[a-z0-9_-]{1,32}")
+
+
+def calibration_key(mode, exposure, gain):
+    return f"{mode}/{int(exposure)}us_g{float(gain):.2f}"
+
+
+def _save_npy(path, array):
+    import numpy as np
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def _save_json(path, data):
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def capture_mean(camera, lock, count):
+    """Average of count main-stream frames as float32 RGB, plus the first frame's metadata
+
+    The lock is taken per frame, so the preview keeps running meanwhile.
+    Raises ValueError if exposure or gain change while recording (AE still on).
+    """
+    import numpy as np
+    total = None
+    first = None
+    for _ in range(count):
+        with timed_lock(lock, CALIBRATION_LOCK):
+            request = camera.capture_request()
+        try:
+            frame = request.make_array("main")
+            metadata = request.get_metadata()
+        finally:
+            request.release()
+        if first is None:
+            first = metadata
+            total = np.zeros(frame.shape[:2] + (3,), dtype=np.float32)
+        elif (abs(metadata.get("ExposureTime", 0) - first.get("ExposureTime", 0)) > 0.02 * first.get("ExposureTime", 1)
+              or abs(metadata.get("AnalogueGain", 0) - first.get("AnalogueGain", 0)) > 0.02 * first.get("AnalogueGain", 1)):
+            raise ValueError("Exposure changed while recording; set a manual exposure first")
+        total += frame[..., 2::-1]    # BGR(X) in memory order -> RGB
+    total /= count
+    return total, first
+
+
+class CalibrationMaps:
+    """Gain and bias maps of one calibration, usually memory-mapped"""
+
+    def __init__(self, key, gain, bias, meta):
+        self.key = key
+        self.gain = gain
+        self.bias = bias
+        self.meta = meta
+
+    @property
+    def size(self):
+        return (self.gain.shape[1], self.gain.shape[0])
+
+    def apply(self, rgb, out=None):
+        """raw * gain + bias into a float32 array (out may be reused between calls)"""
+        import numpy as np
+        out = np.multiply(rgb, self.gain, out=out, dtype=np.float32)
+        np.add(out, self.bias, out=out)
+        return out
+
+
+class CalibrationStore:
+    """Recorded calibrations on disk: <dir>/<mode>/<exposure>us_g<gain>/"""
+
+    def __init__(self, directory=None):
+        self.cfg = CONFIG['calibration']
+        self.directory = directory or self.cfg['dir']
+        self.lock = threading.Lock()
+        self.loaded = {}           # key -> CalibrationMaps
+        self.index = None          # mode -> [(key, meta)], read from disk on first find()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key, name=""):
+        return os.path.join(self.directory, key, name)
+
+    def _meta(self, key):
+        try:
+            with open(self._path(key, "meta.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def keys(self, mode=None):
+        modes = [mode] if mode else sorted(os.listdir(self.directory))
+        keys = []
+        for m in modes:
+            folder = os.path.join(self.directory, m)
+            if os.path.isdir(folder):
+                keys += [f"{m}/{name}" for name in sorted(os.listdir(folder))
+                         if os.path.isdir(os.path.join(folder, name))]
+        return keys
+
+    # ----------------------------
+    # Recording
+    # ----------------------------
+    def record(self, kind, mode, camera, lock, frames=None):
+        """Capture and store a dark frame or flat field at the camera's current exposure
+
+        A flat field also (re)computes the gain/bias maps, using the dark frame
+        of the same key when one exists.
+        """
+        import numpy as np
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+        if not _MODE.fullmatch(mode or ""):
+            raise ValueError("mode must be a short lowercase name such as fluorescence")
+        mean, metadata = capture_mean(camera, lock, frames or self.cfg['frames'])
+        exposure, gain = metadata.get("ExposureTime"), metadata.get("AnalogueGain")
+        if not exposure or not gain:
+            raise ValueError("Camera reports no ExposureTime/AnalogueGain")
+
+        key = calibration_key(mode, exposure, gain)
+        os.makedirs(self._path(key), exist_ok=True)
+        recorded = {
+            "time": time.time(),
+            "frames": frames or self.cfg['frames'],
+            "temperature": metadata.get("SensorTemperature"),
+            "mean": [round(float(v), 2) for v in mean.reshape(-1, 3).mean(axis=0)],
+        }
+        with self.lock:
+            meta = self._meta(key)
+            meta.update({"mode": mode, "exposure_time": int(exposure), "analogue_gain": float(gain),
+                         "size": [mean.shape[1], mean.shape[0]]})
+            if kind == "dark":
+                _save_npy(self._path(key, "dark.npy"), mean)
+            else:
+                dark = None
+                if meta.get("dark"):
+                    dark = np.load(self._path(key, "dark.npy"))
+                    if dark.shape != mean.shape:
+                        dark = None    # recorded at another resolution
+                signal = mean - dark if dark is not None else mean
+                # Per-channel mean over per-pixel response; dead or dark pixels get max_gain
+                level = signal.reshape(-1, 3).mean(axis=0)
+                if level.min() < 1.0:
+                    raise ValueError("Flat field is no brighter than the dark frame")
+                gain_map = level / np.maximum(signal, level / self.cfg['max_gain'])
+                gain_map = gain_map.astype(np.float32)
+                bias_map = (-dark * gain_map if dark is not None else np.zeros_like(gain_map)).astype(np.float32)
+                _save_npy(self._path(key, "gain.npy"), gain_map)
+                _save_npy(self._path(key, "bias.npy"), bias_map)
+                recorded["with_dark"] = dark is not None
+                recorded["falloff"] = round(float(gain_map.max()), 3)   # worst corner boost
+            meta[kind] = recorded
+            _save_json(self._path(key, "meta.json"), meta)
+            self.loaded.pop(key, None)
+            self.index = None
+        return self.describe(key)
+
+    def delete(self, key):
+        import shutil
+        if key not in self.keys():
+            return False
+        with self.lock:
+            self.loaded.pop(key, None)
+            self.index = None
+            shutil.rmtree(self._path(key))
+        return True
+
+    # ----------------------------
+    # Lookup and correction
+    # ----------------------------
+    def _index(self):
+        """Metadata of every calibration by mode, cached until record() or delete()"""
+        with self.lock:
+            if self.index is None:
+                index = {}
+                for key in self.keys():
+                    index.setdefault(key.split("/", 1)[0], []).append((key, self._meta(key)))
+                self.index = index
+            return self.index
+
+    def find(self, mode, exposure, gain, size):
+        """Key of the calibration for mode closest in exposure, within tolerance, or None"""
+        if not exposure or not gain:
+            return None
+        tolerance = self.cfg['exposure_tolerance']
+        best, best_error = None, None
+        for key, meta in self._index().get(mode, ()):
+            if "flat" not in meta or tuple(meta.get("size") or ()) != tuple(size):
+                continue
+            exposure_error = abs(meta["exposure_time"] - exposure) / exposure
+            gain_error = abs(meta["analogue_gain"] - gain) / gain
+            if exposure_error > tolerance or gain_error > tolerance:
+                continue
+            if best is None or exposure_error + gain_error < best_error:
+                best, best_error = key, exposure_error + gain_error
+        return best
+
+    def maps(self, key):
+        """CalibrationMaps for key, memory-mapped on first use"""
+        import numpy as np
+        with self.lock:
+            maps = self.loaded.get(key)
+            if maps is None:
+                maps = CalibrationMaps(key,
+                                       np.load(self._path(key, "gain.npy"), mmap_mode="r"),
+                                       np.load(self._path(key, "bias.npy"), mmap_mode="r"),
+                                       self._meta(key))
+                self.loaded[key] = maps
+            return maps
+
+    def stale_reasons(self, meta, temperature=None):
+        reasons = []
+        flat = meta.get("flat") or {}
+        dark = meta.get("dark") or {}
+        if not flat:
+            return ["no flat field"]
+        age_days = (time.time() - flat["time"]) / 86400
+        if age_days > self.cfg['max_age_days']:
+            reasons.append(f"recorded {age_days:.0f} days ago")
+        if not flat.get("with_dark"):
+            reasons.append("no dark frame")
+        elif dark.get("time", 0) > flat["time"]:
+            reasons.append("dark frame re-recorded after the flat field")
+        if temperature is not None and flat.get("temperature") is not None:
+            drift = abs(temperature - flat["temperature"])
+            if drift > self.cfg['max_temperature_drift']:
+                reasons.append(f"sensor temperature drifted {drift:.1f} C")
+        return reasons
+
+    def correct(self, rgb, mode, metadata, out=None):
+        """Flat-field/dark-corrected float32 copy of an RGB capture, plus what was applied
+
+        Returns an uncorrected float32 copy when no calibration matches; info
+        says which key was used and why it may be stale.
+        """
+        import numpy as np
+        h, w = rgb.shape[:2]
+        key = self.find(mode, metadata.get("ExposureTime") or 0, metadata.get("AnalogueGain") or 1.0, (w, h))
+        if key is None:
+            if out is None:
+                out = rgb.astype(np.float32)
+            else:
+                np.copyto(out, rgb)
+            return out, {"key": None, "stale": True,
+                         "reasons": [f"no {mode} calibration at this exposure and size"]}
+        maps = self.maps(key)
+        reasons = self.stale_reasons(maps.meta, metadata.get("SensorTemperature"))
+        return maps.apply(rgb, out), {"key": key, "stale": bool(reasons), "reasons": reasons}
+
+    def describe(self, key, temperature=None):
+        meta = self._meta(key)
+        reasons = self.stale_reasons(meta, temperature)
+        return {"key": key, **meta, "stale": bool(reasons), "reasons": reasons}
+
+    def status(self, temperature=None):
+        return [self.describe(key, temperature) for key in self.keys()]
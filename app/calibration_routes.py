@@ -0,0 +1,56 @@
+"""
+Flat-field and dark-frame calibration endpoints
+"""
+from flask import Blueprint, request, jsonify
+from . import get_calibration, get_camera, get_lock
+from .calibration import KINDS
+
+
+calibration_bp = Blueprint("calibration", __name__)
+
+
+def error_response(msg, code=400):
+    return jsonify({"success": False, "message": msg}), code
+
+
+@calibration_bp.route("/api/calibration")
+def list_calibrations():
+    """Recorded calibrations with their stale flags"""
+    store = get_calibration()
+    if store is None:
+        return error_response("Calibration not available", 503)
+    return jsonify({"success": True, "data": store.status()})
+
+
+@calibration_bp.route("/api/calibration/<kind>", methods=["POST"])
+def record(kind):
+    """Record a dark frame or flat field at the current exposure: {"mode": "fluorescence", "frames": 16}"""
+    store = get_calibration()
+    if store is None:
+        return error_response("Calibration not available", 503)
+    if kind not in KINDS:
+        return error_response(f"kind must be one of {', '.join(KINDS)}", 404)
+    picam2 = get_camera()
+    if picam2 is None:
+        return error_response("Camera not available", 503)
+
+    data = request.json or {}
+    frames = data.get("frames")
+    if frames is not None and (not isinstance(frames, int) or isinstance(frames, bool) or not 1 <= frames <= 64):
+        return error_response("frames must be an integer between 1 and 64")
+    try:
+        return jsonify({"success": True, "data": store.record(kind, data.get("mode"), picam2, get_lock(), frames)})
+    except ValueError as e:
+        return error_response(str(e))
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+@calibration_bp.route("/api/calibration/<mode>/<name>", methods=["DELETE"])
+def delete(mode, name):
+    store = get_calibration()
+    if store is None:
+        return error_response("Calibration not available", 503)
+    if not store.delete(f"{mode}/{name}"):
+        return error_response("Calibration not found", 404)
+    return jsonify({"success": True, "message": f"Deleted {mode}/{name}"})
@@ -0,0 +1,475 @@
+"""
+Camera backends
+
+The rest of the app talks to the camera through the subset of the Picamera2
+API it already used: configurations, start/stop, set_controls,
+camera_controls/camera_properties, capture_request()/capture_metadata() and
+the encoder calls. open_camera() picks the implementation from
+CONFIG['camera']['backend'] (LANCAM_CAMERA):
+
+- "picamera2": the real camera; Picamera2 itself is the backend
+- "synthetic": a moving test pattern at the configured size and frame rate,
+  with the controls of app/control.json and plausible metadata; with
+  CONFIG['camera']['test_pattern'] each frame also carries its counter and
+  capture time as a barcode (see stamp_pattern) for latency measurements
+- "replay": frames and metadata recorded with record_replay(), played back
+  at their original pace and looped
+
+The software backends pace capture_request() like a sensor does, so
+capture, encode and streaming can be measured on any Linux box. They have
+no H.264 encoder; recording and restreaming need the real camera.
+"""
+import io
+import json
+import os
+import threading
+import time
+
+from .config import CONFIG
+
+
+CONTROLS_FILE = os.path.join(os.path.dirname(__file__), "control.json")
+
+
+def open_camera(backend=None):
+    """Camera object for the configured backend"""
+    backend = backend or CONFIG['camera']['backend']
+    if backend == "picamera2":
+        from picamera2 import Picamera2
+        return Picamera2()
+    if backend == "synthetic":
+        return SyntheticCamera()
+    if backend == "replay":
+        return ReplayCamera(CONFIG['camera']['replay'])
+    raise ValueError(f"Unknown camera backend '{backend}'")
+
+
+def load_controls(path=CONTROLS_FILE):
+    """camera_controls as libcamera reports them: name -> (min, max, default)"""
+    with open(path) as f:
+        controls = json.load(f)
+    return {name: tuple(tuple(v) if isinstance(v, list) else v for v in value)
+            for name, value in controls.items()}
+
+
+# ----------------------------
+# Latency test pattern
+# ----------------------------
+# A stripe along the top of the frame: one white and one black reference
+# block, then 16 bits of frame counter and 32 bits of capture time (ms since
+# the epoch, mod 2**32), most significant bit first. Blocks are large and
+# flat so they survive JPEG; Frontend/js/latency.js decodes the same layout.
+PATTERN_BLOCKS = 2 + 16 + 32
+
+
+def pattern_geometry(width, height):
+    """(block width, stripe height) of the pattern for a frame size"""
+    return width // PATTERN_BLOCKS, max(8, height // 40)
+
+
+def stamp_pattern(frame, counter, capture_ms):
+    """Draw the barcode into the top rows of an RGB frame (in place)"""
+    h, w = frame.shape[:2]
+    bw, bh = pattern_geometry(w, h)
+    value = ((counter & 0xFFFF) << 32) | (int(capture_ms) & 0xFFFFFFFF)
+    bits = [1, 0] + [(value >> (47 - i)) & 1 for i in range(48)]
+    for i, bit in enumerate(bits):
+        frame[:bh, i * bw:(i + 1) * bw] = 255 if bit else 0
+
+
+def read_pattern(rgb, size=None):
+    """(counter, capture ms) decoded from an RGB frame, None if there is no pattern
+
+    size is the (width, height) the frame was stamped at, when rgb is a
+    reduced decode of it (JPEG draft mode).
+    """
+    h, w = rgb.shape[:2]
+    full_w, full_h = size or (w, h)
+    bw, bh = pattern_geometry(full_w, full_h)
+    sx, sy = w / full_w, h / full_h
+    row = rgb[int(bh // 2 * sy)]
+    levels = [int(row[int((i * bw + bw // 2) * sx), :3].mean()) for i in range(PATTERN_BLOCKS)]
+    white, black = levels[0], levels[1]
+    if white - black < 96:
+        return None
+    threshold = (white + black) // 2
+    value = 0
+    for level in levels[2:]:
+        value = (value << 1) | (level > threshold)
+    return value >> 32, value & 0xFFFFFFFF
+
+
+# ----------------------------
+# Software cameras
+# ----------------------------
+class CompletedRequest:
+    """Stand-in for picamera2's CompletedRequest"""
+
+    def __init__(self, camera, frame, metadata):
+        self.camera = camera
+        self.frame = frame
+        self.metadata = metadata
+
+    def make_array(self, name="main"):
+        return self.camera._array(self.frame, name)
+
+    def make_image(self, name="main"):
+        from PIL import Image
+        return Image.fromarray(self.camera._rgb(self.frame, name))
+
+    def save(self, name, file_output, format=None, quality=None):
+        self.camera._save(self.frame, name, file_output, format, quality)
+
+    def get_metadata(self):
+        return dict(self.metadata)
+
+    def release(self):
+        self.frame = None
+
+
+class SoftwareCamera:
+    """Configuration, controls and frame pacing shared by the software backends
+
+    Subclasses provide _next_frame() and _rgb(); native_size, when set, is
+    the default size of every configuration.
+    """
+
+    model = "software"
+    native_size = None
+
+    def __init__(self, sensor_size, fps):
+        self.sensor_resolution = tuple(sensor_size)
+        self.camera_properties = {
+            "Model": self.model,
+            "PixelArraySize": self.sensor_resolution,
+            "PixelArrayActiveAreas": [(0, 0) + self.sensor_resolution],
+            "Location": 2,
+            "Rotation": 0,
+        }
+        self.camera_controls = load_controls()
+        self.controls = {name: value[2] for name, value in self.camera_controls.items()
+                         if value[2] is not None}
+        self.controls["ScalerCrop"] = (0, 0) + self.sensor_resolution
+        self.fps = fps
+        self.config = None
+        self.started = False
+        self.lock = threading.Lock()
+        self.next_due = 0.0
+        self.sequence = 0
+        self.configure(self.create_preview_configuration())
+
+    # ----------------------------
+    # Configuration
+    # ----------------------------
+    def _configuration(self, use_case, main, lores, controls, default_size):
+        main = dict(main or {})
+        main.setdefault("size", self.native_size or default_size)
+        main.setdefault("format", "XBGR8888")
+        config = {"use_case": use_case, "main": main, "lores": None, "controls": dict(controls or {})}
+        if lores:
+            lores = dict(lores)
+            lores.setdefault("format", "YUV420")
+            config["lores"] = lores
+        return config
+
+    def create_preview_configuration(self, main=None, lores=None, controls=None, **kwargs):
+        return self._configuration("preview", main, lores, controls, (640, 480))
+
+    def create_video_configuration(self, main=None, lores=None, controls=None, **kwargs):
+        return self._configuration("video", main, lores, controls, (1280, 720))
+
+    def create_still_configuration(self, main=None, lores=None, controls=None, **kwargs):
+        return self._configuration("still", main, lores, controls, self.sensor_resolution)
+
+    def configure(self, config=None):
+        if self.started:
+            raise RuntimeError("Camera must be stopped before configuring")
+        config = config or self.create_preview_configuration()
+        for stream in ("main", "lores"):
+            if config.get(stream):
+                config[stream]["size"] = tuple(config[stream]["size"])
+        self.config = config
+        self._configured(config)
+        self.set_controls(config.get("controls") or {})
+
+    def _configured(self, config):
+        pass
+
+    def camera_configuration(self):
+        return self.config
+
+    def start(self, config=None):
+        if config is not None:
+            self.configure(config)
+        self.started = True
+        self.next_due = time.monotonic()
+
+    def stop(self):
+        self.started = False
+
+    def close(self):
+        self.stop()
+
+    # ----------------------------
+    # Controls
+    # ----------------------------
+    def set_controls(self, controls):
+        with self.lock:
+            for name, value in controls.items():
+                if name == "FrameRate":
+                    self.fps = float(value)
+                    continue
+                if name not in self.camera_controls:
+                    raise RuntimeError(f"Control {name} is not advertised by libcamera")
+                self.controls[name] = tuple(value) if isinstance(value, list) else value
+                if name == "FrameDurationLimits" and value:
+                    self.fps = 1e6 / max(value[0], 1)
+
+    def frame_duration(self):
+        return 1.0 / max(self.fps, 0.1)
+
+    # ----------------------------
+    # Capture
+    # ----------------------------
+    def capture_request(self, wait=None, flush=None):
+        if not self.started:
+            raise RuntimeError("Camera is not started")
+        # Frames arrive on the sensor's clock, not whenever they are asked for
+        now = time.monotonic()
+        if self.next_due > now:
+            time.sleep(self.next_due - now)
+            now = self.next_due
+        duration = self.frame_duration()
+        self.next_due = max(now, self.next_due) + duration
+        frame, metadata = self._next_frame()
+        self.sequence += 1
+        metadata["SensorTimestamp"] = time.monotonic_ns()
+        metadata["FrameDuration"] = int(duration * 1e6)
+        return CompletedRequest(self, frame, metadata)
+
+    def capture_metadata(self, wait=None):
+        request = self.capture_request()
+        try:
+            return request.get_metadata()
+        finally:
+            request.release()
+
+    def capture_array(self, name="main", wait=None):
+        request = self.capture_request()
+        try:
+            return request.make_array(name)
+        finally:
+            request.release()
+
+    def capture_file(self, file_output, name="main", format=None, wait=None):
+        request = self.capture_request()
+        try:
+            request.save(name, file_output, format=format)
+            return request.get_metadata()
+        finally:
+            request.release()
+
+    def start_encoder(self, encoder=None, output=None, **kwargs):
+        raise RuntimeError(f"The {self.model} camera has no H.264 encoder")
+
+    def stop_encoder(self, encoders=None):
+        pass
+
+    def _next_frame(self):
+        raise NotImplementedError
+
+    def _rgb(self, frame, name):
+        raise NotImplementedError
+
+    def _array(self, frame, name):
+        """Frame as make_array() returns it for the stream's format"""
+        import numpy as np
+        stream = self.config.get(name)
+        if not stream:
+            raise ValueError(f"Stream {name} is not configured")
+        rgb = self._rgb(frame, name)
+        fmt = stream["format"]
+        if fmt in ("YUV420", "YVU420"):
+            # Y plane (BT.601), then the 2x2-subsampled chroma planes packed
+            # row after row into the remaining h/2 rows, as libcamera lays them out
+            h, w = rgb.shape[:2]
+            out = np.empty((h * 3 // 2, w), dtype=np.uint8)
+            rgb = rgb.astype(np.float32)
+            out[:h] = rgb[..., 0] * 0.299 + rgb[..., 1] * 0.587 + rgb[..., 2] * 0.114
+            sub = rgb[::2, ::2]
+            y = sub[..., 0] * 0.299 + sub[..., 1] * 0.587 + sub[..., 2] * 0.114
+            u = np.clip((sub[..., 2] - y) * 0.564 + 128, 0, 255).astype(np.uint8)
+            v = np.clip((sub[..., 0] - y) * 0.713 + 128, 0, 255).astype(np.uint8)
+            if fmt == "YVU420":
+                u, v = v, u
+            out[h:].reshape(-1)[:u.size + v.size] = np.concatenate([u.ravel(), v.ravel()])
+            return out
+        bgr = rgb[..., ::-1]   # RGB888/XBGR8888 are B, G, R in memory order
+        if fmt.startswith("X"):
+            return np.dstack([bgr, np.full(bgr.shape[:2], 255, dtype=np.uint8)])
+        return bgr
+
+    def _save(self, frame, name, file_output, format, quality):
+        format = format or (os.path.splitext(file_output)[1][1:] if isinstance(file_output, str) else "jpeg")
+        image = CompletedRequest(self, frame, {}).make_image(name)
+        image.save(file_output, format=format, quality=quality or 90)
+
+
+class SyntheticCamera(SoftwareCamera):
+    """Moving colour pattern whose brightness follows ExposureTime x AnalogueGain"""
+
+    model = "synthetic"
+    NOMINAL_EXPOSURE = 20000 * 1.0   # exposure (us) x gain rendering the pattern as drawn
+
+    def __init__(self):
+        cfg = CONFIG['camera']
+        self.pattern = None
+        self.test_pattern = cfg['test_pattern']
+        super().__init__(cfg['sensor_size'], cfg['fps'])
+
+    def _configured(self, config):
+        import numpy as np
+        w, h = config["main"]["size"]
+        # A frame and a half of pattern, so each frame is a cheap slice of it
+        x = np.linspace(0, 3 * np.pi, w + w // 2, dtype=np.float32)
+        y = np.linspace(0, 2 * np.pi, h, dtype=np.float32)[:, None]
+        pattern = np.empty((h, w + w // 2, 3), dtype=np.uint8)
+        pattern[..., 0] = (127 + 100 * np.sin(x + y)).astype(np.uint8)
+        pattern[..., 1] = (127 + 100 * np.sin(x * 0.7 - y + 2.0)).astype(np.uint8)
+        pattern[..., 2] = (127 + 100 * np.cos(x * 1.3 + y * 0.5)).astype(np.uint8)
+        # Sharp-edged grid, so focus and detail measurements have something to find
+        pattern[::max(h // 12, 1), :, :] = 235
+        pattern[:, ::max(w // 16, 1), :] = 235
+        self.pattern = pattern
+
+    def _next_frame(self):
+        import numpy as np
+        w, h = self.config["main"]["size"]
+        span = self.pattern.shape[1] - w
+        offset = (self.sequence * 4) % (2 * span) if span else 0
+        offset = 2 * span - offset if offset > span else offset
+        frame = self.pattern[:, offset:offset + w]
+
+        with self.lock:
+            controls = dict(self.controls)
+        exposure = controls.get("ExposureTime", 20000)
+        gain = controls.get("AnalogueGain", 1.0)
+        scale = exposure * gain / self.NOMINAL_EXPOSURE
+        if abs(scale - 1.0) > 0.01:
+            lut = np.clip(np.arange(256, dtype=np.float32) * scale, 0, 255).astype(np.uint8)
+            frame = lut[frame]
+        if self.test_pattern:
+            if frame.base is not None:
+                frame = frame.copy()   # still a view of the shared pattern
+            stamp_pattern(frame, self.sequence, time.time() * 1000.0)
+        lens = controls.get("LensPosition", 1.0)
+        metadata = {
+            "ExposureTime": int(exposure),
+            "AnalogueGain": float(gain),
+            "DigitalGain": 1.0,
+            "ColourGains": tuple(controls.get("ColourGains") or (1.9, 1.6)),
+            "ColourTemperature": 4500,
+            "Lux": round(400.0 * scale, 1),
+            "LensPosition": float(lens),
+            "AfState": 2 if controls.get("AfMode") == 2 else 0,
+            "AfPauseState": 0,
+            "FocusFoM": int(3000 / (1.0 + abs(lens - 1.0))),
+            "ScalerCrop": controls.get("ScalerCrop"),
+            "SensorTemperature": 42.0,
+            "SensorBlackLevels": (4096, 4096, 4096, 4096),
+            "AeLocked": not controls.get("AeEnable", True),
+        }
+        return frame, metadata
+
+    def _rgb(self, frame, name):
+        if name == "main":
+            return frame
+        import numpy as np
+        w, h = self.config[name]["size"]
+        fh, fw = frame.shape[:2]
+        return frame[np.arange(h) * fh // h][:, np.arange(w) * fw // w]
+
+
+class ReplayCamera(SoftwareCamera):
+    """Plays back a directory written by record_replay(), looping at the end
+
+    The JPEG bytes are handed out as recorded, so save(..., format="jpeg")
+    costs nothing; arrays are decoded on demand.
+    """
+
+    model = "replay"
+
+    def __init__(self, directory):
+        if not directory:
+            raise ValueError("LANCAM_REPLAY must name a recorded directory")
+        self.directory = directory
+        with open(os.path.join(directory, "index.json")) as f:
+            index = json.load(f)
+        self.frames = index["frames"]
+        if not self.frames:
+            raise ValueError(f"No frames recorded in {directory}")
+        self.position = 0
+        self.native_size = tuple(index["size"])
+        super().__init__(index.get("sensor_size") or index["size"], index.get("fps") or 30.0)
+
+    def frame_duration(self):
+        # The recorded interval to the next frame, so bursts and stalls replay too
+        entry = self.frames[self.position % len(self.frames)]
+        return entry.get("duration") or super().frame_duration()
+
+    def _next_frame(self):
+        entry = self.frames[self.position % len(self.frames)]
+        self.position += 1
+        with open(os.path.join(self.directory, entry["file"]), "rb") as f:
+            jpeg = f.read()
+        return jpeg, dict(entry.get("metadata") or {})
+
+    def _rgb(self, frame, name):
+        import numpy as np
+        from PIL import Image
+        image = Image.open(io.BytesIO(frame)).convert("RGB")
+        stream = self.config.get(name) or self.config["main"]
+        if image.size != tuple(stream["size"]):
+            image = image.resize(stream["size"])
+        return np.asarray(image)
+
+    def _save(self, frame, name, file_output, format, quality):
+        if name == "main" and (format or "jpeg").lower() in ("jpeg", "jpg") and not quality:
+            if isinstance(file_output, str):
+                with open(file_output, "wb") as f:
+                    f.write(frame)
+            else:
+                file_output.write(frame)
+            return
+        super()._save(frame, name, file_output, format, quality)
+
+
+def record_replay(camera, directory, seconds=10.0):
+    """Capture seconds of frames and metadata from camera into a replay directory"""
+    os.makedirs(directory, exist_ok=True)
+    frames = []
+    previous = None
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        request = camera.capture_request()
+        try:
+            buf = io.BytesIO()
+            request.save("main", buf, format="jpeg")
+            metadata = request.get_metadata()
+        finally:
+            request.release()
+        name = f"frame_{len(frames):06d}.jpg"
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(buf.getvalue())
+        timestamp = metadata.get("SensorTimestamp")
+        if previous is not None and timestamp:
+            frames[-1]["duration"] = (timestamp - previous) / 1e9
+        previous = timestamp
+        frames.append({"file": name, "metadata": {k: v for k, v in metadata.items()
+                                                  if isinstance(v, (int, float, bool, str, list, tuple))}})
+    config = camera.camera_configuration()
+    index = {"size": list(config["main"]["size"]), "sensor_size": list(camera.sensor_resolution),
+             "fps": len(frames) / seconds if seconds else None, "frames": frames}
+    with open(os.path.join(directory, "index.json"), "w") as f:
+        json.dump(index, f)
+    return len(frames)
@@ -1,16 +1,35 @@
 """
 Camera-related routes and streaming functionality (simplified)
 """
-import io
+import itertools
+import threading
 import time
 from flask import Blueprint, Response, request, jsonify
 from functools import wraps
-from . import get_camera, get_lock
+from . import get_analytics, get_camera, get_lock, get_frame_hub, get_media
+from .analytics import lores_stream
+from .metrics import (Gauge, RECONFIGURE_SECONDS, STREAM_BYTES, STREAM_DROPPED,
+                      lock_holder, timed_lock)
+from .tracing import TRACE
 from .utils import validate_camera_settings, validate_focus_settings
 
 
 camera_bp = Blueprint("camera", __name__)
 
+REQUEST_LOCK = lock_holder("request")
+
+# Header of each /stream part: length, then sensor time, hub sequence and send
+# time (epoch ms) for latency measurements. tools/bench.py times this template.
+PART_HEADER = (b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n"
+               b"X-Sensor-Timestamp: %d\r\nX-Frame-Seq: %d\r\nX-Send-Time: %.1f\r\n\r\n")
+
+# Connected /stream clients: id -> {"remote", "fps"} (fps is a moving average)
+stream_clients = {}
+_client_ids = itertools.count(1)
+Gauge("lancam_stream_client_fps", "Frame rate delivered to each /stream client",
+      lambda: {(cid, c["remote"]): round(c["fps"], 2) for cid, c in list(stream_clients.items())},
+      labels=("client", "remote"))
+
 
 # ----------------------------
 # Helpers
@@ -22,8 +41,7 @@ def with_camera(func):
         picam2 = get_camera()
         if picam2 is None:
             return jsonify({"success": False, "message": "Camera not available"}), 503
-        lock = get_lock()
-        with lock:
+        with timed_lock(get_lock(), REQUEST_LOCK):
             return func(picam2, *args, **kwargs)
     return wrapper
 
@@ -38,29 +56,52 @@ def error_response(msg, code=400):
 @camera_bp.route("/stream")
 def stream():
     """MJPEG Preview Stream"""
-    def generate():
-        picam2 = get_camera()
-        lock = get_lock()
+    remote = request.remote_addr
 
-        if picam2 is None:
+    def generate():
+        hub = get_frame_hub()
+        if get_camera() is None or hub is None:
             while True:
                 yield (b"--frame\r\nContent-Type: text/plain\r\n\r\nCamera not available\r\n")
                 time.sleep(1)
 
-        while True:
-            with lock:
-                try:
-                    buf = io.BytesIO()
-                    picam2.capture_file(buf, format="jpeg")
-                    frame = buf.getvalue()
-                except Exception as e:
-                    yield (b"--frame\r\nContent-Type: text/plain\r\n\r\n"
-                           + f"Camera error: {e}".encode() + b"\r\n")
-                    time.sleep(1)
+        # Every client shares the hub's single capture and JPEG encode
+        hub.subscribe()
+        client_id = next(_client_ids)
+        client = stream_clients[client_id] = {"remote": remote, "fps": 0.0}
+        # Named for /api/debug/profile; server threads are reused, so restore afterwards
+        thread = threading.current_thread()
+        thread_name, thread.name = thread.name, f"stream-client-{client_id}"
+        try:
+            seq = 0
+            last = time.monotonic()
+            while True:
+                previous = seq
+                seq, frame, timestamp = hub.wait_frame(seq)
+                if frame is None:
+                    if hub.error:
+                        yield (b"--frame\r\nContent-Type: text/plain\r\n\r\n"
+                               + hub.error.encode() + b"\r\n")
+                        time.sleep(1)
                     continue
-
-            yield (b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + frame + b"\r\n")
-            time.sleep(0.03)  # ~30 fps
+                if previous and seq > previous + 1:
+                    # This client was too slow to take every frame
+                    STREAM_DROPPED.inc(seq - previous - 1)
+                t_send = time.perf_counter()
+                # The server writes the part to the socket before resuming us
+                yield (PART_HEADER % (len(frame), timestamp or 0, seq, time.time() * 1000.0)
+                       + frame + b"\r\n")
+                if TRACE.enabled:
+                    TRACE.add("send", t_send, time.perf_counter(), {"seq": seq, "client": client_id})
+                STREAM_BYTES.inc(len(frame))
+                now = time.monotonic()
+                if now > last:
+                    client["fps"] += 0.1 * (1.0 / (now - last) - client["fps"])
+                last = now
+        finally:
+            stream_clients.pop(client_id, None)
+            thread.name = thread_name
+            hub.unsubscribe()
 
     return Response(generate(), mimetype="multipart/x-mixed-replace; boundary=frame")
 
@@ -144,6 +185,51 @@ def set_gain(picam2):
         return error_response(str(e), 400)
 
 
+@camera_bp.route("/api/camera/auto_exposure", methods=["POST"])
+def auto_exposure():
+    """Converge exposure on the stones: {"mode": "fluorescence", "roi": [x, y, w, h], "target": 110}
+
+    Not under the camera lock: the frame hub needs it to deliver the frames
+    the controller meters.
+    """
+    analytics = get_analytics()
+    controller = analytics.get("ae") if analytics is not None else None
+    if controller is None:
+        return error_response("Auto-exposure not available", 503)
+    if get_camera() is None:
+        return error_response("Camera not available", 503)
+
+    data = request.json or {}
+    mode = data.get("mode", "default")
+    roi = data.get("roi")
+    target = data.get("target")
+    if not isinstance(mode, str) or not mode:
+        return error_response("mode must be a name such as fluorescence")
+    if roi is not None:
+        if (not isinstance(roi, list) or len(roi) != 4
+                or not all(isinstance(v, (int, float)) and 0 <= v <= 1 for v in roi)
+                or roi[2] <= 0 or roi[3] <= 0):
+            return error_response("roi must be [x, y, w, h] as fractions of the frame")
+    if target is not None and (not isinstance(target, (int, float)) or not 1 <= target <= 250):
+        return error_response("target must be between 1 and 250")
+
+    try:
+        result = controller.converge(mode, roi, target)
+    except RuntimeError as e:
+        return error_response(str(e), 409)
+    return jsonify({"success": True, "data": result})
+
+
+@camera_bp.route("/api/camera/auto_exposure")
+def auto_exposure_status():
+    """Converged settings per mode and recent convergence results"""
+    analytics = get_analytics()
+    controller = analytics.get("ae") if analytics is not None else None
+    if controller is None:
+        return error_response("Auto-exposure not available", 503)
+    return jsonify({"success": True, "data": controller.status()})
+
+
 @camera_bp.route("/api/camera/zoom", methods=["POST"])
 def set_zoom():
     """Set camera zoom level"""
@@ -168,7 +254,7 @@ def set_zoom():
         y = (full_h - new_h) // 2
         crop = (x, y, new_w, new_h)
 
-        with lock:
+        with timed_lock(lock, REQUEST_LOCK):
             picam2.set_controls({"ScalerCrop": crop})
 
         return jsonify({"success": True, "zoom": zoom_level})
@@ -181,6 +267,9 @@ def set_zoom():
 def start_camera(picam2):
     if not picam2.started:
         picam2.start()
+        media = get_media()
+        if media is not None:
+            media.resume()
     return jsonify({"success": True, "message": "Camera started"})
 
 
@@ -188,6 +277,9 @@ def start_camera(picam2):
 @with_camera
 def stop_camera(picam2):
     if picam2.started:
+        media = get_media()
+        if media is not None:
+            media.suspend()
         picam2.stop()
     return jsonify({"success": True, "message": "Camera stopped"})
 
@@ -205,11 +297,18 @@ def set_camera(picam2):
     try:
         config = picam2.create_video_configuration(
             main={"size": (width, height)},
+            lores=lores_stream((width, height)),
             controls={"FrameRate": fps},
         )
-        picam2.stop()
-        picam2.configure(config)
-        picam2.start()
+        media = get_media()
+        with RECONFIGURE_SECONDS.time():
+            if media is not None:
+                media.suspend()
+            picam2.stop()
+            picam2.configure(config)
+            picam2.start()
+            if media is not None:
+                media.resume()
         return jsonify({"success": True, "message": "Camera settings updated"})
     except Exception as e:
         return error_response(str(e), 500)
@@ -0,0 +1,101 @@
+"""
+Certificate generation endpoints
+"""
+import os
+from flask import Blueprint, request, jsonify, send_file, send_from_directory, url_for
+from . import get_certificates, get_history
+from .certificates import PDF_NAME, PNG_NAME
+
+
+certificate_bp = Blueprint("certificates", __name__)
+
+FORM_FIELDS = ("date", "customer", "stone_details", "description", "natural", "cvd", "hpht", "refer")
+MAX_BATCH = 1000
+
+
+def error_response(msg, code=400):
+    return jsonify({"success": False, "message": msg}), code
+
+
+def form_fields(data):
+    return {f: data.get(f) for f in FORM_FIELDS if f in data}
+
+
+def certificate_urls(scan_id, certificate_no):
+    if scan_id is not None:
+        return {fmt: url_for("certificates.scan_certificate", scan_id=scan_id, fmt=fmt) for fmt in ("pdf", "png")}
+    return {fmt: url_for("certificates.certificate_file", name=f"{certificate_no}.{fmt}") for fmt in ("pdf", "png")}
+
+
+@certificate_bp.route("/api/certificates", methods=["POST"])
+def generate_certificate():
+    """Render one certificate, for a history scan (scan_id) or from form fields only"""
+    service = get_certificates()
+    if service is None:
+        return error_response("Certificate rendering not available", 503)
+
+    data = request.json or {}
+    scan = None
+    if data.get("scan_id") is not None:
+        try:
+            scan_id = int(data["scan_id"])
+        except (TypeError, ValueError):
+            return error_response("scan_id must be an integer")
+        store = get_history()
+        scan = store.get_scan(scan_id) if store is not None else None
+        if scan is None:
+            return error_response("Scan not found", 404)
+
+    try:
+        info = service.render(form_fields(data), scan)
+    except Exception as e:
+        return error_response(str(e), 500)
+    return jsonify({"success": True, "certificate_no": info["certificate_no"],
+                    "urls": certificate_urls(scan["id"] if scan else None, info["certificate_no"])})
+
+
+@certificate_bp.route("/api/certificates/batch", methods=["POST"])
+def generate_batch():
+    """Render certificates for every scan of a lot (or a list of scan_ids) in the background"""
+    service = get_certificates()
+    store = get_history()
+    if service is None or store is None:
+        return error_response("Certificate rendering not available", 503)
+
+    data = request.json or {}
+    try:
+        scans = store.select_scans(lot=data.get("lot"), scan_ids=data.get("scan_ids"), limit=MAX_BATCH)
+    except (TypeError, ValueError):
+        return error_response("scan_ids must be a list of integers")
+    if not scans:
+        return error_response("No scans selected")
+
+    job = service.render_batch(scans, form_fields(data))
+    return jsonify({
+        "success": True,
+        "job": job.to_dict(),
+        "status_url": url_for("events.job_status", job_id=job.id),
+        "events_url": url_for("events.job_events", job_id=job.id),
+    }), 202
+
+
+@certificate_bp.route("/api/certificates/scan/<int:scan_id>.<fmt>")
+def scan_certificate(scan_id, fmt):
+    store = get_history()
+    if store is None:
+        return error_response("History not available", 503)
+    scan = store.get_scan(scan_id)
+    if scan is None or not scan["folder"] or fmt not in ("pdf", "png"):
+        return error_response("Certificate not found", 404)
+    path = os.path.join(store.folder_path(scan["folder"]), PDF_NAME if fmt == "pdf" else PNG_NAME)
+    if not os.path.exists(path):
+        return error_response("Certificate not generated yet", 404)
+    return send_file(path, conditional=True, etag=True)
+
+
+@certificate_bp.route("/api/certificates/file/<name>")
+def certificate_file(name):
+    service = get_certificates()
+    if service is None:
+        return error_response("Certificate rendering not available", 503)
+    return send_from_directory(service.directory, name, conditional=True)
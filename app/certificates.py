@@ -0,0 +1,255 @@
+"""
+Certificate rendering (PDF plus PNG preview)
+
+The layout in certificate_layout.json is parsed once per process together
+with its fonts, logo and static artwork into a base page. Rendering a
+certificate copies that page and draws only the per-stone text, the QR code
+and the capture thumbnail. Without the qrcode package certificates carry no
+QR code and no "verify" line, and are reported as not verifiable. Lot batches are spread across a process pool that
+is forked at startup, with progress published as job events.
+"""
+import importlib.util
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .config import CONFIG
+from .derivatives import derivative_path, primary_capture
+from .events import Job
+from .history import folder_size
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYOUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "certificate_layout.json")
+PDF_NAME = "certificate.pdf"
+PNG_NAME = "certificate.png"
+SCAN_TYPES = ("natural", "cvd", "hpht")
+
+
+# ----------------------------
+# Template (one per process)
+# ----------------------------
+def _load_font(name, size):
+    from PIL import ImageFont
+
+    try:
+        # Pillow also searches the system font directories for bare names
+        return ImageFont.truetype(name, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+class CertificateTemplate:
+    """Parsed layout, loaded fonts and the pre-drawn static page"""
+
+    def __init__(self, path=LAYOUT_PATH):
+        from PIL import Image, ImageDraw
+
+        with open(path) as f:
+            self.layout = json.load(f)
+        layout = self.layout
+        self.fonts = {key: _load_font(name, size) for key, (name, size) in layout["fonts"].items()}
+
+        page = Image.new("RGB", tuple(layout["size"]), layout["background"])
+        draw = ImageDraw.Draw(page)
+        self.verifiable = importlib.util.find_spec("qrcode") is not None
+
+        draw.rectangle(layout["border"]["box"], outline=layout["accent"], width=layout["border"]["width"])
+        draw.rectangle(layout["rule"]["box"], fill=layout["accent"])
+
+        logo = layout.get("logo")
+        if logo and os.path.exists(os.path.join(ROOT_DIR, logo["path"])):
+            self._paste_fit(page, Image.open(os.path.join(ROOT_DIR, logo["path"])), logo["box"])
+
+        title = layout["title"]
+        draw.text(title["xy"], title["text"], font=self.fonts[title["font"]], fill=layout["foreground"])
+        for field in layout["fields"]:
+            draw.text(field["xy"], f"{field['label']}:", font=self.fonts["label"], fill=layout["accent"])
+        footer = layout["footer"]
+        footer_text = footer["text"] if self.verifiable else footer.get("unverified_text", "")
+        draw.text(footer["xy"], footer_text, font=self.fonts[footer["font"]], fill=layout["foreground"])
+        draw.rectangle(layout["image"]["box"], outline=layout["image"]["outline"], width=2)
+        self.page = page
+
+    @staticmethod
+    def _paste_fit(page, image, box):
+        """Scale image into box keeping aspect ratio, centered"""
+        x0, y0, x1, y1 = box
+        image = image.convert("RGBA")
+        image.thumbnail((x1 - x0, y1 - y0))
+        x = x0 + ((x1 - x0) - image.width) // 2
+        y = y0 + ((y1 - y0) - image.height) // 2
+        page.paste(image, (x, y), image)
+
+    def qr_image(self, text):
+        """QR code encoding text, or None when qrcode is missing (never a stand-in image)"""
+        if not self.verifiable:
+            return None
+        import qrcode
+        qr = qrcode.QRCode(border=1, error_correction=qrcode.constants.ERROR_CORRECT_M)
+        qr.add_data(text)
+        qr.make(fit=True)
+        return qr.make_image(fill_color="black", back_color="white").convert("RGB")
+
+    def render(self, data, pdf_path, png_path, capture_path=None, qr_text=None):
+        from PIL import Image, ImageDraw
+
+        layout = self.layout
+        page = self.page.copy()
+        draw = ImageDraw.Draw(page)
+        for field in layout["fields"]:
+            value = data.get(field["key"])
+            if value:
+                x, y = field["xy"]
+                draw.text((x + layout["value_offset"], y), str(value), font=self.fonts["value"],
+                          fill=layout["foreground"])
+
+        if capture_path:
+            box = layout["image"]["box"]
+            # Prefer the cached preview derivative; otherwise let the JPEG decoder downscale
+            preview = derivative_path(capture_path, "preview")
+            image = Image.open(preview if os.path.exists(preview) else capture_path)
+            image.draft("RGB", (box[2] - box[0], box[3] - box[1]))
+            self._paste_fit(page, image, box)
+
+        qr = self.qr_image(qr_text) if qr_text else None
+        if qr is not None:
+            x0, y0, x1, y1 = layout["qr"]["box"]
+            page.paste(qr.resize((x1 - x0, y1 - y0), Image.NEAREST), (x0, y0))
+
+        page.save(pdf_path, "PDF", resolution=layout["dpi"])
+        width = layout["preview_width"]
+        preview_img = page.resize((width, round(page.height * width / page.width)), Image.BILINEAR)
+        preview_img.save(png_path, "PNG", optimize=False)
+        return os.path.getsize(pdf_path) + os.path.getsize(png_path)
+
+
+_template = None
+
+
+def get_template():
+    global _template
+    if _template is None:
+        _template = CertificateTemplate()
+    return _template
+
+
+def _init_worker():
+    get_template()
+
+
+def _render_task(data, pdf_path, png_path, capture_path, qr_text):
+    t0 = time.perf_counter()
+    template = get_template()
+    size = template.render(data, pdf_path, png_path, capture_path, qr_text)
+    return {"bytes": size, "render_ms": (time.perf_counter() - t0) * 1000.0, "verifiable": template.verifiable}
+
+
+# ----------------------------
+# Service (Flask process side)
+# ----------------------------
+def certificate_data(scan, fields):
+    """Merge per-scan history data with the fields entered on the certificate screen"""
+    data = {}
+    if scan:
+        data.update({
+            "certificate_no": f"{scan['id']:08d}",
+            "lot": scan["lot"],
+            "stone_details": " ".join(v for v in (scan["name"], scan["size"]) if v),
+            "description": scan["remark"],
+        })
+        scan_type = scan["type"].lower()
+        if scan_type in SCAN_TYPES:
+            data[scan_type] = "Yes"
+    data.update({k: v for k, v in fields.items() if v not in (None, "")})
+    # Timestamp plus a random suffix: two renders in the same second must not share files
+    data.setdefault("certificate_no", f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}")
+    # The number names the output files
+    data["certificate_no"] = re.sub(r"[^\w-]", "_", str(data["certificate_no"]))[:64]
+    data.setdefault("date", time.strftime("%d/%m/%Y"))
+    return data
+
+
+class CertificateService:
+    """Renders certificates in a process pool forked before the camera starts"""
+
+    def __init__(self, history=None):
+        cfg = CONFIG['certificates']
+        self.history = history
+        self.directory = cfg['dir']
+        self.verify_url = cfg['verify_url']
+        os.makedirs(self.directory, exist_ok=True)
+        if importlib.util.find_spec("qrcode") is None:
+            print("qrcode is not installed: certificates are rendered without a QR code")
+        self.pool = ProcessPoolExecutor(
+            max_workers=cfg['workers'],
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+        )
+        # With fork, the first submit starts every worker; do it now, while
+        # the process has no camera or request threads.
+        self.pool.submit(time.time).result()
+
+    def paths(self, data, scan=None):
+        if scan and scan["folder"] and self.history is not None:
+            folder = self.history.folder_path(scan["folder"])
+            return os.path.join(folder, PDF_NAME), os.path.join(folder, PNG_NAME), primary_capture(folder)
+        base = os.path.join(self.directory, data["certificate_no"])
+        return base + ".pdf", base + ".png", None
+
+    def _submit(self, data, scan=None):
+        pdf_path, png_path, capture = self.paths(data, scan)
+        os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+        qr_text = self.verify_url.format(no=data["certificate_no"])
+        future = self.pool.submit(_render_task, data, pdf_path, png_path, capture, qr_text)
+        return future, {"certificate_no": data["certificate_no"], "pdf": pdf_path, "png": png_path}
+
+    def _account(self, scan):
+        """Keep the scan's byte count (and the storage gauge) in step with new files"""
+        if scan and scan["folder"] and self.history is not None:
+            self.history.set_scan_bytes(scan["id"], folder_size(self.history.folder_path(scan["folder"])))
+
+    def render(self, fields, scan=None):
+        data = certificate_data(scan, fields)
+        future, info = self._submit(data, scan)
+        info.update(future.result())
+        self._account(scan)
+        return info
+
+    def render_batch(self, scans, fields):
+        """Start rendering one certificate per scan; returns the progress Job"""
+        job = Job("certificates", total=len(scans))
+        threading.Thread(target=self._run_batch, args=(job, scans, fields),
+                         name=f"certificates-{job.id}", daemon=True).start()
+        return job
+
+    def _run_batch(self, job, scans, fields):
+        futures = {}
+        for scan in scans:
+            try:
+                future, info = self._submit(certificate_data(scan, fields), scan)
+                futures[future] = (scan, info)
+            except Exception as e:
+                job.error(f"scan {scan['id']}: {e}")
+                job.advance()
+
+        rendered = []
+        for future in as_completed(futures):
+            scan, info = futures[future]
+            try:
+                result = future.result()
+                self._account(scan)
+                rendered.append(info["certificate_no"])
+                job.advance(bytes=result["bytes"])
+            except Exception as e:
+                job.error(f"scan {scan['id']}: {e}")
+                job.advance()
+        job.finish({"certificates": len(rendered)})
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,183 @@
+"""
+Pre-event ring buffer and "Save clip"
+
+While armed, the last few seconds of preview frames are kept in memory as
+the JPEG bytes the frame hub already encoded for /stream; the ring is bounded
+by bytes as well as by age, so a busy high-resolution preview cannot grow it
+past its budget. Saving a clip writes the buffered pre-roll followed by live
+frames for the requested post-roll into an MJPEG AVI (ffmpeg -c:v copy), so
+no frame is decoded or encoded again.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from .config import CONFIG
+from .events import Job
+from .supervisor import Supervisor
+
+
+class _Clip:
+    """Live frames handed from the capture thread to one clip writer"""
+
+    def __init__(self, until):
+        self.until = until
+        self.queue = queue.Queue(maxsize=256)
+        self.dropped = 0
+
+    def offer(self, frame, at):
+        try:
+            self.queue.put_nowait((at, frame))
+        except queue.Full:
+            self.dropped += 1
+
+
+class PreRollBuffer:
+    """Byte- and time-bounded ring of recent JPEG frames fed by the frame hub"""
+
+    def __init__(self, hub, catalog=None):
+        cfg = CONFIG['clips']
+        self.hub = hub
+        self.catalog = catalog
+        self.seconds = cfg['preroll_s']
+        self.max_bytes = cfg['max_mb'] * 1024 * 1024
+        self.directory = CONFIG['media']['recordings']
+        self.lock = threading.Lock()
+        self.frames = deque()      # (monotonic time, jpeg)
+        self.bytes = 0
+        self.clips = []
+        self.armed = False
+
+    def arm(self, seconds=None):
+        with self.lock:
+            if seconds is not None:
+                self.seconds = float(seconds)
+            if self.armed:
+                return
+            self.armed = True
+        # Keeps the capture loop running even with no /stream client
+        self.hub.subscribe()
+        self.hub.add_listener(self._on_frame)
+
+    def disarm(self):
+        with self.lock:
+            if not self.armed:
+                return
+            self.armed = False
+            self.frames.clear()
+            self.bytes = 0
+        self.hub.remove_listener(self._on_frame)
+        self.hub.unsubscribe()
+
+    def _on_frame(self, frame, timestamp):
+        now = time.monotonic()
+        with self.lock:
+            self.frames.append((now, frame))
+            self.bytes += len(frame)
+            while self.frames and (self.bytes > self.max_bytes or now - self.frames[0][0] > self.seconds):
+                self.bytes -= len(self.frames.popleft()[1])
+            for clip in self.clips:
+                clip.offer(frame, now)
+
+    def status(self):
+        with self.lock:
+            span = self.frames[-1][0] - self.frames[0][0] if len(self.frames) > 1 else 0.0
+            return {
+                "armed": self.armed,
+                "preroll_s": self.seconds,
+                "buffered_s": round(span, 2),
+                "frames": len(self.frames),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "saving": len(self.clips),
+            }
+
+    # ----------------------------
+    # Saving
+    # ----------------------------
+    def save_clip(self, post_seconds):
+        """Write pre-roll plus post_seconds of live frames in the background; returns the Job"""
+        if not self.armed:
+            raise RuntimeError("Pre-roll buffer is not armed")
+        clip = _Clip(time.monotonic() + post_seconds)
+        with self.lock:
+            # Snapshot and registration together, so no frame is missed or doubled
+            snapshot = list(self.frames)
+            self.clips.append(clip)
+        job = Job("clip", total=len(snapshot))
+        threading.Thread(target=self._write, args=(job, clip, snapshot),
+                         name=f"clip-{job.id}", daemon=True).start()
+        return job
+
+    def _write(self, job, clip, snapshot):
+        path = self._reserve_path()
+        fps = self._frame_rate(snapshot)
+        child = Supervisor(f"ffmpeg-clip-{job.id}", lambda: [
+            "ffmpeg", "-hide_banner", "-loglevel", "warning", "-nostdin", "-nostats", "-progress", "pipe:1",
+            "-f", "mjpeg", "-framerate", f"{fps:.3f}", "-i", "pipe:0", "-c:v", "copy", "-y", path,
+        ], stdin=True, restart=False)
+        try:
+            child.start()
+            stdin = child.process.stdin
+            for _, frame in snapshot:
+                stdin.write(frame)
+                job.advance(bytes=len(frame))
+            while True:
+                remaining = clip.until - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    at, frame = clip.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if at > clip.until:
+                    break
+                stdin.write(frame)
+                job.total += 1
+                job.advance(bytes=len(frame))
+        except (OSError, ValueError) as e:
+            job.error(str(e))
+        finally:
+            with self.lock:
+                self.clips.remove(clip)
+            child.stop(timeout=30)
+
+        if clip.dropped:
+            job.error(f"{clip.dropped} live frames dropped")
+        if child.exit_code != 0 or not os.path.exists(path) or not os.path.getsize(path):
+            job.error(f"ffmpeg exited with {child.exit_code}: {' '.join(list(child.log)[-2:])}")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            job.finish(state="failed")
+            return
+        if self.catalog is not None:
+            self.catalog.add_file(path)
+        job.finish({"filename": os.path.basename(path), "path": path, "fps": round(fps, 2),
+                    "bytes": os.path.getsize(path)})
+
+    def _reserve_path(self):
+        """Create the clip file exclusively, so two saves in one second get separate files"""
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("clip_%Y%m%d_%H%M%S")
+        n = 1
+        path = os.path.join(self.directory, f"{stamp}.avi")
+        while True:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return path
+            except FileExistsError:
+                n += 1
+                path = os.path.join(self.directory, f"{stamp}_{n}.avi")
+
+    @staticmethod
+    def _frame_rate(snapshot):
+        """Average rate of the buffered frames; the clip is written at a constant rate"""
+        if len(snapshot) > 1:
+            span = snapshot[-1][0] - snapshot[0][0]
+            if span > 0:
+                return (len(snapshot) - 1) / span
+        return 30.0
@@ -0,0 +1,151 @@
+"""
+Application configuration
+"""
+import os
+
+
+# Root directory for everything the device writes (models, captures, indexes)
+DATA_DIR = os.environ.get("LANCAM_DATA", os.path.join(os.path.expanduser("~"), "lancam_data"))
+
+
+CONFIG = {
+    'paths': {
+        'data': DATA_DIR,
+        'models': os.path.join(DATA_DIR, "models"),
+    },
+    'cache': {
+        'dir': os.path.join(DATA_DIR, "cache"),
+        'memory_mb': 64,
+        'disk_mb': 2048,
+    },
+    'history': {
+        'db': os.path.join(DATA_DIR, "history.db"),
+        'captures': os.path.join(DATA_DIR, "captures"),  # scan folders live here
+    },
+    'derivatives': {
+        'workers': 2,
+        'quality': 80,
+        'disk_mb': 1024,           # LRU budget for thumbnails and previews
+    },
+    'certificates': {
+        'dir': os.path.join(DATA_DIR, "certificates"),  # certificates not tied to a scan
+        'workers': 2,
+        'verify_url': os.environ.get("LANCAM_VERIFY_URL", "https://trusure.example/verify/{no}"),
+    },
+    'export': {
+        'dir': os.path.join(DATA_DIR, "exports"),       # "Save to Disk" target
+        'usb_roots': ["/media", "/mnt"],               # where USB drives are mounted
+        'sync_mb': 8,                                  # fsync interval while writing
+    },
+    'downloads': {
+        # nginx internal location mapped to DATA_DIR, e.g. "/protected"; empty serves from Flask
+        'accel_prefix': os.environ.get("LANCAM_ACCEL_PREFIX", ""),
+        'x_sendfile': os.environ.get("LANCAM_X_SENDFILE", "0") == "1",
+    },
+    'upload': {
+        'url': os.environ.get("LANCAM_UPLOAD_URL", ""),  # empty disables the workers
+        'token': os.environ.get("LANCAM_UPLOAD_TOKEN", ""),
+        'db': os.path.join(DATA_DIR, "uploads.db"),
+        'workers': 2,              # concurrent connections
+        'chunk_kb': 1024,          # resumable chunk size for large files
+        'small_kb': 256,           # files up to this size are batched
+        'batch_kb': 2048,          # max bytes per batch request
+        'batch_items': 32,
+        'max_attempts': 12,
+        'backoff_min': 2.0,        # seconds, doubled per attempt
+        'backoff_max': 600.0,
+        'timeout': 30.0,
+    },
+    'mail': {
+        'host': os.environ.get("LANCAM_SMTP_HOST", ""),  # empty disables sending
+        'port': int(os.environ.get("LANCAM_SMTP_PORT", "25")),
+        'security': os.environ.get("LANCAM_SMTP_SECURITY", "none"),  # none, starttls or ssl
+        'user': os.environ.get("LANCAM_SMTP_USER", ""),
+        'password': os.environ.get("LANCAM_SMTP_PASSWORD", ""),
+        'sender': os.environ.get("LANCAM_MAIL_FROM", "lancam@localhost"),
+        'per_session': 50,         # messages sent before the SMTP session is recycled
+        'idle_s': 60,              # close the session after this long without mail
+        'max_mb': 20,              # attachments per message; larger selections are split
+        'max_attempts': 3,
+        'backoff': 5.0,            # seconds, doubled per attempt
+        'timeout': 30.0,
+    },
+    'camera': {
+        'backend': os.environ.get("LANCAM_CAMERA", "picamera2"),  # picamera2, synthetic or replay
+        'replay': os.environ.get("LANCAM_REPLAY", ""),   # directory written by record_replay()
+        'sensor_size': (4608, 2592),   # synthetic sensor (Camera Module 3)
+        'fps': 30.0,               # synthetic frame rate until FrameRate is set
+        # Synthetic frames carry counter + capture time for glass-to-glass latency
+        'test_pattern': os.environ.get("LANCAM_TEST_PATTERN", "0") == "1",
+    },
+    'media': {
+        'recordings': os.path.join(DATA_DIR, "recordings"),
+        'bitrate': 4_000_000,      # shared H.264 encode, bits/s
+        'keyframe_interval': 30,   # frames; also the longest a new sink waits to start
+        'sink_queue': 240,         # encoded frames buffered per sink before dropping
+        'segment_s': 60,           # recording segment length, seconds
+        'rtsp_url': os.environ.get("LANCAM_RTSP_URL", "rtsp://127.0.0.1:8554/live"),
+    },
+    'clips': {
+        'preroll_s': 10.0,         # seconds of preview kept before "Save clip"
+        'max_mb': 48,              # hard memory bound of the pre-roll ring
+        'post_s': 5.0,             # default live seconds appended after the press
+        'max_post_s': 60.0,
+        'auto_arm': os.environ.get("LANCAM_PREROLL", "0") == "1",
+    },
+    'analytics': {
+        'lores_width': 320,        # YUV420 analysis stream; height follows the main aspect
+        'exposure_every': 3,       # analyse every Nth preview frame
+        'histogram_bins': 64,      # power of two
+        'clip_high': 250,          # 8-bit levels counted as clipped
+        'clip_low': 5,
+        'target_luma': 110.0,      # mean Y that ev_to_target aims at
+        'peaking_every': 3,
+        'peaking_threshold': 40,   # |dx| + |dy| of Y counted as an in-focus edge
+        'peaking_max_fraction': 0.08,  # at most this share of pixels marked; threshold rises
+    },
+    'auto_exposure': {
+        'target': 110.0,           # mean lores Y of the stones
+        'tolerance_ev': 0.1,       # converged within this many stops of target
+        'tray_level': 16,          # Y at or below this is tray, not stone
+        'min_stone_fraction': 0.005,  # fewer stone pixels: meter the brightest ones instead
+        'max_step_ev': 3.0,        # largest correction per step
+        'max_steps': 8,
+        'settle_frames': 6,        # frames to wait for new settings to show in metadata
+        'timeout_s': 5.0,
+        'min_exposure': 100,       # us
+        'max_exposure': 500000,
+        'max_gain': 16.0,
+    },
+    'calibration': {
+        'dir': os.path.join(DATA_DIR, "calibration"),
+        'frames': 16,              # frames averaged per dark frame / flat field
+        'exposure_tolerance': 0.1, # a calibration serves exposures and gains within 10%
+        'max_gain': 4.0,           # strongest per-pixel flat-field boost
+        'max_age_days': 30,        # older calibrations are flagged stale
+        'max_temperature_drift': 8.0,  # C of sensor temperature change flagged stale
+    },
+    'debug': {
+        'trace': os.environ.get("LANCAM_TRACE", "0") == "1",  # can also be switched at runtime
+        'trace_spans': 20000,      # ring size; about 10 minutes of one 30 fps stream
+        'profile_hz': 100,         # default sampling rate of /api/debug/profile
+        'profile_max_hz': 1000,
+        'profile_max_s': 120,
+    },
+    'retention': {
+        'interval': 15 * 60,       # seconds between purge runs
+        'batch_size': 20,          # scans fetched per batch
+        'slice_ms': 50,            # max time spent deleting per batch
+        'pause_ms': 200,           # sleep between batches
+    },
+    'inference': {
+        'model': "stone_classifier.onnx",
+        'model_int8': "stone_classifier.int8.onnx",
+        'use_int8': os.environ.get("LANCAM_INT8", "1") == "1",
+        'input_size': 96,          # crops are resized to input_size x input_size
+        'threads': 3,              # leave one Pi core for capture and Flask
+        'warmup_batch': 16,        # typical number of stones on a tray
+        'timeout': 30.0,           # seconds to wait for a batch result
+        'labels': ["natural", "cvd", "hpht", "simulant"],
+    },
+}
@@ -2,11 +2,21 @@
 Control routes and other device endpoints
 """
 import os
-from flask import Blueprint, send_from_directory
+import time
+from datetime import datetime
+from flask import Blueprint, Response, jsonify, send_from_directory
+from . import get_camera, get_lock, get_frame_hub, get_media, get_result_cache
+from .config import CONFIG
+from .metrics import render as render_metrics
+from .supervisor import supervised
 
 
 control_bp = Blueprint('control', __name__)
 
+STARTED = time.time()
+STATUS_CONTROLS = ("ExposureTime", "AnalogueGain", "ColourGains", "AfMode", "LensPosition",
+                   "AeEnable", "AwbEnable", "Brightness", "Contrast", "Saturation")
+
 
 @control_bp.route("/")
 def index():
@@ -14,3 +24,54 @@ def index():
     # Get the absolute path to the Frontend directory
     frontend_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'Frontend')
     return send_from_directory(frontend_dir, "index.html")
+
+
+@control_bp.route("/api/system/status")
+def system_status():
+    """Camera, streaming and per-process health"""
+    picam2 = get_camera()
+    camera = {"initialized": picam2 is not None}
+    controls = {}
+    if picam2 is not None:
+        try:
+            camera["started"] = picam2.started
+            camera["resolution"] = picam2.camera_configuration()["main"]["size"]
+            # Don't queue behind a long camera operation just to report status
+            lock = get_lock()
+            if lock.acquire(timeout=0.5):
+                try:
+                    metadata = picam2.capture_metadata()
+                finally:
+                    lock.release()
+                controls = {k: metadata[k] for k in STATUS_CONTROLS
+                            if isinstance(metadata.get(k), (int, float, bool, str, list, tuple))}
+        except Exception as e:
+            controls = {"error": str(e)}
+
+    media = get_media()
+    hub = get_frame_hub()
+    cache = get_result_cache()
+    return jsonify({
+        "success": True,
+        "data": {
+            "camera": camera,
+            "controls": controls,
+            "streaming": {
+                "mjpeg": hub.status() if hub is not None else None,
+                **(media.status() if media is not None else {}),
+            },
+            "processes": supervised(),
+            "result_cache": cache.status() if cache is not None else None,
+            "system": {
+                "timestamp": datetime.now().isoformat(),
+                "uptime_s": round(time.time() - STARTED, 1),
+                "recordings_path": CONFIG['media']['recordings'],
+            },
+        },
+    })
+
+
+@control_bp.route("/metrics")
+def metrics():
+    """Prometheus text exposition of the pipeline metrics"""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,114 @@
+"""
+Debugging endpoints: pipeline tracing, the sampling profiler and latency reports
+"""
+import threading
+import time
+from collections import deque
+from flask import Blueprint, Response, request, jsonify
+from .config import CONFIG
+from .metrics import GLASS_TO_GLASS
+from .profiler import Sampler
+from .tracing import TRACE
+
+
+debug_bp = Blueprint("debug", __name__)
+
+# Recent glass-to-glass samples (seconds) reported by latency overlays
+latency_samples = deque(maxlen=2000)
+latency_lock = threading.Lock()
+
+
+def error_response(msg, code=400):
+    return jsonify({"success": False, "message": msg}), code
+
+
+@debug_bp.route("/api/debug/trace")
+def trace():
+    """Recorded spans of the last `seconds` (default: the whole ring) as Chrome trace JSON"""
+    try:
+        seconds = float(request.args.get("seconds", 0))
+    except ValueError:
+        return error_response("seconds must be a number")
+    if seconds < 0:
+        return error_response("seconds must not be negative")
+    response = jsonify(TRACE.chrome_trace(seconds or None))
+    response.headers["Content-Disposition"] = "attachment; filename=lancam_trace.json"
+    return response
+
+
+@debug_bp.route("/api/debug/trace", methods=["POST"])
+def set_trace():
+    """Switch tracing on or off: {"enabled": true}"""
+    data = request.json or {}
+    if not isinstance(data.get("enabled"), bool):
+        return error_response("enabled must be true or false")
+    TRACE.enable(data["enabled"])
+    return jsonify({"success": True, "data": TRACE.status()})
+
+
+@debug_bp.route("/api/debug/trace/status")
+def trace_status():
+    return jsonify({"success": True, "data": TRACE.status()})
+
+
+@debug_bp.route("/api/debug/profile")
+def profile():
+    """Sample all thread stacks for `seconds` at `hz`; collapsed-stack text for flame graphs"""
+    cfg = CONFIG['debug']
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        hz = float(request.args.get("hz", cfg['profile_hz']))
+    except ValueError:
+        return error_response("seconds and hz must be numbers")
+    if not 0 < seconds <= cfg['profile_max_s']:
+        return error_response(f"seconds must be between 0 and {cfg['profile_max_s']}")
+    if not 0 < hz <= cfg['profile_max_hz']:
+        return error_response(f"hz must be between 0 and {cfg['profile_max_hz']}")
+    mode = request.args.get("mode", "cpu")
+    if mode not in ("cpu", "wall"):
+        return error_response("mode must be cpu or wall")
+    group = request.args.get("group", "1") != "0"
+
+    try:
+        sampler = Sampler(seconds, hz, mode, group).run()
+    except RuntimeError as e:
+        return error_response(str(e), 409)
+    response = Response(sampler.collapsed(), mimetype="text/plain")
+    for key, value in sampler.summary().items():
+        response.headers[f"X-Profile-{key.replace('_', '-').title()}"] = str(value)
+    return response
+
+
+@debug_bp.route("/api/debug/clock")
+def clock():
+    """Server wall clock, for clients estimating their offset to it"""
+    return jsonify({"success": True, "time": time.time()})
+
+
+@debug_bp.route("/api/debug/latency", methods=["POST"])
+def report_latency():
+    """Glass-to-glass samples measured by the frontend overlay: {"samples": [seconds, ...]}"""
+    samples = (request.json or {}).get("samples")
+    if not isinstance(samples, list) or len(samples) > 1000:
+        return error_response("samples must be a list of at most 1000 numbers")
+    try:
+        samples = [float(s) for s in samples]
+    except (TypeError, ValueError):
+        return error_response("samples must be numbers")
+    samples = [s for s in samples if 0 <= s < 60]
+    for s in samples:
+        GLASS_TO_GLASS.observe(s)
+    with latency_lock:
+        latency_samples.extend(samples)
+    return latency_summary()
+
+
+@debug_bp.route("/api/debug/latency")
+def latency_summary():
+    with latency_lock:
+        samples = sorted(latency_samples)
+    data = {"count": len(samples)}
+    if samples:
+        data.update({f"p{p}_ms": round(samples[min(len(samples) - 1, len(samples) * p // 100)] * 1000.0, 1)
+                     for p in (50, 90, 99)})
+    return jsonify({"success": True, "data": data})
@@ -0,0 +1,260 @@
+"""
+Thumbnail and preview derivatives of captures
+
+Derivatives are written next to the capture (white.jpg -> white.thumb.jpg,
+white.preview.jpg) by a small worker pool. Adding a scan through the history
+API queues them in the background; any that are missing or older than their
+capture (evicted, never made, capture replaced) are regenerated lazily on
+request, decoding the JPEG at reduced size. Their total size on disk is
+bounded by an LRU whose index is kept in the history database.
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import CONFIG
+
+
+KINDS = {"thumb": 160, "preview": 640}   # kind -> longest edge in pixels
+CAPTURE_CHANNELS = ("white", "fluorescence", "phosphorescence")
+CAPTURE_EXT = ".jpg"
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS derivatives (
+        path TEXT PRIMARY KEY,
+        bytes INTEGER NOT NULL,
+        accessed REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_derivatives_accessed ON derivatives(accessed);
+"""
+
+# Access times are only written back when older than this, so serving a
+# popular thumbnail does not turn every request into a database write.
+TOUCH_INTERVAL = 3600
+
+
+def derivative_path(capture_path, kind):
+    stem, ext = os.path.splitext(capture_path)
+    return f"{stem}.{kind}{ext or CAPTURE_EXT}"
+
+
+def is_derivative(name):
+    stem = os.path.splitext(name)[0]
+    return any(stem.endswith("." + kind) for kind in KINDS)
+
+
+def _inside(folder_path, path):
+    root = os.path.realpath(folder_path)
+    return os.path.realpath(path).startswith(root + os.sep)
+
+
+def primary_capture(folder_path, channel=None):
+    """The capture shown for a scan: the requested channel, else the first present
+
+    channel must be one of CAPTURE_CHANNELS (ValueError otherwise), and the
+    capture must resolve inside folder_path, symlinks included.
+    """
+    if channel and channel not in CAPTURE_CHANNELS:
+        raise ValueError(f"Unknown channel '{channel}'")
+    channels = (channel,) if channel else CAPTURE_CHANNELS
+    for name in channels:
+        path = os.path.join(folder_path, name + CAPTURE_EXT)
+        if os.path.exists(path) and _inside(folder_path, path):
+            return path
+    if channel:
+        return None
+    try:
+        names = sorted(n for n in os.listdir(folder_path)
+                       if n.lower().endswith(CAPTURE_EXT) and not is_derivative(n)
+                       and _inside(folder_path, os.path.join(folder_path, n)))
+    except FileNotFoundError:
+        return None
+    return os.path.join(folder_path, names[0]) if names else None
+
+
+def capture_version(folder_path):
+    """Short token that changes whenever a capture of the folder is replaced"""
+    h = hashlib.sha1(folder_path.encode())
+    for channel in CAPTURE_CHANNELS:
+        try:
+            st = os.stat(os.path.join(folder_path, channel + CAPTURE_EXT))
+        except OSError:
+            continue
+        h.update(f"|{channel}:{st.st_mtime_ns}:{st.st_size}".encode())
+    return h.hexdigest()[:12]
+
+
+def _fresh(out, capture_path):
+    """Whether a derivative exists and is not older than its capture"""
+    try:
+        return os.path.getmtime(out) >= os.path.getmtime(capture_path)
+    except OSError:
+        return False
+
+
+def _resize(frame, edge):
+    import cv2
+
+    h, w = frame.shape[:2]
+    scale = edge / max(h, w)
+    if scale >= 1.0:
+        return frame
+    return cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def _jpeg_size(path):
+    """(width, height) from the JPEG frame header, without decoding"""
+    with open(path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            length = int.from_bytes(f.read(2), "big")
+            if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                header = f.read(5)
+                return int.from_bytes(header[3:5], "big"), int.from_bytes(header[1:3], "big")
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def _decode_reduced(capture_path, edge):
+    """Decode a JPEG at 1/8, 1/4 or 1/2 scale when that is still at least edge"""
+    import cv2
+
+    size = _jpeg_size(capture_path)
+    flag = cv2.IMREAD_COLOR
+    if size is not None:
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if max(size) // factor >= edge:
+                flag = reduced
+                break
+    frame = cv2.imread(capture_path, flag)
+    if frame is None:
+        raise ValueError(f"Cannot decode {capture_path}")
+    return frame
+
+
+class DerivativeStore:
+    """Generates derivatives in a worker pool and keeps them within a disk budget"""
+
+    def __init__(self, history):
+        cfg = CONFIG['derivatives']
+        self.history = history
+        self.quality = cfg['quality']
+        self.budget = cfg['disk_mb'] * 1024 * 1024
+        self.pool = ThreadPoolExecutor(max_workers=cfg['workers'], thread_name_prefix="derivatives")
+        self.lock = threading.Lock()
+        self.pending = {}   # capture path -> future, so requests join queued work
+        self.index_lock = threading.Lock()   # index rows and self.total change together
+        conn = history.connection()
+        conn.executescript(SCHEMA)
+        self.total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM derivatives").fetchone()[0]
+
+    def capture_stored(self, capture_path, frame=None):
+        """Queue derivatives of a new capture; frame is the decoded BGR array if at hand"""
+        with self.lock:
+            future = self.pending.get(capture_path)
+            if future is None:
+                future = self.pool.submit(self._generate, capture_path, frame)
+                self.pending[capture_path] = future
+                future.add_done_callback(lambda _: self._done(capture_path))
+        return future
+
+    def folder_stored(self, folder_path):
+        """Queue derivatives for every capture of a scan folder"""
+        for channel in CAPTURE_CHANNELS:
+            path = os.path.join(folder_path, channel + CAPTURE_EXT)
+            if os.path.exists(path):
+                self.capture_stored(path)
+
+    def _done(self, capture_path):
+        with self.lock:
+            self.pending.pop(capture_path, None)
+
+    def get(self, capture_path, kind):
+        """Path of a derivative, regenerating it first if it was evicted or never made"""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown derivative '{kind}'")
+        path = derivative_path(capture_path, kind)
+        if not _fresh(path, capture_path):
+            self.capture_stored(capture_path).result()
+        self._touch(path)
+        return path
+
+    def _generate(self, capture_path, frame=None):
+        import cv2
+
+        # Largest kind first, so each smaller one is resized from the previous result
+        for kind, edge in sorted(KINDS.items(), key=lambda kv: -kv[1]):
+            out = derivative_path(capture_path, kind)
+            if _fresh(out, capture_path):
+                continue
+            if frame is None:
+                frame = _decode_reduced(capture_path, edge)
+            frame = _resize(frame, edge)
+            ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if not ok:
+                raise ValueError(f"Cannot encode {kind} for {capture_path}")
+            tmp = out + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(buf.tobytes())
+            os.replace(tmp, out)
+            self._record(out, len(buf))
+        self._evict()
+
+    def _record(self, path, size):
+        conn = self.history.connection()
+        with self.index_lock:
+            old = conn.execute("SELECT bytes FROM derivatives WHERE path = ?", (path,)).fetchone()
+            conn.execute(
+                "INSERT INTO derivatives (path, bytes, accessed) VALUES (?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET bytes = excluded.bytes, accessed = excluded.accessed",
+                (path, size, time.time()))
+            self.total += size - (old[0] if old else 0)
+
+    def _touch(self, path):
+        now = time.time()
+        self.history.connection().execute(
+            "UPDATE derivatives SET accessed = ? WHERE path = ? AND accessed < ?",
+            (now, path, now - TOUCH_INTERVAL))
+
+    def _evict(self):
+        """Delete least-recently-used derivatives until the total fits the budget"""
+        conn = self.history.connection()
+        # One evictor at a time: concurrent workers would pick the same oldest rows
+        with self.index_lock:
+            while self.total > self.budget:
+                rows = conn.execute(
+                    "SELECT path, bytes FROM derivatives ORDER BY accessed LIMIT 32").fetchall()
+                if not rows:
+                    break
+                for path, size in rows:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    if conn.execute("DELETE FROM derivatives WHERE path = ?", (path,)).rowcount == 1:
+                        self.total -= size
+                    if self.total <= self.budget:
+                        break
+
+    def forget_folder(self, folder_path):
+        """Drop index entries of a deleted scan folder"""
+        conn = self.history.connection()
+        # Range on the primary key rather than LIKE, whose _ and % would match other folders
+        prefix = os.path.join(folder_path, "")
+        bounds = (prefix, prefix[:-1] + chr(ord(os.sep) + 1))
+        with self.index_lock:
+            freed = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM derivatives WHERE path >= ? AND path < ?",
+                                 bounds).fetchone()[0]
+            conn.execute("DELETE FROM derivatives WHERE path >= ? AND path < ?", bounds)
+            self.total -= freed
+
+    def status(self):
+        with self.lock:
+            pending = len(self.pending)
+        return {"bytes": self.total, "budget": self.budget, "pending": pending}
@@ -0,0 +1,47 @@
+"""
+File responses for recordings, captures and exports
+
+Everything goes through send_file with conditional=True, so Range requests
+(seeking in the browser's video player, resumed downloads), If-Range,
+If-None-Match and If-Modified-Since are answered without reading the whole
+file. The body is the open file handed to the WSGI server's file_wrapper,
+which servers such as gunicorn turn into sendfile(). Behind nginx,
+LANCAM_ACCEL_PREFIX hands the transfer to the proxy (X-Accel-Redirect); for
+Apache/lighttpd LANCAM_X_SENDFILE enables Flask's X-Sendfile.
+"""
+import mimetypes
+import os
+from urllib.parse import quote
+
+from flask import Response, send_file
+from werkzeug.security import safe_join
+
+from .config import CONFIG, DATA_DIR
+
+
+def resolve(directory, name):
+    """Absolute path of name inside directory, or None if it escapes or does not exist"""
+    path = safe_join(directory, name)
+    if path is None or not os.path.isfile(path):
+        return None
+    return path
+
+
+def send_download(path, as_attachment=False, download_name=None, max_age=None):
+    cfg = CONFIG['downloads']
+    name = download_name or os.path.basename(path)
+    prefix = cfg['accel_prefix']
+    real = os.path.realpath(path)
+    root = os.path.join(os.path.realpath(DATA_DIR), "")
+    if prefix and real.startswith(root):
+        # The proxy serves the file (ranges and conditionals included) from its internal location
+        response = Response(mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream")
+        response.headers["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(os.path.relpath(real, root))
+        if as_attachment:
+            response.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(name)}"
+        return response
+
+    response = send_file(path, as_attachment=as_attachment, download_name=name,
+                         conditional=True, etag=True, max_age=max_age)
+    response.headers["Accept-Ranges"] = "bytes"
+    return response
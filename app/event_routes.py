@@ -0,0 +1,43 @@
+"""
+Server-sent events and background job endpoints
+"""
+import itertools
+from flask import Blueprint, Response, request, jsonify
+from .events import event_bus, format_sse, get_job
+
+
+events_bp = Blueprint("events", __name__)
+
+
+def sse_response(generator):
+    return Response(generator, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@events_bp.route("/api/events")
+def events():
+    """Event stream; ?topics=a,b limits it to the given topics"""
+    topics = [t for t in request.args.get("topics", "").split(",") if t]
+    return sse_response(event_bus.stream(topics or None))
+
+
+@events_bp.route("/api/jobs/<int:job_id>")
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    return jsonify({"success": True, "data": job.to_dict()})
+
+
+@events_bp.route("/api/jobs/<int:job_id>/events")
+def job_events(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    # Subscribe before taking the snapshot: a finish published in between is
+    # then queued instead of lost, and late subscribers still see finished jobs
+    entry = event_bus.subscribe([job.topic])
+    current = [format_sse(job.topic, job.to_dict())]
+    response = sse_response(itertools.chain(current, event_bus.stream(entry=entry)))
+    response.call_on_close(lambda: event_bus.unsubscribe(entry))   # also if never iterated
+    return response
@@ -0,0 +1,161 @@
+"""
+Server-sent events channel and background job progress
+
+Publishers call publish(topic, data); each /api/events client gets its own
+bounded queue, so a slow browser drops old events instead of blocking the
+publisher.
+"""
+import itertools
+import json
+import queue
+import threading
+import time
+
+
+class EventBus:
+    """Fan-out of small JSON events to subscribed SSE clients"""
+
+    def __init__(self, client_queue_size=64):
+        self.lock = threading.Lock()
+        self.subscribers = []   # (topics or None, queue)
+        self.client_queue_size = client_queue_size
+
+    def subscribe(self, topics=None):
+        q = queue.Queue(maxsize=self.client_queue_size)
+        entry = (frozenset(topics) if topics else None, q)
+        with self.lock:
+            self.subscribers.append(entry)
+        return entry
+
+    def unsubscribe(self, entry):
+        with self.lock:
+            if entry in self.subscribers:
+                self.subscribers.remove(entry)
+
+    def has_subscribers(self, topic):
+        """Lets producers skip work nobody is listening to"""
+        with self.lock:
+            return any(topics is None or topic in topics for topics, _ in self.subscribers)
+
+    def publish(self, topic, data):
+        with self.lock:
+            targets = [q for topics, q in self.subscribers if topics is None or topic in topics]
+        if not targets:
+            return
+        message = format_sse(topic, data)
+        for q in targets:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # Drop the oldest event for this client rather than block
+                try:
+                    q.get_nowait()
+                    q.put_nowait(message)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def stream(self, topics=None, keepalive=15.0, entry=None):
+        """Generator of SSE bytes for one client
+
+        Pass an entry from subscribe() to stream events published since then
+        (the generator itself only subscribes when first iterated).
+        """
+        entry = entry or self.subscribe(topics)
+        try:
+            yield b": connected\n\n"
+            while True:
+                try:
+                    yield entry[1].get(timeout=keepalive)
+                except queue.Empty:
+                    yield b": keepalive\n\n"
+        finally:
+            self.unsubscribe(entry)
+
+
+def format_sse(topic, data):
+    payload = json.dumps(data, separators=(",", ":"))
+    return f"event: {topic}\ndata: {payload}\n\n".encode()
+
+
+event_bus = EventBus()
+
+
+# ----------------------------
+# Jobs
+# ----------------------------
+_job_ids = itertools.count(1)
+_jobs = {}
+_jobs_lock = threading.Lock()
+MAX_FINISHED_JOBS = 50
+
+
+class Job:
+    """Progress of a long-running background task, published on topic 'job:<id>'"""
+
+    def __init__(self, kind, total=0):
+        self.id = next(_job_ids)
+        self.kind = kind
+        self.total = total
+        self.done = 0
+        self.bytes = 0
+        self.state = "running"
+        self.errors = []
+        self.result = None
+        self.started = time.time()
+        self.finished = None
+        self._last_publish = 0.0
+        with _jobs_lock:
+            _jobs[self.id] = self
+            _prune_jobs()
+
+    @property
+    def topic(self):
+        return f"job:{self.id}"
+
+    def advance(self, count=1, bytes=0, force=False):
+        self.done += count
+        self.bytes += bytes
+        # Rate-limit progress events to ~10/s
+        now = time.monotonic()
+        if force or now - self._last_publish >= 0.1 or self.done >= self.total:
+            self._last_publish = now
+            event_bus.publish(self.topic, self.to_dict())
+
+    def error(self, message):
+        self.errors.append(message)
+
+    def finish(self, result=None, state=None):
+        """Publish the final state; "failed" when every item reported an error
+
+        Failing items still advance() the job, so done counts them too.
+        """
+        self.result = result
+        self.state = state or ("failed" if self.errors and len(self.errors) >= max(self.total, 1) else "done")
+        self.finished = time.time()
+        event_bus.publish(self.topic, self.to_dict())
+
+    def to_dict(self):
+        elapsed = (self.finished or time.time()) - self.started
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "total": self.total,
+            "done": self.done,
+            "bytes": self.bytes,
+            "elapsed_s": round(elapsed, 3),
+            "bytes_per_s": self.bytes / elapsed if elapsed > 0 else None,
+            "errors": self.errors[-20:],
+            "result": self.result,
+        }
+
+
+def _prune_jobs():
+    finished = sorted((j for j in _jobs.values() if j.finished), key=lambda j: j.finished)
+    for job in finished[:-MAX_FINISHED_JOBS]:
+        del _jobs[job.id]
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
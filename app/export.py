@@ -0,0 +1,258 @@
+"""
+Streaming export of scans as zip or tar archives
+
+Archives are produced by a generator that reads one file chunk at a time,
+feeds it to the archive writer and yields whatever bytes the writer produced.
+The same chunks update each file's SHA-256, so checksums cost no extra read,
+and memory use stays at a couple of chunks regardless of export size. The
+generator is consumed either by an HTTP response or by a file on disk/USB.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+import zipfile
+
+from .config import CONFIG
+from .events import Job
+
+
+CHUNK = 1024 * 1024
+FORMATS = ("zip", "tar")
+MIMETYPES = {"zip": "application/zip", "tar": "application/x-tar"}
+
+
+class _Sink:
+    """Write target for the archive writers; drained after every chunk"""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+# ----------------------------
+# Entries and manifest
+# ----------------------------
+def scan_entries(store, scans):
+    """(scan, absolute path, archive name, size) for every file of the selected scans"""
+    entries = []
+    for scan in scans:
+        if not scan["folder"]:
+            continue
+        try:
+            folder = store.folder_path(scan["folder"])
+        except ValueError:
+            continue
+        for dirpath, _, filenames in os.walk(folder):
+            for name in sorted(filenames):
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    size = os.stat(path).st_size
+                except OSError:
+                    continue
+                arcname = os.path.join(scan["folder"], os.path.relpath(path, folder)).replace(os.sep, "/")
+                entries.append((scan, path, arcname, size))
+    return entries
+
+
+def _manifest_json(scans, files):
+    by_scan = {}
+    for scan_id, record in files:
+        by_scan.setdefault(scan_id, []).append(record)
+    doc = {
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scans": [{**scan, "files": by_scan.get(scan["id"], [])} for scan in scans],
+    }
+    return json.dumps(doc, indent=2).encode()
+
+
+def _manifest_csv(scans, files):
+    by_id = {scan["id"]: scan for scan in scans}
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["scan_id", "name", "lot", "type", "size", "remark", "date", "timestamp", "path", "bytes", "sha256"])
+    for scan_id, record in files:
+        s = by_id[scan_id]
+        writer.writerow([scan_id, s["name"], s["lot"], s["type"], s["size"], s["remark"], s["date"], s["timestamp"],
+                         record["path"], record["bytes"], record["sha256"]])
+    return out.getvalue().encode()
+
+
+# ----------------------------
+# Archive generators
+# ----------------------------
+def _read_chunks(path, size, job):
+    """File chunks, stopping at the size recorded when the export was planned"""
+    remaining = size
+    with open(path, "rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(CHUNK, remaining))
+            if not chunk:
+                raise IOError(f"{path} shrank during export")
+            remaining -= len(chunk)
+            if job is not None:
+                job.advance(0, bytes=len(chunk))
+            yield chunk
+    if job is not None:
+        job.advance()
+
+
+def _tar_header(name, size, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0o644
+    return info.tobuf(tarfile.PAX_FORMAT)
+
+
+def _tar_padding(size):
+    return b"\0" * (-size % tarfile.BLOCKSIZE)
+
+
+def iter_archive(entries, scans, fmt="zip", job=None):
+    """Yield the archive bytes for the given entries, manifests last"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'")
+
+    files = []  # (scan_id, {"path", "bytes", "sha256"}) in archive order
+    now = time.time()
+
+    if fmt == "zip":
+        sink = _Sink()
+        # Captures are already JPEG-compressed: store, don't deflate
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for scan, path, arcname, size in entries:
+                digest = hashlib.sha256()
+                info = zipfile.ZipInfo(arcname, time.localtime(os.path.getmtime(path))[:6])
+                info.file_size = size
+                with zf.open(info, "w", force_zip64=size > 0x7FFFFFFF) as member:
+                    for chunk in _read_chunks(path, size, job):
+                        digest.update(chunk)
+                        member.write(chunk)
+                        yield sink.drain()
+                files.append((scan["id"], {"path": arcname, "bytes": size, "sha256": digest.hexdigest()}))
+            zf.writestr("manifest.json", _manifest_json(scans, files))
+            zf.writestr("manifest.csv", _manifest_csv(scans, files))
+        yield sink.drain()
+        return
+
+    for scan, path, arcname, size in entries:
+        digest = hashlib.sha256()
+        yield _tar_header(arcname, size, int(os.path.getmtime(path)))
+        for chunk in _read_chunks(path, size, job):
+            digest.update(chunk)
+            yield chunk
+        yield _tar_padding(size)
+        files.append((scan["id"], {"path": arcname, "bytes": size, "sha256": digest.hexdigest()}))
+    for name, data in (("manifest.json", _manifest_json(scans, files)),
+                       ("manifest.csv", _manifest_csv(scans, files))):
+        yield _tar_header(name, len(data), int(now)) + data + _tar_padding(len(data))
+    yield b"\0" * (2 * tarfile.BLOCKSIZE)
+
+
+def archive_name(fmt, label=None):
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    label = "".join(c if c.isalnum() or c in "-_" else "_" for c in (label or "scans"))
+    return f"lancam_{label}_{stamp}.{fmt}"
+
+
+# ----------------------------
+# Targets
+# ----------------------------
+def usb_mounts():
+    """Mount points of removable drives under the configured roots"""
+    roots = tuple(os.path.join(r, "") for r in CONFIG['export']['usb_roots'])
+    mounts = []
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                mountpoint = line.split()[1].replace("\\040", " ")
+                if mountpoint.startswith(roots) and os.access(mountpoint, os.W_OK):
+                    mounts.append(mountpoint)
+    except OSError:
+        pass
+    return mounts
+
+
+def export_to_path(entries, scans, dest, fmt, job):
+    """Write the archive to dest chunk by chunk, syncing every few MB
+
+    Regular syncs keep the page cache from hoarding a whole lot's worth of
+    dirty data and make the reported throughput the drive's real speed.
+    """
+    sync_every = CONFIG['export']['sync_mb'] * 1024 * 1024
+    tmp = dest + ".part"
+    unsynced = 0
+    try:
+        with open(tmp, "wb") as f:
+            for data in iter_archive(entries, scans, fmt, job):
+                f.write(data)
+                unsynced += len(data)
+                if unsynced >= sync_every:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    unsynced = 0
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, dest)
+    except Exception as e:
+        job.error(str(e))
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        job.finish(state="failed")
+        return
+    job.finish({"path": dest, "bytes": os.path.getsize(dest)})
+
+
+def stream_export(store, scans, fmt="zip"):
+    """(Job, generator) for sending the archive straight into an HTTP response"""
+    entries = scan_entries(store, scans)
+    job = Job("export", total=len(entries))
+
+    def generate():
+        try:
+            for data in iter_archive(entries, scans, fmt, job):
+                if data:
+                    yield data
+        except GeneratorExit:
+            # Client went away before the end of the archive
+            job.finish(state="cancelled")
+            raise
+        except Exception as e:
+            job.error(str(e))
+            job.finish(state="failed")
+            raise
+        job.finish({"bytes": job.bytes})
+
+    return job, generate()
+
+
+def start_export(store, scans, dest_dir, fmt="zip", label=None):
+    """Export to a directory (local disk or USB) in the background; returns the Job"""
+    entries = scan_entries(store, scans)
+    dest = os.path.join(dest_dir, archive_name(fmt, label))
+    job = Job("export", total=len(entries))
+    threading.Thread(target=export_to_path, args=(entries, scans, dest, fmt, job),
+                     name=f"export-{job.id}", daemon=True).start()
+    return job
@@ -0,0 +1,104 @@
+"""
+Export endpoints (Save to Disk / Save to USB / download)
+"""
+import os
+from flask import Blueprint, Response, request, jsonify, url_for
+from . import get_history
+from .config import CONFIG
+from .downloads import resolve, send_download
+from .export import FORMATS, MIMETYPES, archive_name, start_export, stream_export, usb_mounts
+
+
+export_bp = Blueprint("export", __name__)
+
+MAX_EXPORT = 5000
+
+
+def error_response(msg, code=400):
+    return jsonify({"success": False, "message": msg}), code
+
+
+def selected_scans(store, data):
+    scan_ids = data.get("scan_ids")
+    if isinstance(scan_ids, str):
+        scan_ids = [i for i in scan_ids.split(",") if i]
+    return store.select_scans(lot=data.get("lot"), scan_ids=scan_ids, limit=MAX_EXPORT)
+
+
+@export_bp.route("/api/export/targets")
+def export_targets():
+    return jsonify({"success": True, "disk": CONFIG['export']['dir'], "usb": usb_mounts(), "formats": FORMATS})
+
+
+@export_bp.route("/api/export/download")
+def export_download():
+    """Stream the archive straight into the response: ?lot=... or ?scan_ids=1,2&format=zip|tar"""
+    store = get_history()
+    if store is None:
+        return error_response("History not available", 503)
+    fmt = request.args.get("format", "zip")
+    if fmt not in FORMATS:
+        return error_response(f"Format must be one of {FORMATS}")
+    try:
+        scans = selected_scans(store, request.args)
+    except (TypeError, ValueError):
+        return error_response("scan_ids must be integers")
+    if not scans:
+        return error_response("No scans selected")
+
+    job, generator = stream_export(store, scans, fmt)
+    filename = archive_name(fmt, request.args.get("lot"))
+    return Response(generator, mimetype=MIMETYPES[fmt], headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Job-Id": str(job.id),
+        "X-Accel-Buffering": "no",
+    })
+
+
+@export_bp.route("/api/export", methods=["POST"])
+def export_to_target():
+    """Write the archive to local disk or a USB drive in the background"""
+    store = get_history()
+    if store is None:
+        return error_response("History not available", 503)
+
+    data = request.json or {}
+    fmt = data.get("format", "zip")
+    if fmt not in FORMATS:
+        return error_response(f"Format must be one of {FORMATS}")
+
+    target = data.get("target", "disk")
+    if target == "disk":
+        dest_dir = CONFIG['export']['dir']
+        os.makedirs(dest_dir, exist_ok=True)
+    elif target == "usb":
+        mounts = usb_mounts()
+        dest_dir = data.get("usb") or (mounts[0] if mounts else None)
+        if dest_dir not in mounts:
+            return error_response("No writable USB drive found", 404)
+    else:
+        return error_response("Target must be 'disk' or 'usb'")
+
+    try:
+        scans = selected_scans(store, data)
+    except (TypeError, ValueError):
+        return error_response("scan_ids must be a list of integers")
+    if not scans:
+        return error_response("No scans selected")
+
+    job = start_export(store, scans, dest_dir, fmt, data.get("lot"))
+    return jsonify({
+        "success": True,
+        "job": job.to_dict(),
+        "status_url": url_for("events.job_status", job_id=job.id),
+        "events_url": url_for("events.job_events", job_id=job.id),
+    }), 202
+
+
+@export_bp.route("/api/export/files/<name>")
+def export_file(name):
+    """Download an archive written by Save to Disk, with Range support"""
+    path = resolve(CONFIG['export']['dir'], name)
+    if path is None or name.endswith(".part"):
+        return error_response("Export not found", 404)
+    return send_download(path, as_attachment=True)
@@ -0,0 +1,153 @@
+"""
+Single capture loop shared by every preview client
+
+One thread takes each camera request, encodes it to JPEG once and publishes
+the bytes; every /stream client waits for the next sequence number instead
+of capturing (and holding the camera lock) on its own. The thread runs only
+while somebody is watching.
+"""
+import io
+import threading
+import time
+
+from .metrics import (CAPTURE_ERRORS, CAPTURE_SECONDS, JPEG_ENCODE_SECONDS, LORES_FEED_SECONDS,
+                      PREVIEW_FRAMES, lock_holder, timed_lock)
+from .tracing import TRACE
+
+
+HUB_LOCK = lock_holder("frame_hub")
+
+
+class FrameHub:
+    """Latest JPEG preview frame plus the thread that keeps it current"""
+
+    def __init__(self, get_camera, lock, idle_s=5.0):
+        self.get_camera = get_camera
+        self.lock = lock
+        self.idle_s = idle_s
+        self.cond = threading.Condition()
+        self.frame = None
+        self.seq = 0
+        self.timestamp = None      # SensorTimestamp of the frame, ns
+        self.error = None
+        self.clients = 0
+        self.last_client = 0.0
+        self.thread = None
+        self.listeners = []        # called with (jpeg, sensor timestamp) for every frame
+        self.lores_sink = None     # LoresAnalytics: due() and feed() with lores frames
+
+    def subscribe(self):
+        with self.cond:
+            self.clients += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="frame-hub", daemon=True)
+                self.thread.start()
+
+    def add_listener(self, callback):
+        """Have callback(jpeg, timestamp) run on the capture thread for each new frame
+
+        Callbacks must be quick (append to a buffer, hand off to a queue); a
+        listener does not keep the capture loop running, subscribe() does.
+        """
+        with self.cond:
+            self.listeners = self.listeners + [callback]
+
+    def remove_listener(self, callback):
+        with self.cond:
+            self.listeners = [c for c in self.listeners if c != callback]
+
+    def unsubscribe(self):
+        with self.cond:
+            self.clients -= 1
+            self.last_client = time.monotonic()
+
+    def wait_frame(self, after_seq, timeout=2.0):
+        """(seq, jpeg, sensor timestamp) of the first frame newer than after_seq
+
+        jpeg and timestamp are None on timeout.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > after_seq or self.error, timeout=timeout)
+            if self.seq > after_seq:
+                return self.seq, self.frame, self.timestamp
+            return after_seq, None, None
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if self.clients <= 0 and time.monotonic() - self.last_client > self.idle_s:
+                    self.thread = None
+                    return
+            picam2 = self.get_camera()
+            if picam2 is None:
+                self._publish(None, None, "Camera not available")
+                time.sleep(1)
+                continue
+            try:
+                t_wait = time.perf_counter()
+                with timed_lock(self.lock, HUB_LOCK):
+                    t_capture = time.perf_counter()
+                    request = picam2.capture_request()
+                    t_encode = time.perf_counter()
+                    CAPTURE_SECONDS.observe(t_encode - t_capture)
+                try:
+                    buf = io.BytesIO()
+                    request.save("main", buf, format="jpeg")
+                    t_saved = time.perf_counter()
+                    JPEG_ENCODE_SECONDS.observe(t_saved - t_encode)
+                    metadata = request.get_metadata()
+                    timestamp = metadata.get("SensorTimestamp")
+                    self._feed_lores(picam2, request, metadata)
+                finally:
+                    request.release()
+                t_publish = time.perf_counter()
+            except Exception as e:
+                CAPTURE_ERRORS.inc()
+                self._publish(None, None, f"Camera error: {e}")
+                time.sleep(1)
+                continue
+            PREVIEW_FRAMES.inc()
+            self._publish(buf.getvalue(), timestamp)
+            if TRACE.enabled:
+                t_done = time.perf_counter()
+                args = {"seq": self.seq}
+                TRACE.add("lock_wait", t_wait, t_capture, args)
+                TRACE.add("capture_request", t_capture, t_encode, args)
+                TRACE.add("encode", t_encode, t_saved, args)
+                TRACE.add("metadata_lores_release", t_saved, t_publish, args)
+                TRACE.add("publish", t_publish, t_done, args)
+
+    def _feed_lores(self, picam2, request, metadata):
+        """Hand the lores frame to the analyzers when one is due; never fails the preview"""
+        sink = self.lores_sink
+        if sink is None:
+            return
+        due = sink.due()
+        if not due:
+            return
+        try:
+            lores = picam2.camera_configuration().get("lores")
+            if lores:
+                # make_array copies out of the request buffer, so it outlives release()
+                with LORES_FEED_SECONDS.time():
+                    sink.feed(request.make_array("lores"), lores["size"], metadata, due)
+        except Exception as e:
+            sink.error = f"lores: {e}"
+
+    def _publish(self, frame, timestamp, error=None):
+        with self.cond:
+            if frame is not None:
+                self.frame = frame
+                self.timestamp = timestamp
+                self.seq += 1
+            self.error = error
+            self.cond.notify_all()
+            listeners = self.listeners
+        if frame is not None:
+            for callback in listeners:
+                callback(frame, timestamp)
+
+    def status(self):
+        with self.cond:
+            return {"running": self.thread is not None, "clients": self.clients,
+                    "seq": self.seq, "error": self.error}
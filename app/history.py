@@ -0,0 +1,288 @@
+"""
+SQLite-backed scan history store
+
+One row per scan with indexes on lot, type and capture time, plus an FTS5
+index over name/lot/remark. Listing uses keyset pagination on
+(created_at, id) so a page costs the same no matter how deep it is.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from .config import CONFIG
+
+
+FIELDS = ("name", "lot", "type", "size", "remark", "folder")
+
+# Each entry upgrades the schema by one version (PRAGMA user_version)
+MIGRATIONS = [
+    """
+    CREATE TABLE scans (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL DEFAULT '',
+        lot TEXT NOT NULL DEFAULT '',
+        type TEXT NOT NULL DEFAULT '',
+        size TEXT NOT NULL DEFAULT '',
+        remark TEXT NOT NULL DEFAULT '',
+        folder TEXT NOT NULL DEFAULT '',
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX idx_scans_created ON scans(created_at, id);
+    CREATE INDEX idx_scans_lot ON scans(lot, created_at, id);
+    CREATE INDEX idx_scans_type ON scans(type, created_at, id);
+    """,
+    # Storage accounting: per-scan bytes and a single-row running total kept
+    # by triggers in the same transaction, so the gauge never walks the disk.
+    """
+    ALTER TABLE scans ADD COLUMN bytes INTEGER NOT NULL DEFAULT 0;
+    CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    CREATE TABLE storage (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        bytes INTEGER NOT NULL,
+        scans INTEGER NOT NULL
+    );
+    INSERT INTO storage (id, bytes, scans) SELECT 1, COALESCE(SUM(bytes), 0), COUNT(*) FROM scans;
+    CREATE TRIGGER storage_insert AFTER INSERT ON scans BEGIN
+        UPDATE storage SET bytes = bytes + new.bytes, scans = scans + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER storage_delete AFTER DELETE ON scans BEGIN
+        UPDATE storage SET bytes = bytes - old.bytes, scans = scans - 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER storage_update AFTER UPDATE OF bytes ON scans BEGIN
+        UPDATE storage SET bytes = bytes + new.bytes - old.bytes WHERE id = 1;
+    END;
+    """,
+]
+
+FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS scans_fts USING fts5(
+        name, lot, remark, content='scans', content_rowid='id', tokenize='unicode61'
+    );
+    CREATE TRIGGER IF NOT EXISTS scans_fts_insert AFTER INSERT ON scans BEGIN
+        INSERT INTO scans_fts(rowid, name, lot, remark) VALUES (new.id, new.name, new.lot, new.remark);
+    END;
+    CREATE TRIGGER IF NOT EXISTS scans_fts_delete AFTER DELETE ON scans BEGIN
+        INSERT INTO scans_fts(scans_fts, rowid, name, lot, remark) VALUES ('delete', old.id, old.name, old.lot, old.remark);
+    END;
+    CREATE TRIGGER IF NOT EXISTS scans_fts_update AFTER UPDATE OF name, lot, remark ON scans BEGIN
+        INSERT INTO scans_fts(scans_fts, rowid, name, lot, remark) VALUES ('delete', old.id, old.name, old.lot, old.remark);
+        INSERT INTO scans_fts(rowid, name, lot, remark) VALUES (new.id, new.name, new.lot, new.remark);
+    END;
+"""
+
+MAX_PAGE = 200
+
+
+def encode_cursor(created_at, scan_id):
+    return f"{created_at!r}_{scan_id}"
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, scan_id = cursor.rsplit("_", 1)
+        return float(created_at), int(scan_id)
+    except (AttributeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 prefix query, e.g. 'lot 12' -> '"lot"* "12"*'"""
+    tokens = re.findall(r"\w+", text, flags=re.UNICODE)
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+def folder_size(path):
+    """Total size of the files in a scan folder (walked once, when the scan is stored)"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.stat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def day_bounds(day):
+    """Local-time [start, end) epoch bounds of a YYYY-MM-DD date"""
+    start = datetime.strptime(day, "%Y-%m-%d")
+    return start.timestamp(), (start + timedelta(days=1)).timestamp()
+
+
+class HistoryStore:
+    """Scan history on SQLite in WAL mode, one connection per thread"""
+
+    def __init__(self, path=None):
+        self.path = path or CONFIG['history']['db']
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.local = threading.local()
+        self.fts = True
+        self._migrate()
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self.local.conn = conn
+        return conn
+
+    def _migrate(self):
+        conn = self.connection()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for i, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            conn.executescript(f"BEGIN; {script} PRAGMA user_version = {i}; COMMIT;")
+        try:
+            conn.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5: search falls back to LIKE
+            print(f"History full-text search unavailable: {e}")
+            self.fts = False
+
+    # ----------------------------
+    # Writes
+    # ----------------------------
+    def add_scan(self, created_at=None, bytes=None, **fields):
+        values = {f: str(fields.get(f) or "") for f in FIELDS}
+        values["created_at"] = created_at if created_at is not None else time.time()
+        if bytes is None:
+            bytes = folder_size(self.folder_path(values["folder"])) if values["folder"] else 0
+        values["bytes"] = int(bytes)
+        columns = ", ".join(values)
+        marks = ", ".join("?" for _ in values)
+        cur = self.connection().execute(
+            f"INSERT INTO scans ({columns}) VALUES ({marks})", tuple(values.values()))
+        return cur.lastrowid
+
+    def update_scan(self, scan_id, **fields):
+        values = {f: str(fields[f]) for f in FIELDS if f in fields}
+        if not values:
+            return False
+        assignments = ", ".join(f"{f} = ?" for f in values)
+        cur = self.connection().execute(
+            f"UPDATE scans SET {assignments} WHERE id = ?", (*values.values(), scan_id))
+        return cur.rowcount > 0
+
+    def set_scan_bytes(self, scan_id, bytes):
+        self.connection().execute("UPDATE scans SET bytes = ? WHERE id = ?", (int(bytes), scan_id))
+
+    def delete_scan(self, scan_id):
+        cur = self.connection().execute("DELETE FROM scans WHERE id = ?", (scan_id,))
+        return cur.rowcount > 0
+
+    def set_setting(self, key, value):
+        self.connection().execute(
+            "INSERT INTO settings (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, str(value)))
+
+    # ----------------------------
+    # Reads
+    # ----------------------------
+    def get_scan(self, scan_id):
+        row = self.connection().execute("SELECT * FROM scans WHERE id = ?", (scan_id,)).fetchone()
+        return self.to_dict(row) if row else None
+
+    def get_setting(self, key, default=None):
+        row = self.connection().execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def storage(self):
+        """Bytes and scan count from the incrementally maintained counter"""
+        row = self.connection().execute("SELECT bytes, scans FROM storage WHERE id = 1").fetchone()
+        return {"bytes": row["bytes"], "scans": row["scans"]}
+
+    def expired_scans(self, cutoff, limit, after=None):
+        """Oldest scans captured before cutoff, served by the created_at index
+
+        after is the (created_at, id) of the last scan already seen, so rows
+        that could not be deleted are skipped rather than returned again.
+        """
+        if after is None:
+            rows = self.connection().execute(
+                "SELECT id, folder, bytes, created_at FROM scans WHERE created_at < ? "
+                "ORDER BY created_at, id LIMIT ?", (cutoff, limit)).fetchall()
+        else:
+            rows = self.connection().execute(
+                "SELECT id, folder, bytes, created_at FROM scans WHERE created_at < ? "
+                "AND (created_at > ? OR (created_at = ? AND id > ?)) ORDER BY created_at, id LIMIT ?",
+                (cutoff, after[0], after[0], after[1], limit)).fetchall()
+        return [dict(r) for r in rows]
+
+    def folder_path(self, folder):
+        """Absolute path of a scan folder, refusing anything outside the captures root"""
+        root = os.path.realpath(CONFIG['history']['captures'])
+        path = os.path.realpath(os.path.join(root, folder))
+        if path == root or not path.startswith(root + os.sep):
+            raise ValueError(f"Scan folder '{folder}' is outside the captures directory")
+        return path
+
+    def list_scans(self, limit=50, cursor=None, q=None, lot=None, type=None, day=None):
+        """Newest-first page of scans and the cursor for the next page (or None)"""
+        limit = max(1, min(int(limit), MAX_PAGE))
+        joins, where, params = "", [], []
+
+        if q:
+            if self.fts:
+                match = fts_query(q)
+                if match:
+                    joins = "JOIN scans_fts ON scans_fts.rowid = scans.id"
+                    where.append("scans_fts MATCH ?")
+                    params.append(match)
+            else:
+                where.append("(scans.name LIKE ? OR scans.lot LIKE ? OR scans.remark LIKE ?)")
+                params.extend([f"%{q}%"] * 3)
+        if lot:
+            where.append("scans.lot = ?")
+            params.append(lot)
+        if type:
+            where.append("scans.type = ?")
+            params.append(type)
+        if day:
+            start, end = day_bounds(day)
+            where.append("scans.created_at >= ? AND scans.created_at < ?")
+            params.extend([start, end])
+        if cursor:
+            created_at, scan_id = decode_cursor(cursor)
+            where.append("(scans.created_at, scans.id) < (?, ?)")
+            params.extend([created_at, scan_id])
+
+        sql = f"SELECT scans.* FROM scans {joins}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY scans.created_at DESC, scans.id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self.connection().execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+        return [self.to_dict(r) for r in rows], next_cursor
+
+    def select_scans(self, lot=None, scan_ids=None, limit=1000):
+        """Scans picked on the UI: a whole lot, or an explicit list of ids"""
+        scans = []
+        if lot:
+            cursor = None
+            while len(scans) < limit:
+                items, cursor = self.list_scans(limit=MAX_PAGE, cursor=cursor, lot=lot)
+                scans.extend(items)
+                if cursor is None:
+                    break
+        elif scan_ids:
+            scans = [s for s in (self.get_scan(int(i)) for i in scan_ids[:limit]) if s]
+        return scans[:limit]
+
+    @staticmethod
+    def to_dict(row):
+        item = dict(row)
+        created = datetime.fromtimestamp(item["created_at"])
+        item["date"] = created.strftime("%Y-%m-%d")
+        item["timestamp"] = created.strftime("%H:%M:%S")
+        return item
@@ -0,0 +1,202 @@
+"""
+Scan history endpoints
+"""
+import shutil
+from flask import Blueprint, request, jsonify, send_file, url_for
+from . import get_history, get_retention, get_derivatives
+from .config import CONFIG
+from .derivatives import CAPTURE_CHANNELS, KINDS, capture_version, primary_capture
+from .downloads import resolve, send_download
+from .history import FIELDS
+
+
+# Derivative URLs carry a version token of the captures and never change content
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+history_bp = Blueprint("history", __name__)
+
+
+def error_response(msg, code=400):
+    return jsonify({"success": False, "message": msg}), code
+
+
+def with_links(item):
+    """Attach thumbnail/preview URLs to a history row"""
+    if item.get("folder"):
+        try:
+            version = capture_version(get_history().folder_path(item["folder"]))
+        except ValueError:
+            version = f"{item['created_at']:.0f}"
+        for kind in KINDS:
+            item[f"{kind}_url"] = url_for("history.history_derivative", scan_id=item["id"], kind=kind, v=version)
+    return item
+
+
+@history_bp.route("/api/history")
+def list_history():
+    store = get_history()
+    if store is None:
+        return error_response("History not available", 503)
+
+    args = request.args
+    try:
+        items, next_cursor = store.list_scans(
+            limit=args.get("limit", 50),
+            cursor=args.get("cursor"),
+            q=args.get("q"),
+            lot=args.get("lot"),
+            type=args.get("type"),
+            day=args.get("date"),
+        )
+    except ValueError as e:
+        return error_response(str(e))
+    return jsonify({"success": True, "items": [with_links(i) for i in items], "next_cursor": next_cursor})
+
+
+@history_bp.route("/api/history", methods=["POST"])
+def add_history():
+    store = get_history()
+    if store is None:
+        return error_response("History not available", 503)
+
+    data = request.json or {}
+    created_at = data.get("created_at")
+    try:
+        created_at = float(created_at) if created_at is not None else None
+    except (TypeError, ValueError):
+        return error_response("created_at must be epoch seconds")
+    try:
+        scan_id = store.add_scan(created_at=created_at, **{f: data.get(f) for f in FIELDS})
+    except ValueError as e:
+        return error_response(str(e))
+
+    item = store.get_scan(scan_id)
+    derivatives = get_derivatives()
+    if derivatives is not None and item["folder"]:
+        derivatives.folder_stored(store.folder_path(item["folder"]))
+    return jsonify({"success": True, "item": with_links(item)}), 201
+
+
+@history_bp.route("/api/history/<int:scan_id>")
+def get_history_item(scan_id):
+    store = get_history()
+    if store is None:
+        return error_response("History not available", 503)
+    item = store.get_scan(scan_id)
+    if item is None:
+        return error_response("Scan not found", 404)
+    return jsonify({"success": True, "item": with_links(item)})
+
+
+@history_bp.route("/api/history/<int:scan_id>/<kind>")
+def history_derivative(scan_id, kind):
+    """Thumbnail or preview of a scan's capture (optional ?channel=white|fluorescence|...)"""
+    store = get_history()
+    derivatives = get_derivatives()
+    if store is None or derivatives is None:
+        return error_response("History not available", 503)
+    if kind not in KINDS:
+        return error_response(f"Unknown image kind '{kind}'", 404)
+    channel = request.args.get("channel")
+    if channel and channel not in CAPTURE_CHANNELS:
+        return error_response(f"channel must be one of {', '.join(CAPTURE_CHANNELS)}")
+
+    item = store.get_scan(scan_id)
+    if item is None or not item["folder"]:
+        return error_response("Scan not found", 404)
+    try:
+        capture = primary_capture(store.folder_path(item["folder"]), channel)
+        if capture is None:
+            return error_response("No capture stored for this scan", 404)
+        path = derivatives.get(capture, kind)
+    except ValueError as e:
+        return error_response(str(e), 500)
+
+    response = send_file(path, mimetype="image/jpeg", conditional=True, etag=True, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@history_bp.route("/api/history/<int:scan_id>/files/<path:name>")
+def history_file(scan_id, name):
+    """Original capture or any other file of a scan folder, with Range support"""
+    store = get_history()
+    if store is None:
+        return error_response("History not available", 503)
+    item = store.get_scan(scan_id)
+    if item is None or not item["folder"]:
+        return error_response("Scan not found", 404)
+    try:
+        path = resolve(store.folder_path(item["folder"]), name)
+    except ValueError:
+        path = None
+    if path is None:
+        return error_response("File not found", 404)
+    return send_download(path, as_attachment=request.args.get("download") == "1")
+
+
+@history_bp.route("/api/history/<int:scan_id>", methods=["PATCH"])
+def update_history_item(scan_id):
+    store = get_history()
+    if store is None:
+        return error_response("History not available", 503)
+    data = request.json or {}
+    if not store.update_scan(scan_id, **{f: data[f] for f in FIELDS if f in data}):
+        return error_response("Scan not found or nothing to update", 404)
+    return jsonify({"success": True, "item": with_links(store.get_scan(scan_id))})
+
+
+@history_bp.route("/api/history/<int:scan_id>", methods=["DELETE"])
+def delete_history_item(scan_id):
+    store = get_history()
+    if store is None:
+        return error_response("History not available", 503)
+    item = store.get_scan(scan_id)
+    if item is None:
+        return error_response("Scan not found", 404)
+    if not get_retention().delete_scan(item):
+        return error_response("Could not remove the scan's files", 500)
+    return jsonify({"success": True, "message": "Scan deleted"})
+
+
+@history_bp.route("/api/history/storage")
+def history_storage():
+    """Storage gauge: used bytes come from the persisted counter, capacity from statvfs"""
+    store = get_history()
+    if store is None:
+        return error_response("History not available", 503)
+
+    used = store.storage()
+    try:
+        disk = shutil.disk_usage(CONFIG['history']['captures'])
+    except FileNotFoundError:
+        disk = shutil.disk_usage(CONFIG['paths']['data'])
+    return jsonify({
+        "success": True,
+        "used_bytes": used["bytes"],
+        "scans": used["scans"],
+        "disk_total_bytes": disk.total,
+        "disk_free_bytes": disk.free,
+    })
+
+
+@history_bp.route("/api/history/retention")
+def get_retention_settings():
+    worker = get_retention()
+    if worker is None:
+        return error_response("History not available", 503)
+    return jsonify({"success": True, "data": worker.status()})
+
+
+@history_bp.route("/api/history/retention", methods=["POST"])
+def set_retention_settings():
+    worker = get_retention()
+    if worker is None:
+        return error_response("History not available", 503)
+    try:
+        worker.set_period_days((request.json or {}).get("days", 0))
+    except (TypeError, ValueError) as e:
+        return error_response(str(e))
+    return jsonify({"success": True, "data": worker.status()})
@@ -0,0 +1,309 @@
+"""
+CPU batch inference for stone-type classification
+
+The ONNX model runs in a separate worker process so Flask request threads
+never compete with it for the GIL. All stone crops of a tray are sent as one
+batch; the worker stacks them into a single tensor and runs one session call.
+
+Model contract: input is float32 NCHW with 9 channels (RGB of the white-light,
+fluorescence and phosphorescence crops, scaled to 0..1) at input_size x
+input_size; output is one row of logits per stone, ordered like CONFIG labels.
+"""
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+
+from .config import CONFIG
+from .metrics import SCAN_STEP_SECONDS
+
+
+CLASSIFY_SECONDS = SCAN_STEP_SECONDS.labels("classify")
+
+
+CHANNELS = ("white", "fluorescence", "phosphorescence")
+
+
+# ----------------------------
+# Worker process
+# ----------------------------
+def _load_session(model_path, threads):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def _preprocess(crops, size, out):
+    """Resize every stone's channel crops into the preallocated batch tensor"""
+    import cv2
+    import numpy as np
+
+    for i, crop in enumerate(crops):
+        for c, channel in enumerate(CHANNELS):
+            img = crop.get(channel)
+            dst = out[i, c * 3:(c + 1) * 3]
+            if img is None:
+                dst[...] = 0.0
+                continue
+            if img.ndim == 2:
+                img = np.repeat(img[:, :, None], 3, axis=2)
+            img = cv2.resize(img[:, :, :3], (size, size), interpolation=cv2.INTER_AREA)
+            np.multiply(img.transpose(2, 0, 1), 1.0 / 255.0, out=dst, casting="unsafe")
+
+
+def _run_batches(session, input_name, fixed_batch, batch):
+    """Run the batch, splitting/padding only if the model has a fixed batch dim"""
+    import numpy as np
+
+    if fixed_batch is None or fixed_batch == len(batch):
+        return session.run(None, {input_name: batch})[0]
+
+    outputs = []
+    for start in range(0, len(batch), fixed_batch):
+        chunk = batch[start:start + fixed_batch]
+        n = len(chunk)
+        if n < fixed_batch:
+            chunk = np.concatenate([chunk, np.zeros((fixed_batch - n,) + chunk.shape[1:], chunk.dtype)])
+        outputs.append(session.run(None, {input_name: chunk})[0][:n])
+    return np.concatenate(outputs)
+
+
+def _softmax(logits):
+    import numpy as np
+
+    logits = logits - logits.max(axis=1, keepdims=True)
+    np.exp(logits, out=logits)
+    logits /= logits.sum(axis=1, keepdims=True)
+    return logits
+
+
+def _worker_main(conn, model_path, size, threads, warmup_batch):
+    """Entry point of the inference process: load, warm up, then serve batches"""
+    import numpy as np
+
+    try:
+        session = _load_session(model_path, threads)
+        model_input = session.get_inputs()[0]
+        fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
+        # Warm-up: the first runs allocate arenas and pick kernels
+        t0 = time.perf_counter()
+        dummy = np.zeros((fixed_batch or warmup_batch, 9, size, size), np.float32)
+        for _ in range(2):
+            _run_batches(session, model_input.name, fixed_batch, dummy)
+        conn.send(("ready", {"warmup_ms": (time.perf_counter() - t0) * 1000.0}))
+    except Exception as e:
+        conn.send(("error", str(e)))
+        return
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg is None:
+            return
+
+        request_id, crops = msg
+        try:
+            t0 = time.perf_counter()
+            batch = np.empty((len(crops), 9, size, size), np.float32)
+            _preprocess(crops, size, batch)
+            t1 = time.perf_counter()
+            probs = _softmax(_run_batches(session, model_input.name, fixed_batch, batch).astype(np.float32))
+            t2 = time.perf_counter()
+            conn.send((request_id, "ok", {
+                "probs": probs,
+                "preprocess_ms": (t1 - t0) * 1000.0,
+                "infer_ms": (t2 - t1) * 1000.0,
+            }))
+        except Exception as e:
+            conn.send((request_id, "error", str(e)))
+
+
+# ----------------------------
+# Service (Flask process side)
+# ----------------------------
+def model_path(use_int8=None):
+    """Resolve the model file, preferring the int8 model when enabled and present"""
+    cfg = CONFIG['inference']
+    if use_int8 is None:
+        use_int8 = cfg['use_int8']
+    int8_path = os.path.join(CONFIG['paths']['models'], cfg['model_int8'])
+    if use_int8 and os.path.exists(int8_path):
+        return int8_path
+    return os.path.join(CONFIG['paths']['models'], cfg['model'])
+
+
+def quantize_model(src=None, dst=None):
+    """Write a dynamically int8-quantized copy of the float model"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    cfg = CONFIG['inference']
+    src = src or os.path.join(CONFIG['paths']['models'], cfg['model'])
+    dst = dst or os.path.join(CONFIG['paths']['models'], cfg['model_int8'])
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+    return dst
+
+
+class InferenceService:
+    """Owns the inference worker process and reports per-batch timings"""
+
+    def __init__(self, path=None):
+        cfg = CONFIG['inference']
+        self.model_path = path or model_path()
+        self.labels = cfg['labels']
+        self.size = cfg['input_size']
+        self.timeout = cfg['timeout']
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+        self.stats_lock = threading.Lock()   # status() must not wait behind a running batch
+        self.ready = False
+        self.error = None
+        self.warmup_ms = None
+        self.stats = {"batches": 0, "crops": 0, "total_ms": 0.0, "last": None}
+
+    def start(self):
+        """Fork the worker and block until the model is loaded and warmed up"""
+        cfg = CONFIG['inference']
+        # fork, not spawn: spawn would re-import main.py and re-open the camera.
+        # start() is called before the camera and Flask threads exist.
+        ctx = multiprocessing.get_context("fork")
+        parent, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child, self.model_path, self.size, cfg['threads'], cfg['warmup_batch']),
+            name="inference-worker",
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+        self.conn = parent
+
+        if not self.conn.poll(cfg['timeout'] * 4):
+            self.error = "Inference worker did not start"
+            self.stop()
+            return False
+        status, info = self.conn.recv()
+        if status != "ready":
+            self.error = info
+            self.stop()
+            return False
+        self.warmup_ms = info["warmup_ms"]
+        self.ready = True
+        return True
+
+    def stop(self):
+        self.ready = False
+        if self.conn is not None:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        if self.process is not None:
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.process = None
+        self.conn = None
+
+    @property
+    def model_version(self):
+        """Identifier of the loaded model, used to key cached classification results"""
+        try:
+            st = os.stat(self.model_path)
+        except OSError:
+            return None
+        return f"{os.path.basename(self.model_path)}:{st.st_size}:{int(st.st_mtime)}"
+
+    def cache_versions(self):
+        """Stage versions for ResultCache keys of classification results"""
+        return {"classification": self.model_version}
+
+    def classify(self, crops):
+        """Classify all stones of a tray in one batch
+
+        crops is a list with one dict per stone mapping channel name
+        ("white", "fluorescence", "phosphorescence") to an RGB or gray uint8 array.
+        Returns (results, timing) where results has label and score per stone.
+        """
+        if not self.ready:
+            raise RuntimeError(self.error or "Inference service not running")
+        if not crops:
+            return [], {"batch_size": 0}
+
+        t0 = time.perf_counter()
+        with self.lock:
+            request_id = next(self.request_ids)
+            try:
+                self.conn.send((request_id, crops))
+                status, info = self._reply(request_id, t0 + self.timeout)
+            except TimeoutError:
+                raise                  # an OSError too, but the worker is only busy
+            except (EOFError, OSError) as e:
+                # BrokenPipeError is an OSError: the worker died
+                self.ready = False
+                self.error = f"Inference worker exited: {str(e) or type(e).__name__}"
+                raise RuntimeError(self.error)
+        latency_ms = (time.perf_counter() - t0) * 1000.0
+        CLASSIFY_SECONDS.observe(latency_ms / 1000.0)
+        if status != "ok":
+            raise RuntimeError(info)
+
+        probs = info["probs"]
+        results = []
+        for row in probs:
+            best = int(row.argmax())
+            results.append({
+                "label": self.labels[best] if best < len(self.labels) else str(best),
+                "score": float(row[best]),
+                "scores": [float(p) for p in row],
+            })
+
+        timing = {
+            "batch_size": len(crops),
+            "latency_ms": latency_ms,
+            "preprocess_ms": info["preprocess_ms"],
+            "infer_ms": info["infer_ms"],
+            "crops_per_s": len(crops) / (latency_ms / 1000.0) if latency_ms > 0 else None,
+        }
+        with self.stats_lock:
+            self.stats["batches"] += 1
+            self.stats["crops"] += len(crops)
+            self.stats["total_ms"] += latency_ms
+            self.stats["last"] = timing
+        return results, timing
+
+    def _reply(self, request_id, deadline):
+        """Receive the reply to request_id, discarding late replies to timed-out batches"""
+        while True:
+            if not self.conn.poll(max(0.0, deadline - time.perf_counter())):
+                raise TimeoutError("Inference batch timed out")
+            reply_id, status, info = self.conn.recv()
+            if reply_id == request_id:
+                return status, info
+
+    def status(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        total_s = stats["total_ms"] / 1000.0
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "model": os.path.basename(self.model_path),
+            "model_version": self.model_version,
+            "warmup_ms": self.warmup_ms,
+            "batches": stats["batches"],
+            "crops": stats["crops"],
+            "avg_batch_ms": stats["total_ms"] / stats["batches"] if stats["batches"] else None,
+            "crops_per_s": stats["crops"] / total_s if total_s > 0 else None,
+            "last_batch": stats["last"],
+        }
@@ -0,0 +1,16 @@
+"""
+Inference service status endpoints
+"""
+from flask import Blueprint, jsonify
+from . import get_inference
+
+
+inference_bp = Blueprint("inference", __name__)
+
+
+@inference_bp.route("/api/inference/status")
+def inference_status():
+    service = get_inference()
+    if service is None:
+        return jsonify({"success": False, "available": False, "message": "Inference not available"})
+    return jsonify({"success": True, "available": service.ready, "data": service.status()})
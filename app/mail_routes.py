@@ -0,0 +1,61 @@
+"""
+Send to Mail endpoints
+"""
+from flask import Blueprint, request, jsonify, url_for
+from . import get_history, get_mailer
+from .mailer import MailError, scan_attachments
+
+
+mail_bp = Blueprint("mail", __name__)
+
+MAX_SCANS = 1000
+DEFAULT_SUBJECT = "LANCAM certificates"
+DEFAULT_TEXT = "Please find the certificates attached."
+
+
+def error_response(msg, code=400):
+    return jsonify({"success": False, "message": msg}), code
+
+
+@mail_bp.route("/api/mail", methods=["POST"])
+def send_mail():
+    """Queue certificates/thumbnails of a scan_id, scan_ids or lot for delivery"""
+    mailer = get_mailer()
+    store = get_history()
+    if mailer is None or store is None or not mailer.enabled:
+        return error_response("Mail delivery not configured", 503)
+
+    data = request.json or {}
+    scan_ids = [data["scan_id"]] if data.get("scan_id") is not None else data.get("scan_ids")
+    try:
+        scans = store.select_scans(lot=data.get("lot"), scan_ids=scan_ids, limit=MAX_SCANS)
+    except (TypeError, ValueError):
+        return error_response("scan_ids must be a list of integers")
+    if not scans:
+        return error_response("No scans selected")
+
+    include = data.get("include") or ("certificate", "thumb")
+    attachments, missing = scan_attachments(store, scans, include)
+    if not attachments:
+        return error_response("Nothing to send: generate the certificates first")
+
+    try:
+        job = mailer.send(data.get("to"), data.get("subject") or DEFAULT_SUBJECT,
+                          data.get("message") or DEFAULT_TEXT, attachments)
+    except MailError as e:
+        return error_response(str(e))
+    return jsonify({
+        "success": True,
+        "job": job.to_dict(),
+        "missing": missing,
+        "status_url": url_for("events.job_status", job_id=job.id),
+        "events_url": url_for("events.job_events", job_id=job.id),
+    }), 202
+
+
+@mail_bp.route("/api/mail/status")
+def mail_status():
+    mailer = get_mailer()
+    if mailer is None:
+        return error_response("Mail delivery not available", 503)
+    return jsonify({"success": True, "data": mailer.status()})
@@ -0,0 +1,363 @@
+"""
+Background mail delivery for "Send to Mail"
+
+Messages are queued in memory and delivered by a single worker thread, so a
+request never waits on SMTP. The worker keeps its SMTP session open between
+messages and sends everything that is queued over it, closing the session
+only after a quiet period or a fixed number of messages. Attachments are
+never assembled in memory: the MIME body is written to the socket while the
+files are read and base64-encoded one chunk at a time.
+
+To try it without a mail server, run a local SMTP sink and point
+LANCAM_SMTP_HOST/LANCAM_SMTP_PORT at it:
+
+    python3 -m smtpd -n -c DebuggingServer localhost:1025     (Python <= 3.11)
+    python3 -m aiosmtpd -n -l localhost:1025                   (aiosmtpd package)
+"""
+import base64
+import mimetypes
+import os
+import queue
+import re
+import smtplib
+import ssl
+import threading
+import time
+import uuid
+from email.header import Header
+from email.utils import formatdate, make_msgid
+
+from .config import CONFIG
+from .certificates import PDF_NAME
+from .derivatives import derivative_path, primary_capture
+from .events import Job
+
+
+# Multiple of 57 so every chunk encodes to whole 76-character base64 lines
+CHUNK = 57 * 1024
+ADDRESS_RE = re.compile(r"^[^@\s,;<>\"]+@[^@\s,;<>\"]+\.[^@\s,;<>\"]+$")
+MAX_RECIPIENTS = 20
+
+
+class MailError(Exception):
+    pass
+
+
+def parse_recipients(value):
+    """List of addresses from a list or a comma/semicolon separated string"""
+    if isinstance(value, str):
+        value = re.split(r"[,;]", value)
+    if not isinstance(value, list):
+        raise MailError("to must be an address or a list of addresses")
+    addresses = [a.strip() for a in value if isinstance(a, str) and a.strip()]
+    if not addresses:
+        raise MailError("No recipient given")
+    if len(addresses) > MAX_RECIPIENTS:
+        raise MailError(f"At most {MAX_RECIPIENTS} recipients")
+    for address in addresses:
+        if not ADDRESS_RE.match(address):
+            raise MailError(f"Invalid address '{address}'")
+    return addresses
+
+
+def _header_text(value):
+    """Header-safe text: no line breaks, RFC 2047 encoded when not ASCII"""
+    value = " ".join(str(value).split())
+    return Header(value, "utf-8").encode() if not value.isascii() else value
+
+
+# ----------------------------
+# Attachments
+# ----------------------------
+def scan_attachments(store, scans, include=("certificate", "thumb")):
+    """(attachments, missing) for the selected scans
+
+    Each attachment is (path, filename, kind); kind names a derivative of the
+    capture at path that is resolved (and regenerated if evicted) at send time.
+    """
+    attachments, missing = [], []
+    for scan in scans:
+        if not scan["folder"]:
+            missing.append(scan["id"])
+            continue
+        try:
+            folder = store.folder_path(scan["folder"])
+        except ValueError:
+            missing.append(scan["id"])
+            continue
+        prefix = f"{scan['id']:08d}"
+        found = False
+        if "certificate" in include:
+            pdf = os.path.join(folder, PDF_NAME)
+            if os.path.exists(pdf):
+                attachments.append((pdf, f"{prefix}_certificate.pdf", None))
+                found = True
+        if "thumb" in include:
+            capture = primary_capture(folder)
+            if capture:
+                attachments.append((capture, f"{prefix}_thumb.jpg", "thumb"))
+                found = True
+        if not found:
+            missing.append(scan["id"])
+    return attachments, missing
+
+
+def _estimated_size(path, kind):
+    try:
+        return os.path.getsize(derivative_path(path, kind) if kind else path)
+    except OSError:
+        return 0
+
+
+def split_parts(attachments, max_bytes):
+    """Group attachments into messages of at most max_bytes (one oversized file per message)"""
+    parts, current, total = [], [], 0
+    for attachment in attachments:
+        size = _estimated_size(attachment[0], attachment[2])
+        if current and total + size > max_bytes:
+            parts.append(current)
+            current, total = [], 0
+        current.append(attachment)
+        total += size
+    if current or not parts:
+        parts.append(current)
+    return parts
+
+
+class _Message:
+    def __init__(self, job, to, subject, text, attachments):
+        self.job = job
+        self.to = to
+        self.subject = subject
+        self.text = text
+        self.attachments = attachments
+        self.files = None      # resolved (path, filename) pairs, once per message
+        self.attempts = 0
+
+
+# ----------------------------
+# Worker
+# ----------------------------
+class MailWorker:
+    """Queue of outgoing messages and the thread that owns the SMTP session"""
+
+    def __init__(self, derivatives=None):
+        cfg = CONFIG['mail']
+        self.cfg = cfg
+        self.derivatives = derivatives
+        self.sender = cfg['sender']
+        self.max_bytes = cfg['max_mb'] * 1024 * 1024
+        self.queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.smtp = None
+        self.session_sent = 0
+        self.last_used = 0.0
+        self.sent_parts = {}   # job id -> messages delivered so far
+        self.stats = {"sent": 0, "sent_bytes": 0, "failed": 0, "retries": 0, "sessions": 0}
+
+    @property
+    def enabled(self):
+        return bool(self.cfg['host'])
+
+    def send(self, to, subject, text, attachments):
+        """Queue a message (split into parts if the attachments are large); returns the Job"""
+        recipients = parse_recipients(to)
+        parts = split_parts(attachments, self.max_bytes)
+        job = Job("mail", total=len(parts))
+        for i, part in enumerate(parts):
+            part_subject = subject if len(parts) == 1 else f"{subject} ({i + 1}/{len(parts)})"
+            self.queue.put(_Message(job, recipients, part_subject, text, part))
+        return job
+
+    def status(self):
+        return {
+            "enabled": self.enabled,
+            "server": f"{self.cfg['host']}:{self.cfg['port']}" if self.enabled else None,
+            "queued": self.queue.qsize(),
+            "connected": self.smtp is not None,
+            **self.stats,
+        }
+
+    def start(self):
+        if not self.enabled or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._worker, name="mail", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.queue.put(None)
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def _worker(self):
+        while not self.stop_event.is_set():
+            try:
+                message = self.queue.get(timeout=self.cfg['idle_s'] if self.smtp else None)
+            except queue.Empty:
+                # Nothing more queued: let the session go rather than keep it open
+                self._close()
+                continue
+            if message is None:
+                break
+            self._deliver(message)
+        self._close()
+
+    def _deliver(self, message):
+        job = message.job
+        if message.files is None:
+            message.files = self._resolve_all(message)
+        while True:
+            message.attempts += 1
+            try:
+                sent = self._transaction(self._session(), message)
+            except Exception as e:
+                # Anything unexpected fails this message only; the session state is unknown
+                self._close()
+                permanent = not isinstance(e, (OSError, smtplib.SMTPException)) or (
+                    isinstance(e, smtplib.SMTPResponseException) and e.smtp_code >= 500) or \
+                    isinstance(e, smtplib.SMTPRecipientsRefused)
+                if not permanent and message.attempts < self.cfg['max_attempts'] \
+                        and not self.stop_event.is_set():
+                    self.stats["retries"] += 1
+                    self.stop_event.wait(self.cfg['backoff'] * 2 ** (message.attempts - 1))
+                    continue
+                self.stats["failed"] += 1
+                job.error(f"{message.subject}: {e}")
+                job.advance()
+                break
+            self.stats["sent"] += 1
+            self.stats["sent_bytes"] += sent
+            self.sent_parts[job.id] = self.sent_parts.get(job.id, 0) + 1
+            job.advance(bytes=sent)
+            break
+        if job.done >= job.total:
+            delivered = self.sent_parts.pop(job.id, 0)
+            job.finish({"to": message.to, "messages": job.total, "delivered": delivered},
+                       state="done" if delivered else "failed")   # errors also count skipped attachments
+
+    # ----------------------------
+    # SMTP session
+    # ----------------------------
+    def _session(self):
+        cfg = self.cfg
+        if self.smtp is not None and self.session_sent >= cfg['per_session']:
+            self._close()
+        if self.smtp is not None and time.monotonic() - self.last_used > 5.0:
+            # The server may have dropped an idle session; check before reusing it
+            try:
+                if self.smtp.noop()[0] != 250:
+                    self._close()
+            except (OSError, smtplib.SMTPException):
+                self._close()
+        if self.smtp is None:
+            if cfg['security'] == "ssl":
+                smtp = smtplib.SMTP_SSL(cfg['host'], cfg['port'], timeout=cfg['timeout'],
+                                        context=ssl.create_default_context())
+            else:
+                smtp = smtplib.SMTP(cfg['host'], cfg['port'], timeout=cfg['timeout'])
+                if cfg['security'] == "starttls":
+                    smtp.starttls(context=ssl.create_default_context())
+            if cfg['user']:
+                smtp.login(cfg['user'], cfg['password'])
+            self.smtp = smtp
+            self.session_sent = 0
+            self.stats["sessions"] += 1
+        return self.smtp
+
+    def _close(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except (OSError, smtplib.SMTPException):
+            self.smtp.close()
+        self.smtp = None
+
+    def _resolve(self, path, kind):
+        if kind is None:
+            return path
+        if self.derivatives is not None:
+            return self.derivatives.get(path, kind)
+        out = derivative_path(path, kind)
+        if not os.path.exists(out):
+            raise FileNotFoundError(out)
+        return out
+
+    def _resolve_all(self, message):
+        """Attachment files for a message; ones that cannot be produced are reported and skipped"""
+        files = []
+        for path, filename, kind in message.attachments:
+            try:
+                files.append((self._resolve(path, kind), filename))
+            except Exception as e:
+                # Deleted by retention or not decodable: send the rest
+                message.job.error(f"{filename}: {e}")
+        return files
+
+    def _transaction(self, smtp, message):
+        """MAIL/RCPT/DATA with the body streamed to the socket; returns bytes sent"""
+        smtp.ehlo_or_helo_if_needed()
+        code, resp = smtp.mail(self.sender)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, resp, self.sender)
+        refused = {}
+        for address in message.to:
+            code, resp = smtp.rcpt(address)
+            if code not in (250, 251):
+                refused[address] = (code, resp)
+        if len(refused) == len(message.to):
+            smtp.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        smtp.putcmd("data")
+        code, resp = smtp.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, resp)
+
+        sent = 0
+        for data in self._body(message, message.files):
+            smtp.send(data)
+            sent += len(data)
+        smtp.send(b".\r\n")
+        code, resp = smtp.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+        self.session_sent += 1
+        self.last_used = time.monotonic()
+        return sent
+
+    def _body(self, message, files):
+        """MIME message as CRLF lines; base64 everywhere, so no line needs dot-stuffing"""
+        boundary = f"=_lancam_{uuid.uuid4().hex}"
+        headers = [
+            f"From: {self.sender}",
+            f"To: {', '.join(message.to)}",
+            f"Subject: {_header_text(message.subject)}",
+            f"Date: {formatdate(localtime=True)}",
+            f"Message-ID: {make_msgid(domain=self.sender.rpartition('@')[2] or None)}",
+            "MIME-Version: 1.0",
+            f'Content-Type: multipart/mixed; boundary="{boundary}"',
+            "",
+            f"--{boundary}",
+            'Content-Type: text/plain; charset="utf-8"',
+            "Content-Transfer-Encoding: base64",
+            "",
+        ]
+        yield ("\r\n".join(headers) + "\r\n").encode()
+        yield base64.encodebytes(message.text.encode()).replace(b"\n", b"\r\n")
+
+        for path, filename in files:
+            mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            yield (f"--{boundary}\r\n"
+                   f'Content-Type: {mimetype}; name="{filename}"\r\n'
+                   f'Content-Disposition: attachment; filename="{filename}"\r\n'
+                   "Content-Transfer-Encoding: base64\r\n\r\n").encode()
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(CHUNK)
+                    if not chunk:
+                        break
+                    yield base64.encodebytes(chunk).replace(b"\n", b"\r\n")
+        yield f"--{boundary}--\r\n".encode()
@@ -0,0 +1,294 @@
+"""
+Shared H.264 encode fanned out to recorders and restreamers
+
+Recording, RTMP and RTSP used to each run an ffmpeg that pulled the MJPEG
+preview over HTTP, decoded it and encoded H.264 again. Now the camera's own
+H.264 encoder runs once, on the main stream, and its packets are written to
+the stdin of each ffmpeg sink, which only remuxes (-c:v copy). The encoder
+runs while at least one sink is attached.
+
+Each sink has a bounded queue drained by its own writer thread, so a slow
+network sink drops frames (resuming at the next keyframe) instead of
+stalling the encoder or the other sinks.
+"""
+import os
+import queue
+import threading
+import time
+
+try:
+    from picamera2.encoders import H264Encoder
+    from picamera2.outputs import Output
+except ImportError:
+    # Software camera backend on a machine without picamera2
+    H264Encoder = None
+    Output = object
+
+from .config import CONFIG
+from .metrics import H264_BYTES, H264_FRAMES, SINK_BYTES, SINK_DROPPED
+from .tracing import TRACE
+from .supervisor import Supervisor
+
+
+class FfmpegSink:
+    """One supervised ffmpeg process remuxing the shared H.264 stream to an output
+
+    target is a fixed URL, or a callable returning a fresh path for every
+    (re)start, so a restarted recording never overwrites the previous part.
+    """
+
+    def __init__(self, name, output_args, target):
+        self.name = name
+        self.output_args = output_args
+        self.target_factory = target if callable(target) else (lambda: target)
+        self.target = None
+        self.outputs = []          # every target written, in order
+        self.queue = queue.Queue(maxsize=CONFIG['media']['sink_queue'])
+        self.child = Supervisor(f"ffmpeg-{name}", self.command, stdin=True, on_start=self._started)
+        self.thread = None
+        self.synced = False        # first keyframe seen; also reset after drops and restarts
+        self.frames = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.started = None
+        self.bytes_metric = SINK_BYTES.labels(name)
+        self.dropped_metric = SINK_DROPPED.labels(name)
+
+    def command(self):
+        self.target = self.target_factory()
+        return ["ffmpeg", "-hide_banner", "-loglevel", "warning", "-nostdin", "-nostats",
+                "-progress", "pipe:1", "-use_wallclock_as_timestamps", "1",
+                "-f", "h264", "-i", "pipe:0", "-c:v", "copy", *self.output_args, self.target]
+
+    def _started(self, process):
+        self.outputs.append(self.target)
+        self.synced = False
+
+    def start(self):
+        self.started = time.time()
+        self.child.start()
+        self.thread = threading.Thread(target=self._writer, name=f"sink-{self.name}", daemon=True)
+        self.thread.start()
+
+    def feed(self, data, keyframe):
+        """Called from the encoder thread; never blocks"""
+        if not self.synced:
+            if not keyframe:
+                self.dropped += 1
+                self.dropped_metric.inc()
+                return
+            self.synced = True
+        try:
+            self.queue.put_nowait((data, keyframe, time.time()))
+        except queue.Full:
+            # Decoders cannot continue mid-GOP; wait for the next keyframe
+            self.synced = False
+            self.dropped += 1
+            self.dropped_metric.inc()
+
+    def on_write(self, keyframe, at):
+        """Hook run after each frame reaches ffmpeg; at is the wall-clock time it was encoded"""
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            data, keyframe, at = item
+            try:
+                self.child.process.stdin.write(data)
+            except (BrokenPipeError, ValueError, OSError):
+                # ffmpeg died; the supervisor restarts it and the next keyframe resyncs
+                self.synced = False
+                self.dropped += 1
+                continue
+            self.frames += 1
+            self.bytes += len(data)
+            self.bytes_metric.inc(len(data))
+            self.on_write(keyframe, at)
+
+    def stop(self, timeout=10):
+        """Flush queued frames, then let ffmpeg finalize the output (e.g. the MP4 index)
+
+        Never blocks on a stalled ffmpeg (e.g. a hung RTMP peer): a full queue
+        is discarded, and a writer still stuck after timeout is released by
+        terminating ffmpeg.
+        """
+        while True:
+            try:
+                self.queue.put_nowait(None)
+                break
+            except queue.Full:
+                # Not keeping up anyway; these frames would only delay the stop
+                self._discard_queued()
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+            if self.thread.is_alive():
+                self.child.terminate()
+                self.thread.join(timeout=5)
+        self.child.stop(timeout=timeout)
+
+    def _discard_queued(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+            self.dropped += 1
+            self.dropped_metric.inc()
+
+    @property
+    def running(self):
+        return self.child.running or (self.started is not None and not self.child.stopping.is_set())
+
+    def status(self):
+        elapsed = time.time() - self.started if self.started else 0
+        return {
+            "name": self.name,
+            "target": self.target,
+            "outputs": self.outputs,
+            "running": self.running,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "bytes": self.bytes,
+            "elapsed_s": round(elapsed, 1),
+            "process": self.child.status(),
+        }
+
+
+class _FanoutOutput(Output):
+    """picamera2 Output handing every encoded frame to the attached sinks"""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        t0 = time.perf_counter()
+        data = bytes(frame)
+        H264_FRAMES.inc()
+        H264_BYTES.inc(len(data))
+        for sink in self.service.sink_list():
+            sink.feed(data, keyframe)
+        if TRACE.enabled:
+            TRACE.add("h264_fanout", t0, time.perf_counter(), {"bytes": len(data), "keyframe": keyframe},
+                      category="h264")
+
+
+class MediaService:
+    """Owns the shared encoder and the set of named sinks"""
+
+    def __init__(self, get_camera, lock):
+        if H264Encoder is None:
+            raise RuntimeError("picamera2 is not installed")
+        cfg = CONFIG['media']
+        self.get_camera = get_camera
+        self.lock = lock
+        self.recordings_dir = cfg['recordings']
+        os.makedirs(self.recordings_dir, exist_ok=True)
+        self.sinks = {}
+        self.sinks_lock = threading.Lock()
+        self.encoder = None
+        self.output = _FanoutOutput(self)
+
+    def sink_list(self):
+        with self.sinks_lock:
+            return list(self.sinks.values())
+
+    def get(self, name):
+        with self.sinks_lock:
+            return self.sinks.get(name)
+
+    def add_sink(self, sink):
+        """Start a sink and make sure the encoder is feeding it"""
+        # Check and claim the name in one step, so two concurrent starts
+        # cannot both spawn an ffmpeg for it
+        with self.sinks_lock:
+            if sink.name in self.sinks:
+                raise RuntimeError(f"{sink.name} already running")
+            self.sinks[sink.name] = sink
+        try:
+            sink.start()
+        except Exception:
+            with self.sinks_lock:
+                self.sinks.pop(sink.name, None)
+            raise
+        try:
+            with self.lock:
+                self.resume()
+        except Exception:
+            self.remove_sink(sink.name)
+            raise
+        return sink
+
+    def remove_sink(self, name):
+        with self.sinks_lock:
+            sink = self.sinks.pop(name, None)
+            empty = not self.sinks
+        if empty:
+            with self.lock:
+                self.suspend()
+        if sink is not None:
+            sink.stop()
+        return sink
+
+    def resume(self):
+        """Start the encoder if any sink needs it; the caller holds the camera lock"""
+        if self.encoder is not None or not self.sink_list():
+            return
+        picam2 = self.get_camera()
+        if picam2 is None:
+            raise RuntimeError("Camera not available")
+        cfg = CONFIG['media']
+        encoder = H264Encoder(bitrate=cfg['bitrate'], repeat=True, iperiod=cfg['keyframe_interval'])
+        for sink in self.sink_list():
+            sink.synced = False   # the new stream starts at its first keyframe
+        picam2.start_encoder(encoder, self.output)
+        self.encoder = encoder
+
+    def suspend(self):
+        """Stop the encoder, keeping the sinks; the caller holds the camera lock
+
+        Used around camera reconfiguration, after which resume() starts an
+        encoder for the new stream size.
+        """
+        if self.encoder is None:
+            return
+        picam2 = self.get_camera()
+        try:
+            if picam2 is not None:
+                picam2.stop_encoder(self.encoder)
+        finally:
+            self.encoder = None
+
+    # ----------------------------
+    # Sinks used by the routes
+    # ----------------------------
+    def start_recording(self, catalog):
+        """Start a segmented recording indexed into catalog; returns its id"""
+        from .recordings import SegmentedRecordingSink
+
+        rec_id = time.strftime("recording_%Y%m%d_%H%M%S")
+        n = 1
+        while os.path.exists(catalog.path(rec_id)):
+            n += 1
+            rec_id = time.strftime(f"recording_%Y%m%d_%H%M%S_{n}")
+        self.add_sink(SegmentedRecordingSink(catalog, rec_id))
+        return rec_id
+
+    def start_rtmp(self, url):
+        return self.add_sink(FfmpegSink("rtmp", ["-f", "flv"], url))
+
+    def start_rtsp(self):
+        return self.add_sink(FfmpegSink("rtsp", ["-f", "rtsp", "-rtsp_transport", "tcp"],
+                                        CONFIG['media']['rtsp_url']))
+
+    def status(self):
+        return {
+            "encoding": self.encoder is not None,
+            "sinks": {sink.name: sink.status() for sink in self.sink_list()},
+        }
+
+    def shutdown(self):
+        for sink in self.sink_list():
+            self.remove_sink(sink.name)
@@ -0,0 +1,217 @@
+"""
+Recording, clip and restreaming endpoints (RTMP/RTSP)
+"""
+from flask import Blueprint, request, jsonify, url_for
+from . import get_media, get_preroll, get_recordings
+from .config import CONFIG
+from .downloads import resolve, send_download
+
+
+media_bp = Blueprint("media", __name__)
+
+
+def error_response(msg, code=400):
+    return jsonify({"success": False, "message": msg}), code
+
+
+def start_sink(start):
+    """Run start(media); returns (result, None) or (None, error response)"""
+    media = get_media()
+    if media is None:
+        return None, error_response("Recording and streaming not available", 503)
+    try:
+        return start(media), None
+    except RuntimeError as e:
+        return None, error_response(str(e), 409)
+    except OSError as e:
+        # ffmpeg missing or not executable
+        return None, error_response(str(e), 500)
+
+
+def stop_sink(name, label):
+    media = get_media()
+    if media is None:
+        return error_response("Recording and streaming not available", 503)
+    sink = media.remove_sink(name)
+    if sink is None:
+        return error_response(f"{label} not running")
+    result = {"success": True, "message": f"{label} stopped", "data": sink.status()}
+    if name == "recording":
+        result["filename"] = sink.rec_id
+    return jsonify(result)
+
+
+@media_bp.route("/api/recording/start", methods=["POST"])
+def start_recording():
+    catalog = get_recordings()
+    if catalog is None:
+        return error_response("Recording not available", 503)
+    filename, error = start_sink(lambda m: m.start_recording(catalog))
+    if error:
+        return error
+    return jsonify({"success": True, "message": "Recording started", "filename": filename})
+
+
+@media_bp.route("/api/recording/stop", methods=["POST"])
+def stop_recording():
+    return stop_sink("recording", "Recording")
+
+
+@media_bp.route("/api/recordings")
+def list_recordings():
+    """Recordings, clips and exports from the in-memory catalog (newest first)"""
+    catalog = get_recordings()
+    if catalog is None:
+        return error_response("Recording not available", 503)
+    return jsonify({"success": True, "recordings": catalog.listing()})
+
+
+@media_bp.route("/api/recordings/<rec_id>")
+def get_recording(rec_id):
+    """One recording with its segments (start, duration, bytes, keyframe offsets)"""
+    catalog = get_recordings()
+    if catalog is None:
+        return error_response("Recording not available", 503)
+    entry = catalog.get(rec_id)
+    if entry is None:
+        return error_response("Recording not found", 404)
+    return jsonify({"success": True, "data": entry})
+
+
+@media_bp.route("/api/recordings/<rec_id>/file")
+@media_bp.route("/api/recordings/<rec_id>/segments/<segment>")
+def download_recording(rec_id, segment=None):
+    """Recording file or segment, with Range support (?download=1 saves instead of plays)"""
+    catalog = get_recordings()
+    if catalog is None:
+        return error_response("Recording not available", 503)
+    entry = catalog.get(rec_id)
+    if entry is None or (segment is None) != (entry["kind"] == "file"):
+        return error_response("Recording not found", 404)
+    path = resolve(catalog.directory, rec_id if segment is None else f"{rec_id}/{segment}")
+    if path is None:
+        return error_response("Recording not found", 404)
+    return send_download(path, as_attachment=request.args.get("download") == "1")
+
+
+@media_bp.route("/api/recordings/<rec_id>/export", methods=["POST"])
+def export_recording(rec_id):
+    """Cut start..end seconds of a segmented recording into one MP4, without re-encoding"""
+    catalog = get_recordings()
+    if catalog is None:
+        return error_response("Recording not available", 503)
+    data = request.json or {}
+    try:
+        start = float(data["start"]) if data.get("start") is not None else None
+        end = float(data["end"]) if data.get("end") is not None else None
+    except (TypeError, ValueError):
+        return error_response("start and end must be seconds from the start of the recording")
+    if start is not None and end is not None and end <= start:
+        return error_response("end must be after start")
+    try:
+        job = catalog.export_range(rec_id, start, end)
+    except KeyError:
+        return error_response("Recording not found", 404)
+    except ValueError as e:
+        return error_response(str(e))
+    return jsonify({
+        "success": True,
+        "job": job.to_dict(),
+        "status_url": url_for("events.job_status", job_id=job.id),
+        "events_url": url_for("events.job_events", job_id=job.id),
+    }), 202
+
+
+@media_bp.route("/api/streaming/rtmp/start", methods=["POST"])
+def start_rtmp():
+    url = (request.json or {}).get("url")
+    if not url or not url.startswith(("rtmp://", "rtmps://")):
+        return error_response("RTMP URL required")
+    _, error = start_sink(lambda m: m.start_rtmp(url))
+    if error:
+        return error
+    return jsonify({"success": True, "message": "RTMP streaming started"})
+
+
+@media_bp.route("/api/streaming/rtmp/stop", methods=["POST"])
+def stop_rtmp():
+    return stop_sink("rtmp", "RTMP streaming")
+
+
+@media_bp.route("/api/streaming/rtsp/start", methods=["POST"])
+def start_rtsp():
+    sink, error = start_sink(lambda m: m.start_rtsp())
+    if error:
+        return error
+    return jsonify({"success": True, "message": "RTSP streaming started", "url": sink.target})
+
+
+@media_bp.route("/api/streaming/rtsp/stop", methods=["POST"])
+def stop_rtsp():
+    return stop_sink("rtsp", "RTSP streaming")
+
+
+@media_bp.route("/api/streaming/status")
+def streaming_status():
+    media = get_media()
+    if media is None:
+        return error_response("Recording and streaming not available", 503)
+    return jsonify({"success": True, "data": media.status()})
+
+
+@media_bp.route("/api/clips/arm", methods=["POST"])
+def arm_clips():
+    """Start keeping the last seconds of preview in memory"""
+    buffer = get_preroll()
+    if buffer is None:
+        return error_response("Clip buffer not available", 503)
+    seconds = (request.json or {}).get("seconds")
+    try:
+        if seconds is not None and not (1 <= float(seconds) <= 120):
+            return error_response("seconds must be between 1 and 120")
+    except (TypeError, ValueError):
+        return error_response("seconds must be a number")
+    buffer.arm(seconds)
+    return jsonify({"success": True, "data": buffer.status()})
+
+
+@media_bp.route("/api/clips/disarm", methods=["POST"])
+def disarm_clips():
+    buffer = get_preroll()
+    if buffer is None:
+        return error_response("Clip buffer not available", 503)
+    buffer.disarm()
+    return jsonify({"success": True, "data": buffer.status()})
+
+
+@media_bp.route("/api/clips/save", methods=["POST"])
+def save_clip():
+    """Save the pre-roll plus post_seconds of live preview to a clip"""
+    buffer = get_preroll()
+    if buffer is None:
+        return error_response("Clip buffer not available", 503)
+    cfg = CONFIG['clips']
+    try:
+        post = float((request.json or {}).get("post_seconds", cfg['post_s']))
+    except (TypeError, ValueError):
+        return error_response("post_seconds must be a number")
+    if not 0 <= post <= cfg['max_post_s']:
+        return error_response(f"post_seconds must be between 0 and {cfg['max_post_s']:g}")
+    try:
+        job = buffer.save_clip(post)
+    except RuntimeError as e:
+        return error_response(str(e), 409)
+    return jsonify({
+        "success": True,
+        "job": job.to_dict(),
+        "status_url": url_for("events.job_status", job_id=job.id),
+        "events_url": url_for("events.job_events", job_id=job.id),
+    }), 202
+
+
+@media_bp.route("/api/clips/status")
+def clips_status():
+    buffer = get_preroll()
+    if buffer is None:
+        return error_response("Clip buffer not available", 503)
+    return jsonify({"success": True, "data": buffer.status()})
@@ -0,0 +1,220 @@
+"""
+Prometheus-style metrics for the camera pipeline
+
+Metrics are created once at import time and observed from hot paths, so an
+observation is a bisect into a preallocated bucket list and two additions
+under a lock: no dicts, labels or strings are built per call. Labelled
+metrics hand out one child per label value, created on first use and
+cached; callers on hot paths keep the child. /metrics renders everything in
+the Prometheus text exposition format.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+# Seconds; from sub-millisecond lock waits to multi-second reconfigures
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_metrics_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.children = {}
+        self.lock = threading.Lock()
+        with _metrics_lock:
+            _metrics.append(self)
+
+    def labels(self, *values):
+        """Child for these label values; keep it when observing from a hot path"""
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        targets = list(self.children.items()) if self.label_names else [((), self)]
+        for values, child in targets:
+            lines.extend(child._samples(self.name, _label_text(self.label_names, values)))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.value = 0
+
+    def _child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def _samples(self, name, labels):
+        return [f"{name}{labels} {self.value}"]
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    inc = Counter.inc
+    _samples = Counter._samples
+
+
+class Gauge(_Metric):
+    """Value computed at scrape time by callback() -> number or {label tuple: number}"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, callback, labels=()):
+        super().__init__(name, help_text, labels)
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.callback()
+        except Exception:
+            return lines
+        if isinstance(value, dict):
+            for values, v in value.items():
+                lines.append(f"{self.name}{_label_text(self.label_names, values)} {v}")
+        elif value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, labels=()):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text, labels)
+        self.counts = [0] * (len(self.buckets) + 1)   # last slot is +Inf
+        self.sum = 0.0
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0)
+
+    def _samples(self, name, labels):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        inner = labels[1:-1] + "," if labels else ""
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{inner}le="{bound:g}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{name}_bucket{{{inner}le="+Inf"}} {cumulative}')
+        lines.append(f"{name}_sum{labels} {total}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    observe = Histogram.observe
+    time = Histogram.time
+    _samples = Histogram._samples
+
+
+def render():
+    """All metrics in the Prometheus text format"""
+    with _metrics_lock:
+        metrics = list(_metrics)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ----------------------------
+# Pipeline metrics
+# ----------------------------
+CAPTURE_SECONDS = Histogram("lancam_capture_seconds", "Time to obtain a camera request for the preview")
+JPEG_ENCODE_SECONDS = Histogram("lancam_jpeg_encode_seconds", "Preview JPEG encode time")
+LORES_FEED_SECONDS = Histogram("lancam_lores_feed_seconds", "Lores copy and hand-off to analytics, per analysed frame",
+                               buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05))
+PREVIEW_FRAMES = Counter("lancam_preview_frames_total", "Preview frames captured by the frame hub")
+CAPTURE_ERRORS = Counter("lancam_capture_errors_total", "Failed preview captures")
+
+STREAM_BYTES = Counter("lancam_stream_bytes_total", "Bytes sent to /stream clients")
+STREAM_DROPPED = Counter("lancam_stream_dropped_frames_total", "Preview frames a /stream client skipped")
+
+H264_FRAMES = Counter("lancam_h264_frames_total", "Frames produced by the shared H.264 encoder")
+H264_BYTES = Counter("lancam_h264_bytes_total", "Bytes produced by the shared H.264 encoder")
+SINK_BYTES = Counter("lancam_sink_bytes_total", "Bytes written to ffmpeg sinks", labels=("sink",))
+SINK_DROPPED = Counter("lancam_sink_dropped_frames_total", "Encoded frames dropped by ffmpeg sinks",
+                       labels=("sink",))
+
+LOCK_WAIT = Histogram("lancam_camera_lock_wait_seconds", "Time spent waiting for the camera lock",
+                      labels=("holder",))
+LOCK_HOLD = Histogram("lancam_camera_lock_hold_seconds", "Time the camera lock was held", labels=("holder",))
+RECONFIGURE_SECONDS = Histogram("lancam_camera_reconfigure_seconds", "Camera stop/configure/start duration")
+
+GLASS_TO_GLASS = Histogram("lancam_glass_to_glass_seconds",
+                           "Capture to display latency reported by the frontend latency overlay")
+
+SCAN_STEP_SECONDS = Histogram("lancam_scan_step_seconds", "Duration of scan pipeline steps", labels=("step",))
+
+
+@contextmanager
+def timed_lock(lock, holder):
+    """Acquire lock recording wait and hold time; holder is a LOCK_WAIT/LOCK_HOLD child pair"""
+    wait, hold = holder
+    t0 = time.perf_counter()
+    with lock:
+        t1 = time.perf_counter()
+        wait.observe(t1 - t0)
+        try:
+            yield
+        finally:
+            hold.observe(time.perf_counter() - t1)
+
+
+def lock_holder(name):
+    return LOCK_WAIT.labels(name), LOCK_HOLD.labels(name)
@@ -0,0 +1,120 @@
+"""
+Built-in sampling profiler
+
+A background thread walks every thread's stack via sys._current_frames() at
+a fixed rate and counts identical stacks, rooted at the thread's name. The
+result is collapsed-stack text, one "thread;outer;...;inner count" line per
+stack, as read by flamegraph.pl, speedscope and Perfetto.
+
+In "cpu" mode a thread is only sampled when its CPU clock advanced since the
+previous sample, so threads blocked on the camera, a socket or a queue drop
+out and what remains is where CPU time goes. "wall" mode samples every
+thread regardless.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+
+_busy = threading.Lock()
+_NUMBERED = re.compile(r"-\d+$")
+
+
+def _cpu_clock(ident):
+    """Clock id of a thread's CPU time, None where the platform has none"""
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError, OSError, OverflowError):
+        return None
+
+
+def _thread_name(thread, group):
+    name = thread.name
+    if group:
+        # stream-client-3, upload-0, ... -> one root per kind of thread
+        name = _NUMBERED.sub("", name)
+    return name.replace(";", ":").replace(" ", "_")
+
+
+def _stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                     .replace(";", ":"))
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+class Sampler:
+    """One profiling run; run() blocks until seconds have passed"""
+
+    def __init__(self, seconds, hz, mode="cpu", group=True):
+        self.seconds = seconds
+        self.interval = 1.0 / hz
+        self.mode = mode
+        self.group = group
+        self.stacks = Counter()
+        self.samples = 0
+        self.ticks = 0
+        self.overhead = 0.0        # seconds spent sampling
+        self.cpu_times = {}
+
+    def run(self):
+        if not _busy.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+            thread.start()
+            thread.join()
+        finally:
+            _busy.release()
+        return self
+
+    def _sample(self):
+        me = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        next_tick = time.monotonic()
+        while next_tick < deadline:
+            t0 = time.perf_counter()
+            threads = {t.ident: t for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                thread = threads.get(ident)
+                if ident == me or thread is None or not self._on_cpu(ident):
+                    continue
+                self.stacks[";".join([_thread_name(thread, self.group)] + _stack(frame))] += 1
+                self.samples += 1
+            self.ticks += 1
+            self.overhead += time.perf_counter() - t0
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()   # fell behind; do not burst to catch up
+
+    def _on_cpu(self, ident):
+        if self.mode != "cpu":
+            return True
+        clock = _cpu_clock(ident)
+        if clock is None:
+            return True
+        try:
+            used = time.clock_gettime(clock)
+        except OSError:
+            return False   # thread exited
+        previous = self.cpu_times.get(ident)
+        self.cpu_times[ident] = used
+        return previous is not None and used > previous
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self):
+        return {"seconds": self.seconds, "hz": round(1.0 / self.interval, 1), "mode": self.mode,
+                "ticks": self.ticks, "samples": self.samples, "stacks": len(self.stacks),
+                "overhead_ms": round(self.overhead * 1000.0, 1)}
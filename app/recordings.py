@@ -0,0 +1,351 @@
+"""
+Segmented recordings, their sidecar index and the in-memory catalog
+
+A recording is a directory of fixed-duration MP4 segments written by the
+ffmpeg segment muxer (-c:v copy from the shared encode). As each segment
+closes, a sidecar JSON next to it records its start time, duration, size
+and keyframe offsets. The keyframe times come from the encoder packets
+themselves, so no file is probed. The catalog loads the sidecars once at
+startup and is then updated in place, so /api/recordings never touches the
+disk. Time-range exports concatenate segments with ffmpeg's concat demuxer,
+starting on a keyframe, without re-encoding.
+
+    recordings/
+      recording_20250101_120000/
+        seg_00000.mp4  seg_00000.json
+        seg_00001.mp4  seg_00001.json
+      clip_20250101_120512.avi          (single files are listed too)
+"""
+import json
+import os
+import re
+import threading
+
+from .config import CONFIG
+from .events import Job
+from .media import FfmpegSink
+from .supervisor import Supervisor
+
+
+SEGMENT_RE = re.compile(r"^seg_(\d+)\.mp4$")
+MEDIA_EXTENSIONS = (".mp4", ".avi", ".mkv")
+
+
+def sidecar_path(segment_path):
+    return os.path.splitext(segment_path)[0] + ".json"
+
+
+class RecordingCatalog:
+    """Recordings and their segments, kept in memory"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or CONFIG['media']['recordings']
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.entries = {}          # id -> entry dict (with its segment list)
+        self._listing = None       # cached listing, rebuilt after a change
+        self._load()
+
+    # ----------------------------
+    # Loading (once, at startup)
+    # ----------------------------
+    def _load(self):
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                segments = []
+                for seg_name in sorted(os.listdir(path)):
+                    if not SEGMENT_RE.match(seg_name):
+                        continue
+                    segment = self._read_sidecar(os.path.join(path, seg_name))
+                    if segment is not None:
+                        segments.append(segment)
+                if segments:
+                    self.entries[name] = self._entry(name, "segmented", segments)
+            elif name.endswith(MEDIA_EXTENSIONS) and not name.startswith("."):
+                self.add_file(path)
+
+    @staticmethod
+    def _read_sidecar(segment_path):
+        try:
+            with open(sidecar_path(segment_path)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+        # Segment closed without its sidecar (e.g. power loss): size and mtime only
+        try:
+            st = os.stat(segment_path)
+        except OSError:
+            return None
+        return {"file": os.path.basename(segment_path), "start": st.st_mtime, "duration": None,
+                "bytes": st.st_size, "keyframes": []}
+
+    @staticmethod
+    def _entry(rec_id, kind, segments, active=False):
+        return {"id": rec_id, "kind": kind, "segments": segments, "active": active}
+
+    # ----------------------------
+    # Incremental updates
+    # ----------------------------
+    def begin(self, rec_id):
+        with self.lock:
+            self.entries[rec_id] = self._entry(rec_id, "segmented", [], active=True)
+            self._listing = None
+
+    def add_segment(self, rec_id, segment):
+        with self.lock:
+            entry = self.entries.setdefault(rec_id, self._entry(rec_id, "segmented", []))
+            entry["segments"].append(segment)
+            self._listing = None
+
+    def end(self, rec_id):
+        with self.lock:
+            entry = self.entries.get(rec_id)
+            if entry is not None:
+                entry["active"] = False
+                if not entry["segments"]:
+                    del self.entries[rec_id]
+            self._listing = None
+
+    def add_file(self, path):
+        """List a single-file recording (clip, export, older monolithic MP4)"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        name = os.path.basename(path)
+        segment = {"file": name, "start": st.st_mtime, "duration": None, "bytes": st.st_size, "keyframes": []}
+        with self.lock:
+            self.entries[name] = self._entry(name, "file", [segment])
+            self._listing = None
+
+    def remove(self, rec_id):
+        with self.lock:
+            self.entries.pop(rec_id, None)
+            self._listing = None
+
+    # ----------------------------
+    # Queries
+    # ----------------------------
+    @staticmethod
+    def _summary(entry):
+        segments = entry["segments"]
+        durations = [s["duration"] for s in segments]
+        return {
+            "id": entry["id"],
+            "kind": entry["kind"],
+            "active": entry["active"],
+            "start": segments[0]["start"] if segments else None,
+            "duration": sum(durations) if durations and None not in durations else None,
+            "bytes": sum(s["bytes"] for s in segments),
+            "segments": len(segments),
+        }
+
+    def listing(self):
+        """Newest first; rebuilt only after the catalog changed"""
+        with self.lock:
+            if self._listing is None:
+                summaries = [self._summary(e) for e in self.entries.values()]
+                summaries.sort(key=lambda s: s["start"] or 0, reverse=True)
+                self._listing = summaries
+            return self._listing
+
+    def get(self, rec_id):
+        with self.lock:
+            entry = self.entries.get(rec_id)
+            if entry is None:
+                return None
+            return {**self._summary(entry), "segment_list": list(entry["segments"])}
+
+    def path(self, rec_id, segment=None):
+        """Absolute path of a recording file (or one segment of a segmented recording)"""
+        if rec_id != os.path.basename(rec_id) or rec_id.startswith("."):
+            raise ValueError("Invalid recording id")
+        if segment is None:
+            return os.path.join(self.directory, rec_id)
+        if segment != os.path.basename(segment):
+            raise ValueError("Invalid segment name")
+        return os.path.join(self.directory, rec_id, segment)
+
+    # ----------------------------
+    # Time-range export
+    # ----------------------------
+    def plan_export(self, rec_id, start=None, end=None):
+        """ffconcat script selecting [start, end) seconds of a segmented recording"""
+        entry = self.get(rec_id)
+        if entry is None:
+            raise KeyError(rec_id)
+        if entry["kind"] != "segmented":
+            raise ValueError("Only segmented recordings can be cut")
+        segments = [s for s in entry["segment_list"] if s["duration"]]
+        if not segments:
+            raise ValueError("Recording has no finished segments")
+
+        origin = segments[0]["start"]
+        start = max(0.0, float(start or 0.0))
+        end = float(end) if end is not None else None
+        lines = ["ffconcat version 1.0"]
+        duration = 0.0
+        for segment in segments:
+            seg_start = segment["start"] - origin
+            seg_end = seg_start + segment["duration"]
+            if seg_end <= start or (end is not None and seg_start >= end):
+                continue
+            lines.append(f"file '{self.path(rec_id, segment['file'])}'")
+            inpoint = 0.0
+            if start > seg_start:
+                # -c copy can only start cleanly on a keyframe: take the last one before start
+                offset = start - seg_start
+                inpoint = max((k for k in segment["keyframes"] if k <= offset), default=0.0)
+                lines.append(f"inpoint {inpoint:.3f}")
+            outpoint = segment["duration"]
+            if end is not None and end < seg_end:
+                outpoint = end - seg_start
+                lines.append(f"outpoint {outpoint:.3f}")
+            duration += outpoint - inpoint
+        if len(lines) == 1:
+            raise ValueError("Range outside the recording")
+        return "\n".join(lines) + "\n", duration
+
+    def export_range(self, rec_id, start=None, end=None):
+        """Cut [start, end) seconds into one MP4 in the background; returns the Job"""
+        script, duration = self.plan_export(rec_id, start, end)
+        job = Job("recording_export", total=1)
+        label = f"{int(start or 0)}-{int(end) if end is not None else 'end'}"
+        out = os.path.join(self.directory, f"{rec_id}_{label}.mp4")
+        threading.Thread(target=self._export, args=(job, script, out, duration),
+                         name=f"recording-export-{job.id}", daemon=True).start()
+        return job
+
+    def _export(self, job, script, out, duration):
+        list_path = os.path.join(self.directory, f".export_{job.id}.ffconcat")
+        with open(list_path, "w") as f:
+            f.write(script)
+        tmp = out + ".part"
+        child = Supervisor(f"ffmpeg-export-{job.id}", lambda: [
+            "ffmpeg", "-hide_banner", "-loglevel", "warning", "-nostdin", "-nostats", "-progress", "pipe:1",
+            "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy",
+            "-movflags", "+faststart", "-f", "mp4", "-y", tmp,
+        ], restart=False)
+        try:
+            child.start()
+            child.process.wait()
+            child.stop()
+        except OSError as e:
+            job.error(str(e))
+        finally:
+            os.remove(list_path)
+
+        if child.exit_code != 0 or not os.path.exists(tmp):
+            job.error(f"ffmpeg exited with {child.exit_code}: {' '.join(list(child.log)[-2:])}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            job.finish(state="failed")
+            return
+        os.replace(tmp, out)
+        self.add_file(out)
+        job.advance(bytes=os.path.getsize(out))
+        job.finish({"filename": os.path.basename(out), "duration": round(duration, 3),
+                    "bytes": os.path.getsize(out)})
+
+
+class SegmentedRecordingSink(FfmpegSink):
+    """Recording sink writing fixed-duration segments and their sidecars"""
+
+    def __init__(self, catalog, rec_id):
+        self.catalog = catalog
+        self.rec_id = rec_id
+        self.directory = catalog.path(rec_id)
+        os.makedirs(self.directory, exist_ok=True)
+        super().__init__("recording", [], os.path.join(self.directory, "seg_%05d.mp4"))
+        self.segment_s = CONFIG['media']['segment_s']
+        self.index_lock = threading.Lock()
+        self.run_origin = None     # wall-clock time of the first frame of the current ffmpeg run
+        self.keyframes = []        # wall-clock times of keyframes not yet assigned to a segment
+        self.list_path = None
+        self.list_offset = 0
+        self.watcher = None
+
+    def _next_number(self):
+        numbers = [int(m.group(1)) for m in map(SEGMENT_RE.match, os.listdir(self.directory)) if m]
+        return max(numbers) + 1 if numbers else 0
+
+    def command(self):
+        # A restart continues numbering, with a fresh segment list for the new run
+        self.collect()
+        number = self._next_number()
+        with self.index_lock:
+            self.run_origin = None
+            self.keyframes = []
+            self.list_path = os.path.join(self.directory, f".segments_{number:05d}.csv")
+            self.list_offset = 0
+        self.target = self.target_factory()
+        return ["ffmpeg", "-hide_banner", "-loglevel", "warning", "-nostdin", "-nostats",
+                "-progress", "pipe:1", "-use_wallclock_as_timestamps", "1",
+                "-f", "h264", "-i", "pipe:0", "-c:v", "copy",
+                "-f", "segment", "-segment_time", str(self.segment_s), "-reset_timestamps", "1",
+                "-segment_format", "mp4", "-segment_format_options", "movflags=+faststart",
+                "-segment_start_number", str(number),
+                "-segment_list", self.list_path, "-segment_list_type", "csv",
+                self.target]
+
+    def on_write(self, keyframe, at):
+        with self.index_lock:
+            if self.run_origin is None:
+                self.run_origin = at
+            if keyframe:
+                self.keyframes.append(at)
+
+    def start(self):
+        self.catalog.begin(self.rec_id)
+        super().start()
+        self.watcher = threading.Thread(target=self._watch, name="recording-index", daemon=True)
+        self.watcher.start()
+
+    def stop(self, timeout=10):
+        super().stop(timeout)
+        self.collect()
+        self.catalog.end(self.rec_id)
+
+    def _watch(self):
+        while not self.child.stopping.wait(1.0):
+            self.collect()
+
+    def collect(self):
+        """Index segments ffmpeg has closed since the last call (from its CSV segment list)"""
+        with self.index_lock:
+            if self.list_path is None:
+                return
+            try:
+                with open(self.list_path) as f:
+                    f.seek(self.list_offset)
+                    lines = f.read()
+            except FileNotFoundError:
+                return
+            complete = lines[:lines.rfind("\n") + 1]
+            self.list_offset += len(complete.encode())
+            origin = self.run_origin
+            for line in complete.splitlines():
+                parts = line.rsplit(",", 2)
+                if len(parts) != 3 or origin is None:
+                    continue
+                name, start, end = parts[0], float(parts[1]), float(parts[2])
+                seg_start = origin + start
+                keyframes = [round(k - seg_start, 3) for k in self.keyframes
+                             if seg_start - 0.001 <= k < origin + end]
+                self.keyframes = [k for k in self.keyframes if k >= origin + end]
+                self._index(name, seg_start, end - start, keyframes)
+
+    def _index(self, name, start, duration, keyframes):
+        path = os.path.join(self.directory, os.path.basename(name))
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        segment = {"file": os.path.basename(name), "start": round(start, 3), "duration": round(duration, 3),
+                   "bytes": size, "keyframes": keyframes}
+        tmp = sidecar_path(path) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(segment, f)
+        os.replace(tmp, sidecar_path(path))
+        self.catalog.add_segment(self.rec_id, segment)
@@ -0,0 +1,253 @@
+"""
+Content-addressed cache for scan analysis results
+
+Results are keyed by the hash of the input capture(s) plus the version of the
+analysis stage that produced them and of every stage it depends on. Changing
+the model version therefore only invalidates classification, while
+segmentation and derived images of the same captures are reused.
+
+Entries live in a byte-bounded in-memory LRU backed by a byte-bounded LRU
+directory on disk. Both hold pickled bytes, so every get() returns a fresh
+copy and callers may modify it freely.
+
+The scan analysis that would call get_or_compute() runs in the client
+today; in this process the cache is only opened and reported in
+/api/system/status.
+"""
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from .config import CONFIG
+
+
+# Stage -> stages whose output it consumes
+STAGE_DEPENDS = {
+    "segmentation": (),
+    "classification": ("segmentation",),
+    "derived": ("segmentation",),
+}
+
+# Bump a stage's version when its algorithm changes. Classification is
+# versioned by the loaded model at runtime (InferenceService.model_version).
+STAGE_VERSIONS = {
+    "segmentation": "1",
+    "classification": None,
+    "derived": "1",
+}
+
+_CHUNK = 1024 * 1024
+_DIGEST_MEMO_ENTRIES = 4096
+_TMP_MAX_AGE = 3600.0     # seconds before an unfinished .tmp write counts as orphaned
+
+
+# ----------------------------
+# Hashing
+# ----------------------------
+_digest_memo = OrderedDict()    # (path, size, mtime) -> digest, least recently used first
+_digest_lock = threading.Lock()
+
+
+def file_digest(path):
+    """SHA-256 of a capture file, memoized on (size, mtime) so re-opening is cheap"""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        digest = _digest_memo.get(memo_key)
+        if digest is not None:
+            _digest_memo.move_to_end(memo_key)
+            return digest
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digest_memo[memo_key] = digest
+        while len(_digest_memo) > _DIGEST_MEMO_ENTRIES:
+            _digest_memo.popitem(last=False)
+    return digest
+
+
+def inputs_digest(paths):
+    """Combined digest of several captures (order matters: one per channel)"""
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(file_digest(path).encode())
+    return h.hexdigest()
+
+
+def _stage_closure(stage):
+    seen = []
+    pending = [stage]
+    while pending:
+        s = pending.pop()
+        if s in seen:
+            continue
+        if s not in STAGE_DEPENDS:
+            raise KeyError(f"Unknown analysis stage '{s}'")
+        seen.append(s)
+        pending.extend(STAGE_DEPENDS[s])
+    return sorted(seen)
+
+
+def stage_key(stage, digest, versions=None):
+    """Cache key for one stage's output on the given inputs"""
+    merged = dict(STAGE_VERSIONS)
+    merged.update(versions or {})
+    h = hashlib.sha256(digest.encode())
+    for s in _stage_closure(stage):
+        if merged.get(s) is None:
+            raise ValueError(f"No version known for stage '{s}'")
+        h.update(f"|{s}={merged[s]}".encode())
+    return f"{stage}-{h.hexdigest()}"
+
+
+# ----------------------------
+# Cache
+# ----------------------------
+class ResultCache:
+    """Two-level (memory, disk) LRU of pickled analysis results"""
+
+    def __init__(self, directory=None, memory_bytes=None, disk_bytes=None):
+        cfg = CONFIG['cache']
+        self.directory = directory or cfg['dir']
+        self.memory_budget = memory_bytes if memory_bytes is not None else cfg['memory_mb'] * 1024 * 1024
+        self.disk_budget = disk_bytes if disk_bytes is not None else cfg['disk_mb'] * 1024 * 1024
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()   # key -> pickled value
+        self.memory_bytes = 0
+        self.disk = OrderedDict()     # key -> size, oldest access first
+        self.disk_bytes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_disk_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def _load_disk_index(self):
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                st = entry.stat()
+                entries.append((st.st_atime, entry.name[:-4], st.st_size))
+            elif entry.name.endswith(".tmp"):
+                # Left by a put() that died mid-write; recent ones may still be in flight
+                try:
+                    if now - entry.stat().st_mtime > _TMP_MAX_AGE:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_bytes += size
+        self._evict_disk()
+
+    def _remember(self, key, blob):
+        if len(blob) > self.memory_budget:
+            return
+        old = self.memory.pop(key, None)
+        if old is not None:
+            self.memory_bytes -= len(old)
+        self.memory[key] = blob
+        self.memory_bytes += len(blob)
+        while self.memory_bytes > self.memory_budget:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _evict_disk(self):
+        while self.disk_bytes > self.disk_budget and self.disk:
+            key, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key, default=None):
+        with self.lock:
+            hit = self.memory.get(key)
+            if hit is not None:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+            on_disk = key in self.disk
+        if hit is not None:
+            return pickle.loads(hit)
+
+        if not on_disk:
+            with self.lock:
+                self.stats["misses"] += 1
+            return default
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+            os.utime(path)
+            value = pickle.loads(blob)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            with self.lock:
+                size = self.disk.pop(key, None)
+                if size is not None:
+                    self.disk_bytes -= size
+                self.stats["misses"] += 1
+            return default
+
+        with self.lock:
+            if key in self.disk:
+                self.disk.move_to_end(key)
+            self._remember(key, blob)
+            self.stats["disk_hits"] += 1
+        return value
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+        with self.lock:
+            old = self.disk.pop(key, None)
+            if old is not None:
+                self.disk_bytes -= old
+            self.disk[key] = len(blob)
+            self.disk_bytes += len(blob)
+            self._remember(key, blob)
+            self._evict_disk()
+
+    def get_or_compute(self, stage, digest, compute, versions=None):
+        """Return a stage result for the inputs, computing and storing it on a miss"""
+        key = stage_key(stage, digest, versions)
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def status(self):
+        with self.lock:
+            return {
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "memory_budget": self.memory_budget,
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_bytes,
+                "disk_budget": self.disk_budget,
+                **self.stats,
+            }
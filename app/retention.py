@@ -0,0 +1,126 @@
+"""
+Background retention purge for scan history
+
+Expired scans are deleted oldest-first in small batches. Each batch is
+bounded in rows and wall time, the worker sleeps between batches, and it
+stops touching the disk whenever a scan is running.
+"""
+import shutil
+import threading
+import time
+
+from .config import CONFIG
+from .scan import scan_active, wait_idle
+
+
+RETENTION_KEY = "delete_period_days"
+ALLOWED_PERIODS = (0, 1, 7, 30)   # 0 = never delete
+
+
+class RetentionWorker:
+    """Thread that purges scans older than the configured delete period"""
+
+    def __init__(self, store, derivatives=None):
+        cfg = CONFIG['retention']
+        self.store = store
+        self.derivatives = derivatives
+        self.interval = cfg['interval']
+        self.batch_size = cfg['batch_size']
+        self.slice_s = cfg['slice_ms'] / 1000.0
+        self.pause_s = cfg['pause_ms'] / 1000.0
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.stats = {"deleted": 0, "freed_bytes": 0, "errors": 0, "last_run": None}
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run, name="retention-worker", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def period_days(self):
+        try:
+            return int(self.store.get_setting(RETENTION_KEY, 0))
+        except ValueError:
+            return 0
+
+    def set_period_days(self, days):
+        days = int(days)
+        if days not in ALLOWED_PERIODS:
+            raise ValueError(f"Delete period must be one of {ALLOWED_PERIODS}")
+        self.store.set_setting(RETENTION_KEY, days)
+        self.wake_event.set()  # apply a shorter period right away
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.purge()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Retention purge error: {e}")
+            self.wake_event.wait(self.interval)
+            self.wake_event.clear()
+
+    def purge(self):
+        """Delete all expired scans, one time-sliced batch at a time"""
+        days = self.period_days()
+        if days <= 0:
+            return 0
+
+        cutoff = time.time() - days * 86400
+        deleted = 0
+        after = None               # (created_at, id) of the last scan tried
+        while not self.stop_event.is_set():
+            if scan_active():
+                wait_idle()
+                continue
+
+            batch = self.store.expired_scans(cutoff, self.batch_size, after)
+            if not batch:
+                break
+
+            deadline = time.monotonic() + self.slice_s
+            for scan in batch:
+                if scan_active() or time.monotonic() > deadline:
+                    break
+                # Undeletable scans are stepped over and retried on the next run
+                after = (scan["created_at"], scan["id"])
+                if self.delete_scan(scan):
+                    deleted += 1
+                    self.stats["deleted"] += 1
+                    self.stats["freed_bytes"] += scan["bytes"]
+            time.sleep(self.pause_s)
+
+        self.stats["last_run"] = time.time()
+        return deleted
+
+    def delete_scan(self, scan):
+        """Remove a scan's files, then its row; False if either fails
+
+        Files first: if removal fails the row stays, so the storage counter
+        never drops for bytes still on disk.
+        """
+        if scan["folder"]:
+            try:
+                folder_path = self.store.folder_path(scan["folder"])
+                shutil.rmtree(folder_path)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                self.stats["errors"] += 1
+                print(f"Retention: cannot remove scan {scan['id']} files: {e}")
+                return False
+            if self.derivatives is not None:
+                self.derivatives.forget_folder(folder_path)
+        return self.store.delete_scan(scan["id"])
+
+    def status(self):
+        return {"period_days": self.period_days(), "running": self.thread is not None, **self.stats}
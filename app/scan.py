@@ -0,0 +1,42 @@
+"""
+Scan session state shared with background workers
+
+The retention purge and upload workers pause while a session is open. The
+capture sequence itself runs in the client, which stores the finished scan
+through POST /api/history, so nothing in this process enters scan_session()
+yet: until a server-side capture path does, scan_active() is always False
+and those pauses never trigger.
+"""
+import threading
+from contextlib import contextmanager
+
+
+_active = 0
+_active_lock = threading.Lock()
+_idle = threading.Event()
+_idle.set()
+
+
+@contextmanager
+def scan_session():
+    """Mark a scan as running; background jobs pause until it ends"""
+    global _active
+    with _active_lock:
+        _active += 1
+        _idle.clear()
+    try:
+        yield
+    finally:
+        with _active_lock:
+            _active -= 1
+            if _active == 0:
+                _idle.set()
+
+
+def scan_active():
+    return not _idle.is_set()
+
+
+def wait_idle(timeout=None):
+    """Block until no scan is running; returns False on timeout"""
+    return _idle.wait(timeout)
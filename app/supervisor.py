@@ -0,0 +1,230 @@
+"""
+Supervision of media child processes (ffmpeg)
+
+Every child's stdout and stderr are drained by dedicated threads, so a full
+pipe can never block it. ffmpeg is run with "-progress pipe:1", whose
+key=value blocks are parsed into live stats (fps, bitrate, speed, dropped
+frames). A child that exits without being asked to is restarted with
+exponential backoff. All supervised children are listed in a registry that
+feeds /api/system/status.
+"""
+import subprocess
+import threading
+import time
+from collections import deque
+
+
+RESTART_MIN = 1.0        # seconds before the first restart, doubled per failure
+RESTART_MAX = 60.0
+STABLE_AFTER = 30.0      # a run this long resets the backoff
+LOG_LINES = 20
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _number(value):
+    """'1234.5kbits/s', '1.02x', '29.9' -> float, None when not a number"""
+    value = value.strip().rstrip("x")
+    for suffix in ("kbits/s", "bits/s"):
+        if value.endswith(suffix):
+            value = value[:-len(suffix)]
+            break
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None   # absent or "N/A"
+
+
+class Supervisor:
+    """One supervised child process, restarted until stop() is called
+
+    command() is called for every (re)start and returns the argv, so it can
+    pick a fresh output name each time. on_start(process) runs after each
+    start, before the child is considered up.
+    """
+
+    def __init__(self, name, command, stdin=False, restart=True, on_start=None):
+        self.name = name
+        self.command = command
+        self.stdin = stdin
+        self.restart = restart
+        self.on_start = on_start
+        self.process = None
+        self.argv = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.monitor = None
+        self.run_started = None
+        self.restarts = 0
+        self.failures = 0          # consecutive short runs, drives the backoff
+        self.exit_code = None
+        self.progress = {}
+        self.log = deque(maxlen=LOG_LINES)
+
+    # ----------------------------
+    # Lifecycle
+    # ----------------------------
+    def start(self):
+        self.stopping.clear()
+        self._spawn()
+        self.monitor = threading.Thread(target=self._monitor, name=f"supervise-{self.name}", daemon=True)
+        self.monitor.start()
+        with _registry_lock:
+            _registry[self.name] = self
+
+    def _spawn(self):
+        argv = self.command()
+        process = subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE if self.stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        threading.Thread(target=self._drain_progress, args=(process.stdout,),
+                         name=f"{self.name}-stdout", daemon=True).start()
+        threading.Thread(target=self._drain_log, args=(process.stderr,),
+                         name=f"{self.name}-stderr", daemon=True).start()
+        with self.lock:
+            self.process = process
+            self.argv = argv
+            self.run_started = time.monotonic()
+            self.progress = {}
+            self.exit_code = None
+        if self.on_start is not None:
+            self.on_start(process)
+
+    def _monitor(self):
+        while True:
+            process = self.process
+            code = process.wait()
+            with self.lock:
+                self.exit_code = code
+            if self.stopping.is_set() or not self.restart:
+                return
+            self.log.append(f"exited with code {code}")
+            if time.monotonic() - self.run_started >= STABLE_AFTER:
+                self.failures = 0
+            delay = min(RESTART_MAX, RESTART_MIN * 2 ** self.failures)
+            self.failures += 1
+            if self.stopping.wait(delay):
+                return
+            try:
+                self._spawn()
+                self.restarts += 1
+            except OSError as e:
+                self.log.append(f"restart failed: {e}")
+                if self.stopping.wait(RESTART_MAX):
+                    return
+
+    def terminate(self):
+        """Ask the child to exit now, without restarting it
+
+        For a child stalled on its output: a writer blocked on its stdin
+        holds the pipe's lock, so stop() could not even close stdin.
+        """
+        self.stopping.set()
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+    def stop(self, timeout=10):
+        """Close stdin (so ffmpeg finalizes its output) and wait; escalate if it hangs"""
+        self.stopping.set()
+        process = self.process
+        if process is None:
+            return
+        if process.stdin is not None:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+        else:
+            process.terminate()
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.terminate()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.monitor is not None:
+            self.monitor.join(timeout=1)
+        if self.running:
+            # Restarted just as stop() was called
+            self.process.kill()
+        with _registry_lock:
+            if _registry.get(self.name) is self:
+                del _registry[self.name]
+
+    @property
+    def running(self):
+        process = self.process
+        return process is not None and process.poll() is None
+
+    # ----------------------------
+    # Output draining
+    # ----------------------------
+    def _drain_progress(self, pipe):
+        """Parse ffmpeg -progress blocks; each ends with a progress=... line"""
+        block = {}
+        for raw in iter(pipe.readline, b""):
+            key, _, value = raw.decode(errors="replace").strip().partition("=")
+            if not key:
+                continue
+            if key == "progress":
+                block["updated"] = time.time()
+                with self.lock:
+                    self.progress = block
+                block = {}
+            else:
+                block[key] = value
+        pipe.close()
+
+    def _drain_log(self, pipe):
+        for raw in iter(pipe.readline, b""):
+            line = raw.decode(errors="replace").rstrip()
+            if line:
+                self.log.append(line[:300])
+        pipe.close()
+
+    # ----------------------------
+    # Health
+    # ----------------------------
+    def status(self):
+        with self.lock:
+            progress = dict(self.progress)
+            exit_code = self.exit_code
+        updated = progress.get("updated")
+        return {
+            "name": self.name,
+            "running": self.running,
+            "pid": self.process.pid if self.process is not None else None,
+            "uptime_s": round(time.monotonic() - self.run_started, 1) if self.run_started else None,
+            "restarts": self.restarts,
+            "exit_code": exit_code,
+            "fps": _number(progress.get("fps", "")),
+            "bitrate_kbps": _number(progress.get("bitrate", "")),
+            "speed": _number(progress.get("speed", "")),
+            "frames": _int(progress.get("frame")),
+            "dropped_frames": _int(progress.get("drop_frames")),
+            "duplicated_frames": _int(progress.get("dup_frames")),
+            "output_bytes": _int(progress.get("total_size")),
+            "stalled_s": round(time.time() - updated, 1) if updated else None,
+            "log": list(self.log)[-5:],
+        }
+
+
+def supervised():
+    """Health of every supervised child, by name"""
+    with _registry_lock:
+        children = list(_registry.values())
+    return {child.name: child.status() for child in children}
@@ -0,0 +1,75 @@
+"""
+Per-frame span tracing for the preview pipeline
+
+Spans (lock wait, capture request, JPEG encode, hub publish, per-client
+send) are written into a fixed-size ring that is allocated when tracing is
+switched on and overwritten in place, oldest first. With tracing off, a
+call site costs one attribute check. /api/debug/trace dumps the ring as
+Chrome trace-event JSON (chrome://tracing, ui.perfetto.dev).
+"""
+import itertools
+import os
+import threading
+import time
+
+from .config import CONFIG
+
+
+class Tracer:
+    """Ring of (name, category, start, end, thread id, thread name, args) tuples"""
+
+    def __init__(self, size):
+        self.size = size
+        self.enabled = False
+        self.ring = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def enable(self, on=True):
+        with self.lock:
+            if on and not self.enabled:
+                self.ring = [None] * self.size
+                self.counter = itertools.count()
+            self.enabled = on
+
+    def add(self, name, start, end, args=None, category="frame"):
+        """Record a finished span; start and end are time.perf_counter() values"""
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        # next() on a count is atomic, so concurrent writers get distinct slots
+        self.ring[next(self.counter) % self.size] = (name, category, start, end,
+                                                     thread.ident, thread.name, args)
+
+    def spans(self, seconds=None):
+        """Recorded spans in start order, limited to those ending in the last seconds"""
+        ring = self.ring
+        since = time.perf_counter() - seconds if seconds else None
+        spans = [s for s in list(ring) if s is not None and (since is None or s[3] >= since)]
+        spans.sort(key=lambda s: s[2])
+        return spans
+
+    def chrome_trace(self, seconds=None):
+        """Spans as a Chrome trace-event document"""
+        events, threads = [], {}
+        pid = os.getpid()
+        for name, category, start, end, tid, thread_name, args in self.spans(seconds):
+            threads[tid] = thread_name
+            event = {"name": name, "cat": category, "ph": "X", "pid": pid, "tid": tid,
+                     "ts": round(start * 1e6, 1), "dur": round((end - start) * 1e6, 1)}
+            if args:
+                event["args"] = args
+            events.append(event)
+        for tid, thread_name in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": thread_name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def status(self):
+        recorded = sum(1 for s in list(self.ring) if s is not None)
+        return {"enabled": self.enabled, "size": self.size, "recorded": recorded}
+
+
+TRACE = Tracer(CONFIG['debug']['trace_spans'])
+if CONFIG['debug']['trace']:
+    TRACE.enable()
@@ -0,0 +1,389 @@
+"""
+Offline-first upload queue for "Send to Cloud"
+
+Uploads are journaled in SQLite before anything touches the network, so a
+crash or power cut only loses the chunk in flight. A fixed number of worker
+threads drain the journal, each over its own keep-alive HTTP connection:
+small files are packed into batch requests, large captures go up in
+resumable chunks. Failures back off exponentially with jitter. Enqueueing is
+a single insert, so the scan path never waits on the network.
+
+Server protocol (see tools/upload_server.py for a local stand-in):
+  POST /v1/batch            body: JSON manifest line, newline, concatenated files
+  POST /v1/uploads          {"key", "size"} -> {"upload_id"}
+  HEAD /v1/uploads/<id>     -> Upload-Offset header
+  PUT  /v1/uploads/<id>     Content-Range: bytes a-b/size -> {"offset"}
+"""
+import hashlib
+import http.client
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from .config import CONFIG
+from .scan import scan_active, wait_idle
+
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS uploads (
+        id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL,
+        key TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        offset INTEGER NOT NULL DEFAULT 0,
+        upload_id TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_uploads_ready ON uploads(state, next_attempt, id);
+"""
+
+
+class UploadError(Exception):
+    """Server rejected or failed a request; retryable unless permanent"""
+
+    def __init__(self, message, permanent=False, status=None):
+        super().__init__(message)
+        self.permanent = permanent
+        self.status = status
+
+
+class _Throughput:
+    """Bytes per second over a sliding window"""
+
+    def __init__(self, window=10.0):
+        self.window = window
+        self.samples = deque()
+        self.lock = threading.Lock()
+
+    def add(self, count):
+        now = time.monotonic()
+        with self.lock:
+            self.samples.append((now, count))
+            self._trim(now)
+
+    def _trim(self, now):
+        while self.samples and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+    def rate(self):
+        now = time.monotonic()
+        with self.lock:
+            self._trim(now)
+            return sum(c for _, c in self.samples) / self.window
+
+
+class UploadQueue:
+    """Journal plus worker threads that push it to the cloud endpoint"""
+
+    def __init__(self, path=None):
+        cfg = CONFIG['upload']
+        self.path = path or cfg['db']
+        self.url = cfg['url']
+        self.token = cfg['token']
+        self.workers = cfg['workers']
+        self.chunk = cfg['chunk_kb'] * 1024
+        self.small = cfg['small_kb'] * 1024
+        self.batch_bytes = cfg['batch_kb'] * 1024
+        self.batch_items = cfg['batch_items']
+        self.max_attempts = cfg['max_attempts']
+        self.backoff = (cfg['backoff_min'], cfg['backoff_max'])
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self.local = threading.local()
+        self.claim_lock = threading.Lock()
+        self.wake = threading.Condition()
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.throughput = _Throughput()
+        self.stats = {"uploaded": 0, "uploaded_bytes": 0, "retries": 0, "failed": 0}
+
+        conn = self.connection()
+        conn.executescript(SCHEMA)
+        # Work that was in flight when the process died is resumed from its offset
+        conn.execute("UPDATE uploads SET state = 'pending' WHERE state = 'active'")
+        # Journals written before finished rows were deleted still hold them
+        conn.execute("DELETE FROM uploads WHERE state = 'done'")
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    # ----------------------------
+    # Producer side
+    # ----------------------------
+    def enqueue(self, files):
+        """Journal (path, key) pairs for upload; returns the number queued"""
+        now = time.time()
+        rows = []
+        for path, key in files:
+            try:
+                rows.append((path, key, os.path.getsize(path), now))
+            except OSError:
+                continue
+        conn = self.connection()
+        conn.execute("BEGIN")
+        conn.executemany("INSERT INTO uploads (path, key, size, created_at) VALUES (?, ?, ?, ?)", rows)
+        conn.execute("COMMIT")
+        with self.wake:
+            self.wake.notify_all()
+        return len(rows)
+
+    def retry_failed(self):
+        cur = self.connection().execute(
+            "UPDATE uploads SET state = 'pending', attempts = 0, next_attempt = 0, upload_id = NULL, offset = 0 "
+            "WHERE state = 'failed'")
+        with self.wake:
+            self.wake.notify_all()
+        return cur.rowcount
+
+    def status(self):
+        conn = self.connection()
+        counts = {row["state"]: (row["n"], row["bytes"]) for row in conn.execute(
+            "SELECT state, COUNT(*) AS n, COALESCE(SUM(size - offset), 0) AS bytes FROM uploads "
+            "GROUP BY state")}
+        pending = counts.get("pending", (0, 0))
+        active = counts.get("active", (0, 0))
+        return {
+            "endpoint": self.url,
+            "depth": pending[0] + active[0],
+            "pending_bytes": pending[1] + active[1],
+            "active": active[0],
+            "failed": counts.get("failed", (0, 0))[0],
+            "bytes_per_s": self.throughput.rate(),
+            "workers": len(self.threads),
+            **self.stats,
+        }
+
+    # ----------------------------
+    # Workers
+    # ----------------------------
+    def start(self):
+        if not self.url or self.threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"upload-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        self.stop_event.set()
+        with self.wake:
+            self.wake.notify_all()
+        for t in self.threads:
+            t.join(timeout=5)
+        self.threads = []
+
+    def _claim(self):
+        """Mark the next ready work as active: one large file or a batch of small ones"""
+        conn = self.connection()
+        now = time.time()
+        with self.claim_lock:
+            rows = conn.execute(
+                "SELECT * FROM uploads WHERE state = 'pending' AND next_attempt <= ? ORDER BY id LIMIT ?",
+                (now, self.batch_items)).fetchall()
+            if not rows:
+                return []
+            if rows[0]["size"] > self.small:
+                claimed = [rows[0]]
+            else:
+                claimed, total = [], 0
+                for row in rows:
+                    if row["size"] > self.small or total + row["size"] > self.batch_bytes:
+                        break
+                    claimed.append(row)
+                    total += row["size"]
+            conn.executemany("UPDATE uploads SET state = 'active' WHERE id = ?", [(r["id"],) for r in claimed])
+        return claimed
+
+    def _next_ready_delay(self):
+        row = self.connection().execute(
+            "SELECT MIN(next_attempt) FROM uploads WHERE state = 'pending'").fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def _worker(self):
+        conn = None
+        while not self.stop_event.is_set():
+            if scan_active():
+                # Keep the network and SD card quiet while a scan runs
+                wait_idle(timeout=5)
+                continue
+
+            rows = []
+            try:
+                rows = self._claim()
+                if not rows:
+                    delay = self._next_ready_delay()
+                    with self.wake:
+                        self.wake.wait(timeout=min(delay, 30.0) if delay is not None else 30.0)
+                    continue
+
+                if conn is None:
+                    conn = self._connect()
+                if len(rows) == 1 and rows[0]["size"] > self.small:
+                    self._upload_chunked(conn, rows[0])
+                else:
+                    self._upload_batch(conn, rows)
+            except Exception as e:
+                # Network errors are expected; anything else (a bad server reply, a
+                # locked journal) must not end the thread or leave rows 'active'
+                if not isinstance(e, (OSError, http.client.HTTPException, UploadError)):
+                    print(f"Upload worker error: {type(e).__name__}: {e}")
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                self._recover(rows, e)
+
+        if conn is not None:
+            conn.close()
+
+    def _recover(self, rows, error):
+        """Back off the claimed rows after an error; pause if even the journal fails"""
+        if not rows:
+            self.stop_event.wait(1.0)
+            return
+        try:
+            self._failed(rows, error)
+        except sqlite3.Error as e:
+            print(f"Upload journal error: {e}")
+            self.stop_event.wait(1.0)
+            # Still 'active': hand them back so they are not stuck until restart
+            try:
+                self.connection().executemany("UPDATE uploads SET state = 'pending' WHERE id = ? AND state = 'active'",
+                                              [(r["id"],) for r in rows])
+            except sqlite3.Error:
+                pass
+
+    def _connect(self):
+        parts = urlsplit(self.url)
+        cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        return cls(parts.hostname, parts.port, timeout=CONFIG['upload']['timeout'])
+
+    def _request(self, conn, method, path, body=None, headers=None):
+        base = urlsplit(self.url).path.rstrip("/")
+        headers = dict(headers or {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        conn.request(method, base + path, body=body, headers=headers)
+        response = conn.getresponse()
+        data = response.read()  # always drain so the connection can be reused
+        if response.status >= 400:
+            permanent = 400 <= response.status < 500 and response.status not in (408, 409, 429)
+            raise UploadError(f"{method} {path}: HTTP {response.status}", permanent=permanent,
+                              status=response.status)
+        return response, data
+
+    def _upload_batch(self, conn, rows):
+        manifest, blobs, sent = [], [], []
+        for row in rows:
+            try:
+                with open(row["path"], "rb") as f:
+                    data = f.read()
+            except FileNotFoundError as e:
+                # Deleted locally (e.g. by retention) before it went out
+                self._failed([row], UploadError(str(e), permanent=True))
+                continue
+            manifest.append({"key": row["key"], "size": len(data), "sha256": hashlib.sha256(data).hexdigest()})
+            blobs.append(data)
+            sent.append(row)
+        if not sent:
+            return
+        rows[:] = sent  # on failure only the rows actually sent are retried
+        body = json.dumps(manifest).encode() + b"\n" + b"".join(blobs)
+        self._request(conn, "POST", "/v1/batch", body, {"Content-Type": "application/x-lancam-batch"})
+        self._done(rows, sum(len(b) for b in blobs))
+
+    def _upload_chunked(self, conn, row):
+        upload_id, offset = row["upload_id"], row["offset"]
+        if upload_id:
+            # Resume: the server is the authority on how much it already has
+            try:
+                response, _ = self._request(conn, "HEAD", f"/v1/uploads/{upload_id}")
+                offset = int(response.getheader("Upload-Offset", offset))
+            except UploadError as e:
+                if e.status != 404:
+                    raise
+                # The server forgot the upload (restart, expiry): start it again
+                upload_id = None
+        if not upload_id:
+            _, data = self._request(conn, "POST", "/v1/uploads",
+                                    json.dumps({"key": row["key"], "size": row["size"]}).encode(),
+                                    {"Content-Type": "application/json"})
+            upload_id, offset = json.loads(data)["upload_id"], 0
+            self.connection().execute("UPDATE uploads SET upload_id = ?, offset = 0 WHERE id = ?",
+                                      (upload_id, row["id"]))
+
+        size = row["size"]
+        try:
+            f = open(row["path"], "rb")
+        except FileNotFoundError as e:
+            raise UploadError(str(e), permanent=True)
+        with f:
+            f.seek(offset)
+            while offset < size and not self.stop_event.is_set():
+                chunk = f.read(min(self.chunk, size - offset))
+                if not chunk:
+                    raise UploadError(f"{row['path']} shrank while uploading", permanent=True)
+                end = offset + len(chunk) - 1
+                try:
+                    self._request(conn, "PUT", f"/v1/uploads/{upload_id}", chunk, {
+                        "Content-Type": "application/octet-stream",
+                        "Content-Range": f"bytes {offset}-{end}/{size}",
+                    })
+                except UploadError as e:
+                    if e.status != 404:
+                        raise
+                    # Forgotten mid-upload: the next attempt starts a new one
+                    self.connection().execute("UPDATE uploads SET upload_id = NULL, offset = 0 WHERE id = ?",
+                                              (row["id"],))
+                    raise UploadError(str(e))
+                offset = end + 1
+                self.throughput.add(len(chunk))
+                self.connection().execute("UPDATE uploads SET offset = ? WHERE id = ?", (offset, row["id"]))
+
+        if offset < size:
+            # Stopping: leave it pending, the offset is journaled
+            self.connection().execute("UPDATE uploads SET state = 'pending' WHERE id = ?", (row["id"],))
+            return
+        self._done([row], 0)
+
+    def _done(self, rows, counted_bytes):
+        # Nothing reads finished rows, so they leave the journal rather than grow it
+        self.connection().executemany("DELETE FROM uploads WHERE id = ?", [(r["id"],) for r in rows])
+        if counted_bytes:
+            self.throughput.add(counted_bytes)
+        self.stats["uploaded"] += len(rows)
+        self.stats["uploaded_bytes"] += sum(r["size"] for r in rows)
+
+    def _failed(self, rows, error):
+        lo, hi = self.backoff
+        conn = self.connection()
+        for row in rows:
+            attempts = row["attempts"] + 1
+            permanent = isinstance(error, UploadError) and error.permanent
+            if permanent or attempts >= self.max_attempts:
+                conn.execute("UPDATE uploads SET state = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                             (attempts, str(error), row["id"]))
+                self.stats["failed"] += 1
+                continue
+            delay = min(hi, lo * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+            conn.execute(
+                "UPDATE uploads SET state = 'pending', attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                (attempts, time.time() + delay, str(error), row["id"]))
+            self.stats["retries"] += 1
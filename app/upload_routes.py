@@ -0,0 +1,51 @@
+"""
+Send to Cloud endpoints
+"""
+from flask import Blueprint, request, jsonify
+from . import get_history, get_uploads
+from .export import scan_entries
+
+
+upload_bp = Blueprint("upload", __name__)
+
+MAX_UPLOAD = 5000
+
+
+def error_response(msg, code=400):
+    return jsonify({"success": False, "message": msg}), code
+
+
+@upload_bp.route("/api/upload", methods=["POST"])
+def queue_upload():
+    """Queue every file of the selected scans (lot or scan_ids); returns immediately"""
+    queue = get_uploads()
+    store = get_history()
+    if queue is None or store is None:
+        return error_response("Cloud upload not available", 503)
+
+    data = request.json or {}
+    try:
+        scans = store.select_scans(lot=data.get("lot"), scan_ids=data.get("scan_ids"), limit=MAX_UPLOAD)
+    except (TypeError, ValueError):
+        return error_response("scan_ids must be a list of integers")
+    if not scans:
+        return error_response("No scans selected")
+
+    queued = queue.enqueue((path, arcname) for _, path, arcname, _ in scan_entries(store, scans))
+    return jsonify({"success": True, "queued": queued, "data": queue.status()}), 202
+
+
+@upload_bp.route("/api/upload/status")
+def upload_status():
+    queue = get_uploads()
+    if queue is None:
+        return error_response("Cloud upload not available", 503)
+    return jsonify({"success": True, "data": queue.status()})
+
+
+@upload_bp.route("/api/upload/retry", methods=["POST"])
+def retry_uploads():
+    queue = get_uploads()
+    if queue is None:
+        return error_response("Cloud upload not available", 503)
+    return jsonify({"success": True, "requeued": queue.retry_failed()})
@@ -2,12 +2,12 @@
 Utility functions and helpers
 """
 import threading
-from picamera2 import Picamera2
+from .camera import open_camera
 
 
 def setup_camera():
     """Setup and configure the camera with default settings"""
-    picam2 = Picamera2()
+    picam2 = open_camera()
     sensorSize = picam2.sensor_resolution
     preview_config = picam2.create_preview_configuration(
         main={"size": (sensorSize[0] // 4, sensorSize[1] // 4)},
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of the frame hot path
+
+Each case times one piece of per-frame work on its own (array -> JPEG with
+every available encoder, colour conversions, multipart framing, metadata
+serialization, stacking and segmentation kernels) at realistic frame
+sizes. Input frames come from the synthetic camera, so JPEG sizes and
+timings are close to those of real trays rather than of random noise.
+Cases whose library is not installed are skipped.
+
+    python3 tools/bench.py --save bench/pi5.json             # record a baseline
+    python3 tools/bench.py --compare bench/pi5.json          # exit 1 on regressions
+    python3 tools/bench.py --filter 'jpeg|color' --sizes sensor3,1080p --json out.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SIZES = {
+    "sensor3": (1536, 864),     # preview: Camera Module 3 sensor / 3
+    "1080p": (1920, 1080),
+    "full": (4608, 2592),       # full sensor
+}
+QUALITY = 90
+
+CASES = []
+
+
+def case(name, *modules):
+    """Register a benchmark; setup(frames) returns the callable that is timed"""
+    def register(setup):
+        CASES.append((name, modules, setup))
+        return setup
+    return register
+
+
+class Frames:
+    """One frame of the synthetic camera in the layouts the pipeline handles"""
+
+    def __init__(self, size):
+        import numpy as np
+        from app.camera import SyntheticCamera
+
+        camera = SyntheticCamera()
+        lores = (size[0] // 4 // 2 * 2, size[1] // 4 // 2 * 2)
+        camera.configure(camera.create_preview_configuration(main={"size": size, "format": "XBGR8888"},
+                                                             lores={"size": lores, "format": "YUV420"}))
+        camera.start()
+        request = camera.capture_request()
+        self.size = size
+        self.xbgr = request.make_array("main")                  # what capture_array gives: B, G, R, X
+        self.bgr = np.ascontiguousarray(self.xbgr[..., :3])
+        self.rgb = np.ascontiguousarray(self.bgr[..., ::-1])
+        self.gray = np.ascontiguousarray(self.bgr[..., 1])
+        self.yuv = request.make_array("lores")
+        self.metadata = request.get_metadata()
+        request.release()
+        camera.stop()
+        buf = io.BytesIO()
+        from PIL import Image
+        Image.fromarray(self.rgb).save(buf, format="jpeg", quality=QUALITY)
+        self.jpeg = buf.getvalue()
+
+
+# ----------------------------
+# JPEG encoders
+# ----------------------------
+@case("jpeg.pil", "PIL")
+def _jpeg_pil(frames):
+    from PIL import Image
+
+    def run():
+        # What CompletedRequest.save(..., format="jpeg") does on picamera2
+        buf = io.BytesIO()
+        Image.fromarray(frames.rgb).save(buf, format="jpeg", quality=QUALITY)
+    return run
+
+
+@case("jpeg.cv2", "cv2")
+def _jpeg_cv2(frames):
+    import cv2
+    params = [cv2.IMWRITE_JPEG_QUALITY, QUALITY]
+    return lambda: cv2.imencode(".jpg", frames.bgr, params)
+
+
+@case("jpeg.simplejpeg", "simplejpeg")
+def _jpeg_simplejpeg(frames):
+    import simplejpeg
+    # picamera2's MJPEGEncoder path; takes the 4-channel array without a copy
+    return lambda: simplejpeg.encode_jpeg(frames.xbgr, quality=QUALITY, colorspace="BGRX",
+                                          colorsubsampling="420")
+
+
+@case("jpeg.turbojpeg", "turbojpeg")
+def _jpeg_turbojpeg(frames):
+    from turbojpeg import TurboJPEG
+    encoder = TurboJPEG()
+    return lambda: encoder.encode(frames.bgr, quality=QUALITY)
+
+
+@case("jpeg.decode_cv2", "cv2")
+def _jpeg_decode_cv2(frames):
+    import cv2
+    import numpy as np
+    data = np.frombuffer(frames.jpeg, dtype=np.uint8)
+    return lambda: cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+# ----------------------------
+# Colour conversions
+# ----------------------------
+@case("color.xbgr_to_rgb_numpy", "numpy")
+def _xbgr_rgb_numpy(frames):
+    import numpy as np
+    return lambda: np.ascontiguousarray(frames.xbgr[..., 2::-1])
+
+
+@case("color.xbgr_to_rgb_cv2", "cv2")
+def _xbgr_rgb_cv2(frames):
+    import cv2
+    return lambda: cv2.cvtColor(frames.xbgr, cv2.COLOR_BGRA2RGB)
+
+
+@case("color.bgr_to_gray_numpy", "numpy")
+def _gray_numpy(frames):
+    import numpy as np
+    weights = np.array([0.114, 0.587, 0.299], dtype=np.float32)
+    return lambda: (frames.bgr @ weights).astype(np.uint8)
+
+
+@case("color.bgr_to_gray_cv2", "cv2")
+def _gray_cv2(frames):
+    import cv2
+    return lambda: cv2.cvtColor(frames.bgr, cv2.COLOR_BGR2GRAY)
+
+
+@case("color.yuv420_to_rgb_cv2", "cv2")
+def _yuv_rgb_cv2(frames):
+    import cv2
+    # A YUV420 frame of the measured size; frames.yuv is only the quarter-size lores stream
+    yuv = cv2.cvtColor(frames.rgb, cv2.COLOR_RGB2YUV_I420)
+    return lambda: cv2.cvtColor(yuv, cv2.COLOR_YUV420p2RGB)
+
+
+# ----------------------------
+# Streaming
+# ----------------------------
+@case("multipart.concat", "flask")
+def _multipart_concat(frames):
+    from app.camera_routes import PART_HEADER
+    jpeg = frames.jpeg
+    timestamp = frames.metadata.get("SensorTimestamp") or 0
+    # As /stream builds each part, header formatting included
+    return lambda: PART_HEADER % (len(jpeg), timestamp, 1, time.time() * 1000.0) + jpeg + b"\r\n"
+
+
+@case("multipart.join", "flask")
+def _multipart_join(frames):
+    from app.camera_routes import PART_HEADER
+    jpeg = frames.jpeg
+    timestamp = frames.metadata.get("SensorTimestamp") or 0
+    return lambda: b"".join((PART_HEADER % (len(jpeg), timestamp, 1, time.time() * 1000.0), jpeg, b"\r\n"))
+
+
+@case("metadata.json")
+def _metadata_json(frames):
+    metadata = frames.metadata
+    return lambda: json.dumps(metadata, separators=(",", ":"))
+
+
+# ----------------------------
+# Analysis kernels
+# ----------------------------
+@case("stack.mean8", "numpy")
+def _stack_mean(frames):
+    import numpy as np
+    stack = [frames.bgr] * 8
+    acc = np.empty(frames.bgr.shape, dtype=np.uint16)
+
+    def run():
+        # Averaging exposures to cut sensor noise; uint16 holds 8 x 255
+        np.copyto(acc, stack[0])
+        for frame in stack[1:]:
+            np.add(acc, frame, out=acc, casting="unsafe")
+        return (acc >> 3).astype(np.uint8)
+    return run
+
+
+@case("stack.focus4", "cv2", "numpy")
+def _stack_focus(frames):
+    import cv2
+    import numpy as np
+    grays = [frames.gray] * 4
+    colours = [frames.bgr] * 4
+
+    def run():
+        # Focus stacking: per pixel, keep the frame with the strongest Laplacian
+        sharpness = np.stack([np.abs(cv2.Laplacian(g, cv2.CV_16S, ksize=3)) for g in grays])
+        best = sharpness.argmax(axis=0)
+        return np.take_along_axis(np.stack(colours), best[None, :, :, None], axis=0)[0]
+    return run
+
+
+@case("segment.otsu_contours", "cv2")
+def _segment(frames):
+    import cv2
+
+    def run():
+        # Stones against the tray: blur, Otsu threshold, outer contours, boxes
+        blurred = cv2.GaussianBlur(frames.gray, (5, 5), 0)
+        _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) > 64]
+    return run
+
+
+@case("inference.preprocess16", "cv2", "numpy")
+def _preprocess(frames):
+    import numpy as np
+    from app.inference import CHANNELS, _preprocess
+    from app.config import CONFIG
+    size = CONFIG['inference']['input_size']
+    crop = frames.bgr[:256, :256]
+    crops = [{channel: crop for channel in CHANNELS}] * 16
+    out = np.empty((16, 3 * len(CHANNELS), size, size), dtype=np.float32)
+    return lambda: _preprocess(crops, size, out)
+
+
+@case("analytics.exposure", "numpy")
+def _exposure(frames):
+    from app.analytics import ExposureAnalyzer, split_yuv420
+    size = (frames.yuv.shape[1], frames.yuv.shape[0] * 2 // 3)
+    analyzer = ExposureAnalyzer()
+    return lambda: analyzer.analyze(*split_yuv420(frames.yuv, size), frames.metadata)
+
+
+@case("analytics.peaking", "numpy")
+def _peaking(frames):
+    from app.analytics import FocusPeakingAnalyzer, split_yuv420
+    size = (frames.yuv.shape[1], frames.yuv.shape[0] * 2 // 3)
+    analyzer = FocusPeakingAnalyzer()
+    return lambda: analyzer.analyze(*split_yuv420(frames.yuv, size), frames.metadata)
+
+
+@case("calibration.apply", "numpy")
+def _calibration(frames):
+    import numpy as np
+    from app.calibration import CalibrationMaps
+    h, w = frames.rgb.shape[:2]
+    # Vignetting-like gain and a flat dark level; the real maps are memory-mapped
+    falloff = 1.0 + 0.5 * ((np.linspace(-1, 1, w)[None, :] ** 2 + np.linspace(-1, 1, h)[:, None] ** 2) / 2)
+    gain = np.repeat(falloff[..., None], 3, axis=2).astype(np.float32)
+    maps = CalibrationMaps("bench", gain, (-16.0 * gain).astype(np.float32), {})
+    out = np.empty(frames.rgb.shape, dtype=np.float32)
+    return lambda: maps.apply(frames.rgb, out)
+
+
+@case("derivatives.thumbnail", "cv2")
+def _thumbnail(frames):
+    from app.derivatives import _resize
+    return lambda: _resize(frames.bgr, 320)
+
+
+# ----------------------------
+# Runner
+# ----------------------------
+def available(modules):
+    for module in modules:
+        try:
+            __import__(module)
+        except ImportError:
+            return module
+    return None
+
+
+def measure(fn, min_time, min_runs):
+    fn()   # warm-up: first-call allocations and lazy imports
+    times = []
+    start = time.perf_counter()
+    while len(times) < min_runs or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    n = len(times)
+    return {
+        "runs": n,
+        "median_ms": round(times[n // 2] * 1000.0, 4),
+        "p90_ms": round(times[min(n - 1, int(n * 0.9))] * 1000.0, 4),
+        "min_ms": round(times[0] * 1000.0, 4),
+        "mean_ms": round(sum(times) / n * 1000.0, 4),
+    }
+
+
+def environment():
+    info = {"python": platform.python_version(), "machine": platform.machine(),
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    for module in ("numpy", "cv2", "PIL", "simplejpeg", "turbojpeg"):
+        try:
+            info[module] = getattr(__import__(module), "__version__", "?")
+        except ImportError:
+            pass
+    try:
+        info["git"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except (OSError, subprocess.TimeoutExpired):
+        pass
+    return info
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison table; returns the names that got slower than threshold"""
+    regressions = []
+    print(f"\n{'benchmark':48} {'baseline':>10} {'now':>10} {'change':>8}")
+    for key, result in results.items():
+        before = baseline.get("results", {}).get(key)
+        if not before:
+            print(f"{key:48} {'-':>10} {result['median_ms']:>10.3f}      new")
+            continue
+        change = result["median_ms"] / before["median_ms"] - 1.0 if before["median_ms"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  SLOWER"
+            regressions.append(key)
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{key:48} {before['median_ms']:>10.3f} {result['median_ms']:>10.3f} {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default=",".join(SIZES), help=f"comma separated: {', '.join(SIZES)}")
+    parser.add_argument("--filter", default="", help="regular expression on case names")
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds per case and size")
+    parser.add_argument("--min-runs", type=int, default=5)
+    parser.add_argument("--json", help="write results here")
+    parser.add_argument("--save", help="write results here as the new baseline")
+    parser.add_argument("--compare", help="baseline to compare against; exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.15, help="relative slowdown counted as regression")
+    parser.add_argument("--list", action="store_true", help="list cases and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, modules, _ in CASES:
+            missing = available(modules)
+            print(f"{name:32} {'(needs ' + missing + ')' if missing else ''}")
+        return 0
+
+    pattern = re.compile(args.filter)
+    results = {}
+    for size_name in args.sizes.split(","):
+        size = SIZES[size_name]
+        frames = Frames(size)
+        for name, modules, setup in CASES:
+            if not pattern.search(name):
+                continue
+            missing = available(modules)
+            if missing:
+                print(f"{name}@{size_name}: skipped, {missing} not installed")
+                continue
+            key = f"{name}@{size_name}"
+            result = measure(setup(frames), args.min_time, args.min_runs)
+            result["size"] = list(size)
+            results[key] = result
+            print(f"{key:48} {result['median_ms']:>10.3f} ms  (p90 {result['p90_ms']:.3f}, {result['runs']} runs)")
+
+    document = {"environment": environment(), "results": results}
+    for path in (args.json, args.save):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(document, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
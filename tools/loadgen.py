@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+End-to-end load generator: /stream viewers plus a control storm
+
+Opens N concurrent /stream consumers that parse the multipart parts and
+measure per-client frame rate, gaps between frames and frame age. At the
+same time it fires control requests the way Frontend/js/camera.js does:
+one request per slider "input" event, without waiting for the previous
+one, during drags separated by pauses. It reports p50/p99 latencies for
+frames and API calls; an API call is timed from the input event, so waiting
+for one of the six browser connections counts.
+
+By default it launches the app on the synthetic camera and stops it
+afterwards; --url targets a server that is already running. With --pattern
+the synthetic frames carry their capture time (LANCAM_TEST_PATTERN), which
+is decoded from the received JPEG: capture-to-client latency for CI.
+
+    python3 tools/loadgen.py --clients 20 --duration 30 --gain-hz 40
+    python3 tools/loadgen.py --url http://lancam.local:5000 --clients 5 --json load.json
+    python3 tools/loadgen.py --pattern --clients 4 --duration 20 --gain-hz 0
+"""
+import argparse
+import http.client
+import json
+import os
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BROWSER_CONNECTIONS = 6    # browsers allow this many concurrent requests per host
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def summary(values, scale=1000.0):
+    """p50/p99/max of seconds, in milliseconds"""
+    if not values:
+        return {"count": 0}
+    return {"count": len(values), "p50_ms": round(percentile(values, 50) * scale, 2),
+            "p99_ms": round(percentile(values, 99) * scale, 2), "max_ms": round(max(values) * scale, 2)}
+
+
+# ----------------------------
+# Server
+# ----------------------------
+def launch(port, data_dir, pattern=False):
+    """Start the app on the synthetic camera; returns the process once it answers"""
+    env = dict(os.environ, LANCAM_CAMERA="synthetic", LANCAM_DATA=data_dir,
+               LANCAM_TEST_PATTERN="1" if pattern else "0")
+    process = subprocess.Popen(
+        [sys.executable, "-c",
+         f"from app import create_app; create_app().run(host='127.0.0.1', port={port}, threaded=True)"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited: {process.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/api/camera/status")
+            if conn.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.3)
+    process.terminate()
+    raise RuntimeError("App did not come up within 60 s")
+
+
+# ----------------------------
+# Stream consumers
+# ----------------------------
+class StreamClient(threading.Thread):
+    """One /stream viewer parsing multipart parts as they arrive"""
+
+    def __init__(self, host, port, index, stop, same_host, pattern=False):
+        super().__init__(name=f"viewer-{index}", daemon=True)
+        self.host, self.port = host, port
+        self.stop_event = stop
+        self.same_host = same_host
+        self.pattern = pattern
+        self.reset()
+        self.error = None
+
+    def reset(self):
+        self.frames = 0
+        self.bytes = 0
+        self.gaps = []          # seconds between consecutive frames
+        self.ages = []          # receive time minus sensor timestamp (same host only)
+        self.send_ages = []     # receive time minus X-Send-Time
+        self.pattern_ages = []  # receive time minus the capture time stamped in the pixels
+        self.skipped = 0        # hub frames this client never received (X-Frame-Seq gaps)
+        self.last_seq = None
+        self.first = self.last = None
+
+    def run(self):
+        try:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            conn.request("GET", "/stream")
+            response = conn.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            while not self.stop_event.is_set():
+                headers, body = self._read_part(response)
+                if body is None:
+                    break
+                if headers.get("content-type") != "image/jpeg":
+                    continue
+                now = time.monotonic()
+                if self.last is not None:
+                    self.gaps.append(now - self.last)
+                self.first = self.first or now
+                self.last = now
+                self.frames += 1
+                self.bytes += len(body)
+                sensor = int(headers.get("x-sensor-timestamp", 0) or 0)
+                if sensor and self.same_host:
+                    # SensorTimestamp is on the monotonic clock of the server
+                    self.ages.append(time.monotonic_ns() / 1e9 - sensor / 1e9)
+                sent = float(headers.get("x-send-time", 0) or 0)
+                if sent and self.same_host:
+                    self.send_ages.append(time.time() - sent / 1000.0)
+                seq = int(headers.get("x-frame-seq", 0) or 0)
+                if seq and self.last_seq is not None and seq > self.last_seq + 1:
+                    self.skipped += seq - self.last_seq - 1
+                self.last_seq = seq or None
+                if self.pattern:
+                    self._read_pattern(body)
+            conn.close()
+        except (OSError, RuntimeError, http.client.HTTPException) as e:
+            if not self.stop_event.is_set():
+                self.error = str(e)
+
+    def _read_pattern(self, jpeg):
+        import io
+        import numpy as np
+        from PIL import Image
+        from app.camera import read_pattern
+
+        received_ms = time.time() * 1000.0
+        image = Image.open(io.BytesIO(jpeg))
+        size = image.size
+        # Decoding at 1/8 scale keeps the client from becoming the bottleneck
+        image.draft("RGB", (size[0] // 8, size[1] // 8))
+        decoded = read_pattern(np.asarray(image.convert("RGB")), size)
+        if decoded is not None:
+            age_ms = (int(received_ms) - decoded[1]) % 2 ** 32
+            if age_ms < 60000:
+                self.pattern_ages.append(age_ms / 1000.0)
+
+    @staticmethod
+    def _read_part(response):
+        line = response.readline()
+        while line in (b"\r\n", b"\n"):
+            line = response.readline()
+        if not line:
+            return None, None
+        if not line.startswith(b"--"):
+            raise RuntimeError(f"Expected a boundary, got {line[:40]!r}")
+        headers = {}
+        while True:
+            line = response.readline()
+            if not line:
+                return None, None
+            if line in (b"\r\n", b"\n"):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        length = headers.get("content-length")
+        if length is not None:
+            body = response.read(int(length))
+        else:
+            # Parts without a length (error messages) are a single line
+            body = response.readline()
+        return headers, body
+
+    def result(self):
+        span = (self.last - self.first) if self.first and self.last else 0
+        return {"frames": self.frames, "fps": round((self.frames - 1) / span, 2) if span > 0 else 0.0,
+                "mbit_s": round(self.bytes * 8 / span / 1e6, 2) if span > 0 else 0.0,
+                "gap": summary(self.gaps), "age": summary(self.ages), "pattern_age": summary(self.pattern_ages),
+                "skipped": self.skipped, "error": self.error}
+
+
+# ----------------------------
+# Control storm
+# ----------------------------
+class ControlStorm:
+    """Slider drags and clicks as camera.js sends them, fire-and-forget"""
+
+    def __init__(self, host, port, stop, args):
+        self.host, self.port = host, port
+        self.stop_event = stop
+        self.args = args
+        self.requests = queue.Queue()
+        self.latencies = {}     # endpoint -> [seconds]
+        self.errors = {}
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._sender, name=f"control-{i}", daemon=True)
+                        for i in range(BROWSER_CONNECTIONS)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        rates = [(self.args.gain_hz, self._gain), (self.args.focus_hz, self._focus),
+                 (self.args.zoom_hz, self._zoom), (self.args.af_hz, self._af)]
+        for rate, event in rates:
+            if rate > 0:
+                threading.Thread(target=self._drive, args=(rate, event), daemon=True).start()
+
+    def _drive(self, rate, event):
+        """Drag for drag_s at rate events/s, pause for pause_s, repeat"""
+        while not self.stop_event.is_set():
+            drag_end = time.monotonic() + self.args.drag_s
+            position = random.random()
+            while time.monotonic() < drag_end and not self.stop_event.is_set():
+                position = min(1.0, max(0.0, position + random.uniform(-0.05, 0.05)))
+                # Stamped when the page would call fetch(): waiting for a free
+                # connection is part of the latency the operator feels
+                self.requests.put(event(position) + (time.perf_counter(),))
+                self.stop_event.wait(1.0 / rate)
+            self.stop_event.wait(self.args.pause_s)
+
+    # Same paths and bodies as Frontend/js/camera.js
+    @staticmethod
+    def _gain(position):
+        return "set_gain", "/api/camera/set_gain", {"gain": round(1 + position * 15, 2)}
+
+    @staticmethod
+    def _focus(position):
+        return "set_focus", "/api/camera/set_focus", {"mode": "manual", "position": round(position * 10, 1)}
+
+    @staticmethod
+    def _zoom(position):
+        return "zoom", f"/api/camera/zoom?level={1 + round(position * 30) / 10}", None
+
+    @staticmethod
+    def _af(position):
+        return "trigger_af", "/api/camera/trigger_af", None
+
+    def _sender(self):
+        conn = None
+        while not self.stop_event.is_set():
+            try:
+                name, path, body, t0 = self.requests.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+                data = json.dumps(body).encode() if body is not None else b""
+                conn.request("POST", path, body=data, headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 400
+                if response.will_close:
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn = None
+            elapsed = time.perf_counter() - t0
+            if self.stop_event.is_set():
+                break   # the server may already be going down
+            with self.lock:
+                self.latencies.setdefault(name, []).append(elapsed)
+                if not ok:
+                    self.errors[name] = self.errors.get(name, 0) + 1
+
+    def result(self):
+        with self.lock:
+            return {name: dict(summary(values), errors=self.errors.get(name, 0),
+                               backlog=self.requests.qsize())
+                    for name, values in self.latencies.items()}
+
+
+# ----------------------------
+# Main
+# ----------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="running server; default launches the app on the synthetic camera")
+    parser.add_argument("--port", type=int, default=5055, help="port for the launched app")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds ignored at the start")
+    parser.add_argument("--gain-hz", type=float, default=30.0, help="gain slider input events per second")
+    parser.add_argument("--focus-hz", type=float, default=0.0)
+    parser.add_argument("--zoom-hz", type=float, default=0.0, help="mouse wheel ticks per second")
+    parser.add_argument("--af-hz", type=float, default=0.0, help="auto focus clicks per second")
+    parser.add_argument("--drag-s", type=float, default=2.0, help="length of one slider drag")
+    parser.add_argument("--pause-s", type=float, default=1.0, help="pause between drags")
+    parser.add_argument("--pattern", action="store_true",
+                        help="decode the test pattern for capture-to-client latency (needs NumPy and Pillow)")
+    parser.add_argument("--json", help="write the report here")
+    args = parser.parse_args()
+
+    process = None
+    data_dir = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        data_dir = tempfile.mkdtemp(prefix="lancam_load_")
+        host, port = "127.0.0.1", args.port
+        print(f"Launching the app on the synthetic camera at :{port} ...")
+        process = launch(port, data_dir, args.pattern)
+    same_host = host in ("127.0.0.1", "localhost", "::1")
+
+    stop = threading.Event()
+    try:
+        if args.pattern:
+            sys.path.insert(0, ROOT)
+        clients = [StreamClient(host, port, i, stop, same_host, args.pattern) for i in range(args.clients)]
+        for client in clients:
+            client.start()
+        time.sleep(args.warmup)
+        for client in clients:
+            # Measure the steady state only
+            client.reset()
+        storm = ControlStorm(host, port, stop, args)
+        storm.start()
+        print(f"{args.clients} viewers, gain {args.gain_hz}/s, focus {args.focus_hz}/s, "
+              f"zoom {args.zoom_hz}/s for {args.duration:.0f} s ...")
+        time.sleep(args.duration)
+    finally:
+        stop.set()
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        if data_dir is not None:
+            # The app has exited, so nothing writes here any more
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    viewers = [client.result() for client in clients]
+    fps = [v["fps"] for v in viewers]
+    report = {
+        "clients": args.clients,
+        "duration_s": args.duration,
+        "fps": {"mean": round(sum(fps) / len(fps), 2) if fps else 0, "min": min(fps, default=0),
+                "max": max(fps, default=0)},
+        "frame_gap": summary([g for client in clients for g in client.gaps]),
+        "frame_age": summary([a for client in clients for a in client.ages]),
+        "send_age": summary([a for client in clients for a in client.send_ages]),
+        "pattern_age": summary([a for client in clients for a in client.pattern_ages]),
+        "skipped_frames": sum(client.skipped for client in clients),
+        "api": storm.result(),
+        "viewer_errors": [v["error"] for v in viewers if v["error"]],
+        "viewers": viewers,
+    }
+
+    print(f"\nviewer fps     mean {report['fps']['mean']}  min {report['fps']['min']}  max {report['fps']['max']}")
+    print(f"skipped        {report['skipped_frames']} hub frames not delivered")
+    for label, key in (("frame gap", "frame_gap"), ("frame age", "frame_age"), ("since send", "send_age"),
+                       ("capture->recv", "pattern_age")):
+        s = report[key]
+        if s["count"]:
+            print(f"{label:14} p50 {s['p50_ms']} ms  p99 {s['p99_ms']} ms  max {s['max_ms']} ms")
+        else:
+            print(f"{label:14} n/a")
+    for name, s in sorted(report["api"].items()):
+        print(f"{name:14} p50 {s['p50_ms']} ms  p99 {s['p99_ms']} ms  ({s['count']} calls, {s['errors']} errors)")
+    if report["viewer_errors"]:
+        print(f"viewer errors: {report['viewer_errors']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=1)
+    return 1 if report["viewer_errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
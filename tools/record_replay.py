@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Record camera frames and metadata for the replay camera backend
+
+Run on the device (with the server stopped, as it owns the camera), then copy
+the directory to any machine and serve it from there:
+
+    python3 tools/record_replay.py /tmp/tray_replay --seconds 20 --width 1536 --height 864
+    LANCAM_CAMERA=replay LANCAM_REPLAY=/tmp/tray_replay python3 main.py
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.camera import open_camera, record_replay  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("directory")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--width", type=int, default=1536)
+    parser.add_argument("--height", type=int, default=864)
+    parser.add_argument("--backend", default="picamera2", help="camera backend to record from")
+    args = parser.parse_args()
+
+    camera = open_camera(args.backend)
+    camera.configure(camera.create_preview_configuration(main={"size": (args.width, args.height)},
+                                                         controls={"AfMode": 2}))
+    camera.start()
+    try:
+        count = record_replay(camera, args.directory, args.seconds)
+    finally:
+        camera.stop()
+    print(f"Recorded {count} frames to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
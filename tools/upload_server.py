@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the cloud upload endpoint
+
+Implements the protocol used by app/upload_queue.py and stores what it
+receives under a directory, so "Send to Cloud" can be exercised without a
+network. Options let it drop requests to test retries and resumption.
+
+    python3 tools/upload_server.py --port 8600 --dir /tmp/lancam_cloud --fail-rate 0.2
+    LANCAM_UPLOAD_URL=http://localhost:8600 python3 main.py
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+uploads = {}          # upload_id -> {"key", "size", "offset"}
+uploads_lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, so client connection reuse is visible
+    store_dir = "."
+    fail_rate = 0.0
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _reply(self, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _flaky(self):
+        if random.random() < self.fail_rate:
+            self._body()
+            self._reply(503, {"error": "injected failure"})
+            return True
+        return False
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.store_dir, key.lstrip("/")))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def do_POST(self):
+        if self._flaky():
+            return
+        if self.path.endswith("/v1/batch"):
+            body = self._body()
+            header, _, data = body.partition(b"\n")
+            pos = 0
+            for item in json.loads(header):
+                with open(self._path(item["key"]), "wb") as f:
+                    f.write(data[pos:pos + item["size"]])
+                pos += item["size"]
+            self.server.stats["batches"] += 1
+            return self._reply(200, {"stored": pos})
+        if self.path.endswith("/v1/uploads"):
+            meta = json.loads(self._body())
+            upload_id = uuid.uuid4().hex
+            with uploads_lock:
+                uploads[upload_id] = {"key": meta["key"], "size": meta["size"], "offset": 0}
+            open(self._path(meta["key"]) + ".part", "wb").close()
+            return self._reply(201, {"upload_id": upload_id})
+        self._reply(404, {"error": "not found"})
+
+    def do_HEAD(self):
+        upload = uploads.get(self.path.rsplit("/", 1)[-1])
+        if upload is None:
+            return self._reply(404)
+        self._reply(200, headers={"Upload-Offset": str(upload["offset"])})
+
+    def do_PUT(self):
+        if self._flaky():
+            return
+        upload = uploads.get(self.path.rsplit("/", 1)[-1])
+        if upload is None:
+            self._body()
+            return self._reply(404, {"error": "unknown upload"})
+        span, _, total = self.headers["Content-Range"].split(" ")[1].partition("/")
+        start, end = (int(v) for v in span.split("-"))
+        data = self._body()
+        if start != upload["offset"] or end - start + 1 != len(data):
+            return self._reply(409, {"error": "offset mismatch", "offset": upload["offset"]})
+        part = self._path(upload["key"]) + ".part"
+        with open(part, "r+b") as f:
+            f.seek(start)
+            f.write(data)
+        upload["offset"] = end + 1
+        self.server.stats["chunks"] += 1
+        if upload["offset"] == int(total):
+            os.replace(part, self._path(upload["key"]))
+        self._reply(200, {"offset": upload["offset"]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--dir", default="/tmp/lancam_cloud")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    Handler.store_dir = args.dir
+    Handler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer(("0.0.0.0", args.port), Handler)
+    server.verbose = args.verbose
+    server.stats = {"batches": 0, "chunks": 0}
+    print(f"Upload stand-in listening on :{args.port}, storing in {args.dir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nStats: {server.stats}")
+
+
+if __name__ == "__main__":
+    main()